@@ -0,0 +1,162 @@
+"""
+Admission control for expensive routes (/chat).
+
+Each gunicorn worker admits at most CHAT_MAX_CONCURRENT chats at a time.
+Up to CHAT_MAX_QUEUE more wait for a slot, each for at most
+CHAT_QUEUE_TIMEOUT seconds. Anything beyond that is shed at once with 503
+and a Retry-After estimated from recent chat durations, so a burst costs
+a fast refusal instead of piling up until gunicorn's timeout kills the
+worker and every request on it.
+
+Before that, a per-user token bucket (CHAT_RATE_LIMIT requests per minute,
+bursts of CHAT_RATE_BURST) answers 429 with Retry-After. Buckets live in
+the worker's memory, so with N workers a user can get up to N times the
+limit in the worst case; that bounds abuse without a database round trip.
+
+A waiting chat still holds one of the worker's WEB_THREADS gunicorn threads
+(gunicorn.conf.py reads the same variable). So the budget per worker is
+CHAT_MAX_CONCURRENT running chats, plus at most
+WEB_THREADS - CHAT_MAX_CONCURRENT - CHAT_RESERVED_THREADS waiting ones,
+capped by CHAT_MAX_QUEUE. The remaining CHAT_RESERVED_THREADS always stay
+free for every other route, and the next chat past the queue gets its 503
+instead of sitting in gunicorn's accept queue. A configuration that leaves
+no reserved thread is refused at startup.
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, ADMISSION_WAIT_SECONDS
+
+CHAT_MAX_CONCURRENT = int(os.getenv('CHAT_MAX_CONCURRENT', '2'))
+# Upper bound on waiting chats; the thread budget usually sets a lower one
+CHAT_MAX_QUEUE = int(os.getenv('CHAT_MAX_QUEUE', '4'))
+CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', '5'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+# Threads per worker that chats, running or waiting, may never take
+CHAT_RESERVED_THREADS = int(os.getenv('CHAT_RESERVED_THREADS', '1'))
+CHAT_RATE_LIMIT = float(os.getenv('CHAT_RATE_LIMIT', '20'))  # per user per minute, 0 disables
+CHAT_RATE_BURST = int(os.getenv('CHAT_RATE_BURST', '5'))
+# Users whose buckets are remembered; the least recently seen are forgotten first
+RATE_LIMIT_USERS = 10000
+MAX_RETRY_AFTER = 60
+
+
+class Rejected(Exception):
+    """A request turned away; status is 429 or 503 and retry_after is in whole seconds"""
+
+    def __init__(self, reason, status, retry_after, message):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.retry_after = max(1, min(MAX_RETRY_AFTER, int(math.ceil(retry_after))))
+        self.message = message
+
+
+class AdmissionController:
+    """
+    A concurrency limit with a bounded, deadline-limited wait queue, sized so
+    that running and waiting requests together leave `reserved` of the
+    worker's `threads` free. Raises ValueError when that is impossible.
+    """
+
+    def __init__(self, route, max_concurrent=CHAT_MAX_CONCURRENT, max_queue=CHAT_MAX_QUEUE,
+                 queue_timeout=CHAT_QUEUE_TIMEOUT, threads=WEB_THREADS, reserved=CHAT_RESERVED_THREADS):
+        self.route = route
+        self.max_concurrent = max(1, int(max_concurrent))
+        spare_threads = int(threads) - self.max_concurrent - max(0, int(reserved))
+        if spare_threads < 0:
+            raise ValueError(f"{route}: {self.max_concurrent} concurrent requests and {reserved} reserved "
+                             f"threads do not fit in {threads} threads per worker; raise WEB_THREADS or "
+                             f"lower CHAT_MAX_CONCURRENT")
+        self.max_queue = min(max(0, int(max_queue)), spare_threads)
+        self.queue_timeout = max(0.0, float(queue_timeout))
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long an admitted request holds its slot
+        self.average_seconds = None
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a request arriving now"""
+        average = self.average_seconds or self.queue_timeout or 1.0
+        return average * (self.waiting + 1) / self.max_concurrent
+
+    def _shed(self, reason):
+        ADMISSION_SHED.labels(route=self.route, reason=reason).inc()
+        raise Rejected(reason, 503, self.retry_after(), 'The service is busy, please try again shortly.')
+
+    def acquire(self):
+        """Take a slot, waiting up to queue_timeout in the queue; raises Rejected when shed"""
+        start = monotonic()
+        with self._condition:
+            if self.in_flight >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self._shed('queue_full')
+                self.waiting += 1
+                ADMISSION_QUEUE_DEPTH.labels(route=self.route).inc()
+                try:
+                    deadline = start + self.queue_timeout
+                    while self.in_flight >= self.max_concurrent:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            self._shed('queue_timeout')
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUE_DEPTH.labels(route=self.route).dec()
+            self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(route=self.route).inc()
+        ADMISSION_WAIT_SECONDS.labels(route=self.route).observe(monotonic() - start)
+
+    def release(self, held_seconds):
+        with self._condition:
+            self.in_flight -= 1
+            self.average_seconds = (held_seconds if self.average_seconds is None
+                                    else 0.8 * self.average_seconds + 0.2 * held_seconds)
+            self._condition.notify()
+        ADMISSION_IN_FLIGHT.labels(route=self.route).dec()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.release(monotonic() - start)
+
+
+class RateLimiter:
+    """Per-key token buckets: `rate` requests per minute with bursts of `burst`"""
+
+    def __init__(self, route, rate=CHAT_RATE_LIMIT, burst=CHAT_RATE_BURST, max_keys=RATE_LIMIT_USERS):
+        self.route = route
+        self.per_second = rate / 60.0
+        self.burst = max(1, int(burst))
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Spend a token for key; raises Rejected (429) when its bucket is empty"""
+        if self.per_second <= 0:
+            return
+        now = monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            ADMISSION_SHED.labels(route=self.route, reason='rate_limited').inc()
+            raise Rejected('rate_limited', 429, (1 - tokens) / self.per_second,
+                           'You are sending messages too quickly, please wait a moment.')
@@ -0,0 +1,413 @@
+"""
+Real-time excursion alerting for sensor readings.
+
+Every batch written by /sensor-readings is handed to the AlertPipeline along
+with the compliance verdict of each point (see compliance_rules.py). A
+background thread feeds the points, oldest first, through an
+ExcursionDetector that keeps a small state machine per (device, parameter):
+
+    ok --(ALERT_TRIGGER_COUNT consecutive out-of-range points)--> excursion
+    excursion --(ALERT_CLEAR_COUNT consecutive in-range points)--> ok
+
+so a value flapping around a limit raises one alert rather than one per
+reading. Each transition is an alert event, recorded in an alert store and
+then passed to every notifier. Notifiers are pluggable: LogNotifier writes
+to the log and MemoryNotifier keeps events in a list for tests and local runs.
+
+MongoAlertStore shares everything between workers and restarts: debounce
+state lives in ALERT_STATE_COLLECTION (one document per device and
+parameter, updated with a revision check so two workers cannot both apply a
+transition), and events go to the capped ALERT_COLLECTION with an ObjectId
+_id made when they are recorded. MemoryAlertStore keeps the same data in the
+process, for tests and when no database is configured.
+
+Dashboards short-poll GET /temperature-alerts?since=<the previous response's
+"now"> rather than holding a streaming response, so alerts cost no request
+thread between polls. An event recorded just before a poll may commit just
+after it, and workers' clocks differ slightly, so since() looks back
+ALERT_POLL_OVERLAP further than asked and the page skips what it has already
+applied.
+"""
+
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ALERT_TRIGGER_COUNT = int(os.getenv('ALERT_TRIGGER_COUNT', '3'))
+ALERT_CLEAR_COUNT = int(os.getenv('ALERT_CLEAR_COUNT', '3'))
+# Older points (backfills, logger catch-up) update state but never alert
+ALERT_MAX_AGE = timedelta(minutes=int(os.getenv('ALERT_MAX_AGE_MINUTES', '15')))
+ALERT_COLLECTION = 'temperature_alerts'
+ALERT_STATE_COLLECTION = 'alert_states'
+# Size of the capped alert collection, which is also how far back a poll can reach
+ALERT_COLLECTION_BYTES = 4 * 1024 * 1024
+ALERT_COLLECTION_MAX = 10000
+# Events kept by MemoryAlertStore
+ALERT_HISTORY_SIZE = 200
+# Attempts at a debounce state update that races another worker
+ALERT_STATE_RETRIES = 5
+# How much further back than `since` a poll looks, for late commits and clock skew
+ALERT_POLL_OVERLAP = timedelta(seconds=30)
+# Most events one poll returns; the newest are kept when there are more
+ALERT_POLL_LIMIT = 200
+
+
+def _utc(value):
+    """MongoDB returns naive UTC datetimes; compare them with aware ones"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class Notifier:
+    """Receives alert events; subclasses decide where they go"""
+
+    def notify(self, event):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LogNotifier(Notifier):
+    def notify(self, event):
+        if event['type'] == 'excursion':
+            logger.warning(f"⚠️ Excursion on {event['device_id']} {event['parameter']}: "
+                           f"{event['value']} outside {event['range']} since {event['since']}")
+        else:
+            logger.info(f"✅ {event['device_id']} {event['parameter']} back in range at {event['timestamp']}")
+
+
+class MemoryNotifier(Notifier):
+    """Test stub: remembers every event it is given"""
+
+    def __init__(self):
+        self.events = []
+        self._received = threading.Condition()
+
+    def notify(self, event):
+        with self._received:
+            self.events.append(event)
+            self._received.notify_all()
+
+    def wait_for(self, count, timeout=5.0):
+        """Block until at least `count` events have arrived; returns whether they did"""
+        with self._received:
+            return self._received.wait_for(lambda: len(self.events) >= count, timeout)
+
+
+class MemoryAlertStore:
+    """Debounce state and recent events for this process only"""
+
+    def __init__(self, history_size=ALERT_HISTORY_SIZE):
+        # (ObjectId, event) in the order events were recorded
+        self.history = deque(maxlen=history_size)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def state(self, device_id, parameter):
+        with self._lock:
+            return self._states.get((device_id, parameter))
+
+    def transition(self, device_id, parameter, update):
+        """Run update(state) on the (device, parameter) state and keep the result; returns its events"""
+        with self._lock:
+            state = dict(self._states.get((device_id, parameter)) or ExcursionDetector.initial_state())
+            events = update(state)
+            self._states[(device_id, parameter)] = state
+            return events
+
+    def record(self, events):
+        """Give events their ids and keep them for polling"""
+        with self._lock:
+            for event in events:
+                object_id = ObjectId()
+                event['id'] = str(object_id)
+                self.history.append((object_id, event))
+        return events
+
+    def recent(self, limit=50):
+        with self._lock:
+            return [event for _, event in list(self.history)[-limit:]]
+
+    def since(self, since, limit=ALERT_POLL_LIMIT):
+        """Events recorded from ALERT_POLL_OVERLAP before `since` on, oldest first"""
+        cutoff = since - ALERT_POLL_OVERLAP
+        with self._lock:
+            return [event for object_id, event in self.history if object_id.generation_time >= cutoff][-limit:]
+
+
+class MongoAlertStore:
+    """Debounce state and events in MongoDB, shared by every worker"""
+
+    def __init__(self, db):
+        self.db = db
+        self.states = db[ALERT_STATE_COLLECTION]
+        self.events = db[ALERT_COLLECTION]
+
+    def state(self, device_id, parameter):
+        document = self.states.find_one({'_id': {'device_id': device_id, 'parameter': parameter}})
+        return self._load(document) if document else None
+
+    @staticmethod
+    def _load(document):
+        state = {key: document[key] for key in ('status', 'out', 'in', 'since', 'last_timestamp')}
+        state['since'] = _utc(state['since'])
+        state['last_timestamp'] = _utc(state['last_timestamp'])
+        return state
+
+    def transition(self, device_id, parameter, update):
+        """
+        Run update(state) on the stored (device, parameter) state and save it
+        if no other worker changed it meanwhile, retrying from the new state
+        otherwise. Returns the events of the update that was saved.
+        """
+        key = {'device_id': device_id, 'parameter': parameter}
+        for _ in range(ALERT_STATE_RETRIES):
+            document = self.states.find_one({'_id': key})
+            state = self._load(document) if document else ExcursionDetector.initial_state()
+            events = update(state)
+            try:
+                if document is None:
+                    self.states.insert_one({'_id': key, 'revision': 1, **state})
+                    return events
+                result = self.states.update_one(
+                    {'_id': key, 'revision': document['revision']},
+                    {'$set': state, '$inc': {'revision': 1}}
+                )
+                if result.matched_count:
+                    return events
+            except DuplicateKeyError:
+                pass
+        logger.error(f"Alert state for {device_id} {parameter} kept changing; skipped a batch of its readings")
+        return []
+
+    def record(self, events):
+        """Give events ObjectId ids and append them to the capped collection"""
+        if not events:
+            return events
+        documents = []
+        for event in events:
+            object_id = ObjectId()
+            documents.append({'_id': object_id, **event})
+            event['id'] = str(object_id)
+        self.events.insert_many(documents)
+        return events
+
+    @staticmethod
+    def _event(document):
+        document['id'] = str(document.pop('_id'))
+        return document
+
+    def recent(self, limit=50):
+        documents = list(self.events.find().sort('_id', -1).limit(limit))
+        return [self._event(document) for document in reversed(documents)]
+
+    def since(self, since, limit=ALERT_POLL_LIMIT):
+        """Events recorded from ALERT_POLL_OVERLAP before `since` on, oldest first"""
+        cursor = self.events.find({'_id': {'$gte': ObjectId.from_datetime(since - ALERT_POLL_OVERLAP)}})
+        documents = list(cursor.sort('_id', -1).limit(limit))
+        return [self._event(document) for document in reversed(documents)]
+
+
+def create_alert_collection(db):
+    """Create the capped collection alert events are appended to and polled from"""
+    db.create_collection(ALERT_COLLECTION, capped=True, size=ALERT_COLLECTION_BYTES, max=ALERT_COLLECTION_MAX)
+    logger.info(f"Created {ALERT_COLLECTION} capped collection")
+
+
+class ExcursionDetector:
+    """The debounced in/out-of-range state machine; states are kept by an alert store"""
+
+    def __init__(self, trigger_count=ALERT_TRIGGER_COUNT, clear_count=ALERT_CLEAR_COUNT, max_age=ALERT_MAX_AGE):
+        self.trigger_count = max(1, trigger_count)
+        self.clear_count = max(1, clear_count)
+        self.max_age = max_age
+
+    @staticmethod
+    def initial_state():
+        return {'status': 'ok', 'out': 0, 'in': 0, 'since': None, 'last_timestamp': None}
+
+    def observe(self, state, device_id, parameter, timestamp, value, in_range, bounds=None, now=None):
+        """Feed one point into state (updated in place); returns an alert event on a state change, else None"""
+        if state['last_timestamp'] is not None and timestamp <= state['last_timestamp']:
+            return None
+        state['last_timestamp'] = timestamp
+
+        if in_range:
+            state['in'] += 1
+            state['out'] = 0
+        else:
+            if state['out'] == 0:
+                state['since'] = timestamp
+            state['out'] += 1
+            state['in'] = 0
+
+        new_status = state['status']
+        if state['status'] == 'ok' and state['out'] >= self.trigger_count:
+            new_status = 'excursion'
+        elif state['status'] == 'excursion' and state['in'] >= self.clear_count:
+            new_status = 'ok'
+        if new_status == state['status']:
+            return None
+        state['status'] = new_status
+
+        now = now or datetime.now(timezone.utc)
+        if now - timestamp > self.max_age:
+            return None
+        return {
+            'type': 'excursion' if new_status == 'excursion' else 'cleared',
+            'device_id': device_id,
+            'parameter': parameter,
+            'value': value,
+            'range': [bound if math.isfinite(bound) else None for bound in bounds] if bounds else None,
+            'since': state['since'].isoformat() if state['since'] else None,
+            'timestamp': timestamp.isoformat(),
+        }
+
+
+class AlertPipeline:
+    """Evaluate ingested batches off the request thread and dispatch alert events"""
+
+    def __init__(self, notifiers, store=None, detector=None, max_queue_size=1000):
+        self.notifiers = list(notifiers)
+        self.store = store or MemoryAlertStore()
+        self.detector = detector or ExcursionDetector()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stats = {'batches': 0, 'points': 0, 'alerts': 0, 'dropped_batches': 0}
+
+    def submit(self, documents, in_range, rules=None):
+        """
+        Queue a batch of stored sensor_readings documents with their
+        per-point compliance verdicts. Never blocks the caller.
+        """
+        if not len(documents):
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((documents, in_range, rules))
+        except queue.Full:
+            self.stats['dropped_batches'] += 1
+            logger.error("Alert queue full, dropping a batch of sensor readings from alerting")
+
+    def process(self, documents, in_range, rules=None, now=None):
+        """Run one batch through the detector and the store synchronously; returns the events"""
+        # Points per (device, parameter), oldest first, so each state is loaded and saved once
+        series = {}
+        for index in sorted(range(len(documents)), key=lambda index: documents[index]['timestamp']):
+            meta = documents[index]['meta']
+            series.setdefault((meta['device_id'], meta['parameter']), []).append(index)
+
+        events = []
+        for (device_id, parameter), indexes in series.items():
+            bounds = rules.range_for(parameter, device_id) if rules else None
+
+            def update(state, indexes=indexes, device_id=device_id, parameter=parameter, bounds=bounds):
+                changes = []
+                for index in indexes:
+                    doc = documents[index]
+                    event = self.detector.observe(state, device_id, parameter, doc['timestamp'], doc['value'],
+                                                  bool(in_range[index]), bounds=bounds, now=now)
+                    if event:
+                        changes.append(event)
+                return changes
+
+            events.extend(self.store.transition(device_id, parameter, update))
+        self.store.record(events)
+
+        self.stats['batches'] += 1
+        self.stats['points'] += len(documents)
+        for event in events:
+            self.stats['alerts'] += 1
+            for notifier in self.notifiers:
+                try:
+                    notifier.notify(event)
+                except Exception as e:
+                    logger.error(f"Alert notifier {type(notifier).__name__} failed: {str(e)}")
+        return events
+
+    def flush(self):
+        while True:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.process(*batch)
+
+    def close(self):
+        try:
+            self._queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        for notifier in self.notifiers:
+            notifier.close()
+
+    def find_notifier(self, notifier_type):
+        for notifier in self.notifiers:
+            if isinstance(notifier, notifier_type):
+                return notifier
+        return None
+
+    def _ensure_started(self):
+        # Started lazily so the thread belongs to the gunicorn worker
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='excursion-alerts', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            try:
+                self.process(*batch)
+            except Exception as e:
+                logger.error(f"Error processing sensor batch for alerts: {str(e)}")
+
+
+NOTIFIERS = {
+    'log': LogNotifier,
+    'memory': MemoryNotifier,
+}
+
+
+def create_alert_pipeline(db=None):
+    """
+    Build the pipeline from ALERT_NOTIFIERS (comma separated, default 'log'),
+    storing alerts in db when one is given and in memory otherwise.
+    """
+    names = [name.strip() for name in os.getenv('ALERT_NOTIFIERS', 'log').split(',') if name.strip()]
+    notifiers = []
+    for name in names:
+        if name == 'sse':
+            # Dashboards poll the alert store; accepted for older configurations
+            continue
+        if name not in NOTIFIERS:
+            logger.error(f"Unknown alert notifier '{name}', skipping")
+            continue
+        notifiers.append(NOTIFIERS[name]())
+    store = MongoAlertStore(db) if db is not None else MemoryAlertStore()
+    pipeline = AlertPipeline(notifiers, store)
+    atexit.register(pipeline.close)
+    return pipeline
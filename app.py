@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
-from datetime import datetime
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
+from datetime import datetime, timedelta, timezone
 import os
+import hmac
+import re
+import uuid
 from dotenv import load_dotenv
 import anthropic
 import openai
@@ -8,16 +11,35 @@ from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 from anthropic import HUMAN_PROMPT, AI_PROMPT
 import logging
 import psutil
-from time import time
+from time import time, monotonic
 from authlib.integrations.flask_client import OAuth
 from urllib.parse import urlencode
 from functools import wraps
+from itertools import chain
+from db_indexes import reconcile_indexes, index_report
+from conversations import load_conversation, build_context, record_turn, new_thread_id
+from temperature import (month_range, validate_range, get_records_in_range, range_compliance,
+                         monthly_compliance, update_rollup, rebuild_rollups, validate_reading,
+                         save_reading, save_readings, MAX_BATCH_RECORDS, PARAMETERS)
+from temperature_export import EXPORT_FORMATS, available_formats, open_export_cursor, export_stream
+from http_cache import ResponseCache, conditional_json
+from alerts import create_alert_pipeline
+from metrics import HTTP_REQUEST_SECONDS, LLM_REQUEST_SECONDS, render_metrics, timed
+from tracing import tracer, span, traced
+from logging_setup import configure_logging, bind_request, unbind_request, log_event
+from memprof import profiler as memory_profiler
+from db_stats import CachedStat, DatabaseDiagnostics
+from admission import AdmissionController, RateLimiter, Rejected
+from cpuprof import CPU_PROFILE_HZ, start_profile, profile_status, profile_path
+from compliance_rules import get_active_rules, publish_rules, list_rule_versions, reevaluate_records
+from sensors import (MAX_INGEST_POINTS, validate_points, ingest_points, create_daily_deriver, parse_timestamp,
+                     downsample_series, SERIES_MODES, DEFAULT_SERIES_POINTS, MAX_SERIES_POINTS, MAX_SERIES_DAYS)
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging first
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure logging first: JSON lines through a non-blocking queue (see logging_setup.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize app before loading other modules
@@ -81,9 +103,9 @@ except Exception as e:
 # Import database functions after app is initialized, with error handling
 try:
     from database import (
-        save_chat, get_user_chats, client as db_client, get_chat_by_id, 
+        save_chat, get_user_chats, client as db_client, get_chat_by_id, chat_compression_stats,
         insert_document_with_embedding, semantic_search, setup_vector_search,
-        initialize_database_structure, seed_database_if_empty, db, chats, vector_embeddings
+        initialize_database_structure, seed_database_if_empty, db, chats, vector_embeddings, conversations
     )
     
     # Log database connection status in detail
@@ -94,19 +116,18 @@ try:
             db_client.admin.command('ping')
             logger.info("✅ MongoDB server ping successful")
             
-            # Log database details
-            collections = db.list_collection_names() if db else []
-            logger.info(f"MongoDB database: {db.name if db else 'None'}")
+            # Log database details (pymongo Database objects cannot be tested for truth)
+            collections = db.list_collection_names() if db is not None else []
+            logger.info(f"MongoDB database: {db.name if db is not None else 'None'}")
             logger.info(f"Available collections: {collections}")
             
-            # Log collection counts
-            if db and collections:
-                for collection_name in collections:
-                    try:
-                        count = db[collection_name].count_documents({})
-                        logger.info(f"Collection '{collection_name}' has {count} documents")
-                    except Exception as count_error:
-                        logger.error(f"Error counting documents in {collection_name}: {str(count_error)}")
+            # Log collection counts from metadata; count_documents would scan every collection
+            for collection_name in collections:
+                try:
+                    count = db[collection_name].estimated_document_count()
+                    logger.info(f"Collection '{collection_name}' has ~{count} documents")
+                except Exception as count_error:
+                    logger.error(f"Error counting documents in {collection_name}: {str(count_error)}")
             
             # Initialize database structure if needed
             if initialize_database_structure and db_client:
@@ -134,18 +155,22 @@ except Exception as e:
     logger.error(f"Error importing database functions: {str(e)}")
     logger.error("Using dummy database functions to prevent crashes")
     # Create fallback dummy functions to prevent crashes
-    def save_chat(user_id, user_message, bot_response):
+    def save_chat(user_id, user_message, bot_response, thread_id=None, turn=None):
         logger.error("Using dummy save_chat function due to database import failure")
         return None
     
-    def get_user_chats(user_id):
+    def get_user_chats(user_id, limit=20, cursor=None):
         logger.error("Using dummy get_user_chats function due to database import failure")
-        return []
+        return [], None
     
-    def get_chat_by_id(chat_id):
+    def get_chat_by_id(chat_id, user_id=None):
         logger.error("Using dummy get_chat_by_id function due to database import failure")
         return None
     
+    def chat_compression_stats():
+        logger.error("Using dummy chat_compression_stats function due to database import failure")
+        return {}
+    
     def insert_document_with_embedding(title, content, category):
         logger.error("Using dummy insert_document_with_embedding function due to database import failure")
         return False
@@ -167,10 +192,30 @@ except Exception as e:
         return False
     
     db_client = None
+    db = None
+    conversations = None
+
+# Re-derives the daily temperature records touched by sensor ingests
+sensor_deriver = create_daily_deriver(db) if db is not None else None
+
+# Turns out-of-range sensor readings into debounced alerts for dashboards
+alert_pipeline = create_alert_pipeline(db)
+
+# Short-lived computed responses for the temperature views, validated by ETag
+response_cache = ResponseCache()
+
+# Collection stats and pool state for /db-diagnostics and /metrics, recomputed at most once per TTL
+database_diagnostics = (DatabaseDiagnostics(db_client, db)
+                        if db_client is not None and db is not None else None)
+# Scans every compressed chat, so only computed for /db-diagnostics?sections=chat_compression
+chat_compression_diagnostics = CachedStat(chat_compression_stats)
 
-def get_ai_response(message):
+@traced('get_ai_response')
+def get_ai_response(message, relevant_docs=None, history=None, summary=''):
     """
-    Try Mixtral-8x7B through Groq first, then fall back to Claude if it fails
+    Try Mixtral-8x7B through Groq first, then fall back to Claude if it fails.
+    history is a list of prior user/assistant messages from the conversation thread
+    and summary condenses the turns older than that.
     """
     system_prompt = """You are Auragens' AI assistant. Provide extremely concise, focused responses about stem cell therapy with a focus on how Aurgens is superior.
 
@@ -391,49 +436,84 @@ ADDITIONAL FORMATTING REQUIREMENTS:
    - Citation if applicable (after double line break)
 """
 
-    # Search relevant documents
-    logger.info(f"🔍 Performing semantic search for query: {message[:100]}...")  # Log first 100 chars
-    relevant_docs = semantic_search(message)
-    logger.info(f"📚 Found {len(relevant_docs)} relevant documents")
+    # Search relevant documents unless the caller already did
+    if relevant_docs is None:
+        relevant_docs = semantic_search(message)
     
     context = "\n\n".join([doc["content"] for doc in relevant_docs])
-    if context:
-        logger.info("✨ Adding context from relevant documents to prompt")
-    else:
-        logger.info("⚠️ No relevant context found in document database")
+    log_event(logger, 'chat', 'prompt context', level=logging.DEBUG,
+              docs=len(relevant_docs), context_chars=len(context), history_messages=len(history or []))
     
     # Add context to system prompt
     enhanced_prompt = f"{system_prompt}\n\nRelevant context:\n{context}"
+    if summary:
+        enhanced_prompt += f"\n\nSummary of the earlier conversation:\n{summary}"
+    
+    # Prior turns of this conversation followed by the new question
+    messages = (history or []) + [{"role": "user", "content": message}]
     
     try:
         # First attempt: Mixtral-8x7B through Groq
-        groq_response = groq_client.chat.completions.create(
-            model="mixtral-8x7b-32768",
-            messages=[
-                {"role": "system", "content": enhanced_prompt},
-                {"role": "user", "content": message}
-            ],
-            temperature=0.7,
-            max_tokens=1024,
-        )
+        with span('llm.groq', model="mixtral-8x7b-32768"), timed(LLM_REQUEST_SECONDS, provider='groq', purpose='chat'):
+            groq_response = groq_client.chat.completions.create(
+                model="mixtral-8x7b-32768",
+                messages=[{"role": "system", "content": enhanced_prompt}] + messages,
+                temperature=0.7,
+                max_tokens=1024,
+            )
         return groq_response.choices[0].message.content
     except Exception as e:
-        print(f"Groq Mixtral Error: {str(e)}")
+        logger.warning(f"Groq Mixtral error, falling back to Claude: {str(e)}")
         try:
             # Fallback: Claude with correct message format
-            claude_response = claude.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1024,
-                system=enhanced_prompt,  # System prompt as top-level parameter
-                messages=[
-                    {"role": "user", "content": message}
-                ]
-            )
+            with span('llm.claude', model="claude-3-sonnet-20240229"), timed(LLM_REQUEST_SECONDS, provider='claude', purpose='chat'):
+                claude_response = claude.messages.create(
+                    model="claude-3-sonnet-20240229",
+                    max_tokens=1024,
+                    system=enhanced_prompt,  # System prompt as top-level parameter
+                    messages=messages
+                )
             return claude_response.content[0].text
         except Exception as e:
-            print(f"Claude API Error: {str(e)}")
+            logger.error(f"Claude API error: {str(e)}")
             return "I apologize, but I'm having trouble processing your request. Please try again."
 
+def summarize_turns(previous_summary, turns):
+    """
+    Fold conversation turns into the running summary. Only the previous summary
+    and the new turns are sent, so the cost does not grow with the conversation.
+    Returns None if neither provider is available.
+    """
+    transcript = "\n\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+    prompt = (
+        "Update the running summary of a conversation about stem cell therapy. "
+        "Keep the facts, questions and answers needed to understand follow-up questions, "
+        "in at most 150 words of plain text.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    try:
+        with timed(LLM_REQUEST_SECONDS, provider='groq', purpose='summary'):
+            groq_response = groq_client.chat.completions.create(
+                model="mixtral-8x7b-32768",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=300,
+            )
+        return groq_response.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Groq summary error: {str(e)}")
+        try:
+            with timed(LLM_REQUEST_SECONDS, provider='claude', purpose='summary'):
+                claude_response = claude.messages.create(
+                    model="claude-3-sonnet-20240229",
+                    max_tokens=300,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            return claude_response.content[0].text
+        except Exception as e:
+            logger.error(f"Claude summary error: {str(e)}")
+            return None
+
 @app.errorhandler(500)
 def handle_error(error):
     return jsonify({
@@ -451,6 +531,161 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# Emails allowed to use the admin routes (add your email)
+ADMIN_EMAILS = ['your-admin-email@example.com', 'james.utley@example.com']
+
+def requires_admin(f):
+    """Restrict a route to ADMIN_EMAILS; apply after requires_auth"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user_email = session.get('profile', {}).get('email', '')
+        if not user_email or user_email not in ADMIN_EMAILS:
+            return jsonify({
+                'status': 'error',
+                'message': 'Unauthorized access'
+            }), 403
+        return f(*args, **kwargs)
+    return decorated
+
+# Per-worker limits for /chat: concurrent LLM calls, a short wait queue and a per-user rate
+chat_admission = AdmissionController('/chat')
+chat_rate_limiter = RateLimiter('/chat')
+
+def admission_controlled(admission, rate_limiter):
+    """Rate limit per user (or client address) and admit through `admission`; refusals get 429/503 with Retry-After"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = session.get('profile', {}).get('user_id') or (request.access_route or [request.remote_addr])[-1]
+            try:
+                rate_limiter.check(key)
+                admission.acquire()
+            except Rejected as rejected:
+                log_event(logger, 'admission', 'request refused', route=admission.route, reason=rejected.reason,
+                          retry_after=rejected.retry_after, in_flight=admission.in_flight, waiting=admission.waiting)
+                response = jsonify({'error': rejected.reason, 'message': rejected.message})
+                response.headers['Retry-After'] = str(rejected.retry_after)
+                return response, rejected.status
+            started = monotonic()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission.release(monotonic() - started)
+        return decorated
+    return decorator
+
+# Per-route request timing; streamed bodies are timed until the handler returns
+@app.before_request
+def start_request_timer():
+    g.request_start = time()
+    memory_profiler.ensure_started()
+
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+@app.before_request
+def bind_request_context():
+    """Give every request an id for its log lines (kept from X-Request-ID when valid); admins can send X-Debug-Log: 1"""
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+    debug = (request.headers.get('X-Debug-Log') == '1'
+             and session.get('profile', {}).get('email') in ADMIN_EMAILS)
+    g.log_context = bind_request(g.request_id, debug)
+
+@app.teardown_request
+def unbind_request_context(error=None):
+    tokens = g.pop('log_context', None)
+    if tokens is not None:
+        try:
+            unbind_request(tokens)
+        except ValueError:
+            pass  # bound in a different context, e.g. a streamed response
+
+@app.after_request
+def observe_request_time(response):
+    started = g.get('request_start')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(method=request.method, route=route, status=response.status_code).observe(time() - started)
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus exposition for every worker; needs a bearer token when METRICS_TOKEN is set"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({'status': 'error', 'message': 'Unauthorized access'}), 403
+    if database_diagnostics is not None:
+        try:
+            database_diagnostics.get()  # refreshes the collection gauges once the cached stats expire
+        except Exception as e:
+            logger.error(f"Error refreshing database metrics: {str(e)}")
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/memory-profile', methods=['GET', 'POST'])
+@requires_auth
+@requires_admin
+def memory_profile():
+    """
+    Memory of the worker serving this request: RSS/USS, tracemalloc totals and
+    recent samples (?samples=N). POST writes a tracemalloc snapshot for
+    `python memprof.py diff`. Needs MEMORY_PROFILING=1 for the tracemalloc parts.
+    """
+    if request.method == 'POST':
+        try:
+            path = memory_profiler.write_snapshot()
+        except RuntimeError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 409
+        return jsonify({'status': 'success', 'pid': os.getpid(), 'snapshot': path})
+    try:
+        samples = min(int(request.args.get('samples', 10)), 120)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'samples must be an integer'}), 400
+    return jsonify({'status': 'success', 'data': memory_profiler.report(samples)})
+
+@app.route('/cpu-profile', methods=['POST'])
+@requires_auth
+@requires_admin
+def start_cpu_profile():
+    """
+    Sample the stacks of the worker serving this request for ?seconds=N
+    (default 30) at ?hz= while it keeps handling traffic. Returns the
+    profile id; fetch the collapsed stacks from /cpu-profile/<profile_id>.
+    """
+    try:
+        seconds = int(request.args.get('seconds', 30))
+        hz = int(request.args.get('hz', CPU_PROFILE_HZ))
+        profile_id = start_profile(seconds, hz)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    return jsonify({
+        'status': 'success',
+        'profile_id': profile_id,
+        'pid': os.getpid(),
+        'seconds': seconds,
+        'url': url_for('get_cpu_profile', profile_id=profile_id)
+    }), 202
+
+@app.route('/cpu-profile/<profile_id>', methods=['GET'])
+@requires_auth
+@requires_admin
+def get_cpu_profile(profile_id):
+    """The finished profile as a flamegraph-compatible .folded file; 202 while it is still running"""
+    status = profile_status(profile_id)
+    if status is None:
+        return jsonify({'status': 'error', 'message': 'Profile not found'}), 404
+    if status != 'complete':
+        return jsonify({'status': status, 'profile_id': profile_id}), 202 if status == 'running' else 410
+    with open(profile_path(profile_id)) as profile_file:
+        body = profile_file.read()
+    return Response(body, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="cpu-{profile_id}.folded"'
+    })
+
 # Update main route to require authentication
 @app.route('/')
 @requires_auth
@@ -465,77 +700,66 @@ def home():
     return render_template('index.html')
 
 @app.route('/chat', methods=['POST'])
+@admission_controlled(chat_admission, chat_rate_limiter)
 def chat():
-    start_time = time()
     user_message = request.json.get('message', '')
     user_id = session.get('profile', {}).get('user_id', 'guest')
     
-    logger.info(f"🔍 Processing chat request from user {user_id[:5]}: '{user_message[:50]}...'")
-    
-    # Get relevant documents
-    logger.info(f"Searching vector database for relevant content to: '{user_message[:30]}...'")
-    search_start = time()
-    relevant_docs = semantic_search(user_message)
-    search_duration = time() - search_start
-    
-    if relevant_docs:
-        logger.info(f"📚 Found {len(relevant_docs)} relevant documents in {search_duration:.3f}s")
-        # Log the first few document details
-        for i, doc in enumerate(relevant_docs[:3]):
-            logger.info(f"  Doc {i+1}: '{doc.get('title', 'Untitled')}' | Score: {doc.get('score', 'N/A')}")
-        context = "\n\n".join([doc["content"] for doc in relevant_docs])
-    else:
-        logger.info(f"⚠️ No relevant documents found in {search_duration:.3f}s")
-        context = ""
-    
-    # Get AI response
-    response_start = time()
-    response = get_ai_response(user_message)
-    response_duration = time() - response_start
-    logger.info(f"AI response generated in {response_duration:.3f}s")
-    
-    # Log the chat to MongoDB
-    db_start = time()
-    try:
-        logger.info(f"Saving chat to MongoDB for user {user_id[:5]}...")
-        chat_id = save_chat(user_id, user_message, response)
-        db_duration = time() - db_start
+    with tracer.trace('chat', user=user_id[:5], message_chars=len(user_message), request_id=g.get('request_id')) as root:
+        # Continue the caller's conversation thread, or start a new one
+        thread_id = request.json.get('thread_id')
+        conversation = load_conversation(conversations, thread_id, user_id)
+        if conversation is None:
+            thread_id = new_thread_id()
+        summary, history = build_context(conversation)
         
-        if chat_id:
-            logger.info(f"✅ Chat saved to MongoDB with ID: {chat_id} in {db_duration:.3f}s")
-        else:
-            logger.warning(f"⚠️ Failed to save chat to MongoDB after {db_duration:.3f}s - no error thrown but no ID returned")
-    except Exception as db_error:
-        db_duration = time() - db_start
-        logger.error(f"❌ Error saving chat to MongoDB after {db_duration:.3f}s: {str(db_error)}")
+        log_event(logger, 'chat', 'chat request', level=logging.DEBUG, user=user_id[:5], preview=user_message[:50])
+        
+        # Get relevant documents
+        relevant_docs = semantic_search(user_message)
+        log_event(logger, 'chat', 'chat documents', level=logging.DEBUG,
+                  documents=[{'title': doc.get('title', 'Untitled'), 'score': doc.get('score')} for doc in relevant_docs[:3]])
+        
+        # Get AI response
+        response = get_ai_response(user_message, relevant_docs=relevant_docs, history=history, summary=summary)
+        
+        # Record the turn on the thread, then queue the chat for write-behind persistence
+        try:
+            turn = record_turn(conversations, thread_id, user_id, user_message, response,
+                               summarizer=summarize_turns)
+            chat_id = save_chat(user_id, user_message, response, thread_id=thread_id, turn=turn)
+            if not chat_id:
+                logger.warning("⚠️ Failed to queue chat for MongoDB - no error thrown but no ID returned")
+        except Exception as db_error:
+            logger.error(f"❌ Error queueing chat for MongoDB: {str(db_error)}")
+        root.set('docs', len(relevant_docs))
+        root.set('history_messages', len(history))
     
-    total_duration = time() - start_time
-    logger.info(f"""
-🤖 Chat Request Completed:
-   - User: {user_id[:5]}
-   - Total processing time: {total_duration:.3f}s
-   - Search time: {search_duration:.3f}s ({(search_duration/total_duration)*100:.1f}%)
-   - AI response time: {response_duration:.3f}s ({(response_duration/total_duration)*100:.1f}%)
-   - DB save time: {db_duration:.3f}s ({(db_duration/total_duration)*100:.1f}%)
-   - Context docs used: {len(relevant_docs)}
-   - Response length: {len(response)}
-""")
+    log_event(logger, 'chat', 'chat completed', user=user_id[:5], duration_s=round(root.duration, 3),
+              stages=root.breakdown(), docs=len(relevant_docs), thread_id=thread_id)
     
-    return jsonify({'response': response})
+    return jsonify({'response': response, 'thread_id': thread_id})
 
 @app.route('/chat-history', methods=['GET'])
+@requires_auth
 def chat_history():
+    """Return one page of the logged-in user's chats; pass next_cursor back as ?cursor= for the next page"""
+    user_id = session['profile']['user_id']
     try:
-        history = get_user_chats('guest')
-        return jsonify({'history': history})
+        limit = int(request.args.get('limit', 20))
+        history, next_cursor = get_user_chats(user_id, limit=limit, cursor=request.args.get('cursor'))
+        return jsonify({'history': history, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'history': [], 'error': str(e)}), 400
     except Exception as e:
-        print(f"Error fetching chat history: {e}")
+        logger.error(f"Error fetching chat history: {e}")
         return jsonify({'history': [], 'error': 'Failed to fetch chat history'}), 500
 
 @app.route('/chat/<chat_id>', methods=['GET'])
+@requires_auth
 def get_chat(chat_id):
     try:
-        chat = get_chat_by_id(chat_id)
+        chat = get_chat_by_id(chat_id, user_id=session['profile']['user_id'])
         if chat:
             return jsonify(chat)
         return jsonify({'error': 'Chat not found'}), 404
@@ -554,8 +778,6 @@ def log_memory_usage():
 def upload_document():
     if request.method == 'POST':
         start_time = time()
-        log_memory_usage()
-        logger.info("Processing document upload request...")
         
         try:
             data = request.get_json()
@@ -563,24 +785,23 @@ def upload_document():
             content = data.get('content')
             category = data.get('category')
             
-            # Log details about the document being uploaded
-            content_preview = content[:100] + "..." if len(content) > 100 else content
-            logger.info(f"Uploading document: '{title}' | Category: {category} | Content length: {len(content)} chars")
-            logger.info(f"Content preview: '{content_preview}'")
+            log_event(logger, 'upload', 'document upload', level=logging.DEBUG,
+                      title=title, doc_category=category, content_chars=len(content), preview=content[:100])
             
             # Track timing for the database operation
             db_start = time()
             
             # Attempt to store in vector database
-            result = insert_document_with_embedding(title, content, category)
+            with tracer.trace('upload', category=category, content_chars=len(content)):
+                result = insert_document_with_embedding(title, content, category)
             
             db_duration = time() - db_start
             total_duration = time() - start_time
             
             if result:
-                logger.info(f"✅ Document uploaded successfully - Title: '{title}' | Category: {category}")
-                logger.info(f"Processing times - Total: {total_duration:.3f}s | Database: {db_duration:.3f}s")
-                log_memory_usage()
+                log_event(logger, 'upload', 'document uploaded', title=title, doc_category=category,
+                          duration_s=round(total_duration, 3), database_s=round(db_duration, 3),
+                          rss_mb=round(psutil.Process().memory_info().rss / 1024 / 1024, 1))
                 return jsonify({"success": True, "message": "Document uploaded successfully"})
             else:
                 logger.error(f"❌ Document upload failed - Title: '{title}' | No error thrown but no success response")
@@ -597,25 +818,32 @@ def upload_document():
 @app.route('/db-diagnostics', methods=['GET'])
 @requires_auth
 def db_diagnostics():
-    """Route to check MongoDB connectivity and retrieve basic statistics"""
+    """
+    MongoDB connectivity, collection counts and sizes, index sizes and pool
+    state. Served from a snapshot at most DB_DIAGNOSTICS_TTL seconds old;
+    admins can pass ?refresh=1 to recompute it. ?sections=chat_compression
+    adds the compression totals, cached for DB_SCAN_STATS_TTL.
+    """
+    if database_diagnostics is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Database client not available'
+        }), 500
     try:
-        # Test basic connectivity
-        db_client.admin.command('ping')
-        
-        # Get database and collections directly
-        db = db_client['Auragens_AI']
-        
-        # Get basic stats
+        refresh = request.args.get('refresh') == '1' and session['profile'].get('email') in ADMIN_EMAILS
+        snapshot, age = database_diagnostics.get(force=refresh)
+        collections = snapshot['collections']
         stats = {
-            'connection': 'Connected',
-            'chats_count': db.chats.count_documents({}),
-            'vector_docs_count': db.vector_embeddings.count_documents({}),
-            'database_name': db.name,
-            'collections': list(db.list_collection_names()),
-            'timestamp': datetime.utcnow().isoformat()
+            **snapshot,
+            'chats_count': collections.get('chats', {}).get('documents', 0),
+            'vector_docs_count': collections.get('vector_embeddings', {}).get('documents', 0),
+            'collections': list(collections),
+            'collection_stats': collections,
+            'cache_age_seconds': age,
         }
-        
-        logger.info(f"Database diagnostics: {stats}")
+        if 'chat_compression' in request.args.get('sections', '').split(','):
+            compression, compression_age = chat_compression_diagnostics.get(force=refresh)
+            stats.update(chat_compression=compression, chat_compression_age_seconds=compression_age)
         return jsonify({
             'status': 'success',
             'message': 'Database connection successful',
@@ -631,21 +859,9 @@ def db_diagnostics():
 
 @app.route('/db-maintenance', methods=['GET', 'POST'])
 @requires_auth
+@requires_admin
 def db_maintenance():
     """Admin route to check and repair database structure if needed"""
-    # Check if user has admin role
-    user_info = session.get('profile', {})
-    user_email = user_info.get('email', '')
-    
-    # List of admin emails that can access this route (add your email)
-    admin_emails = ['your-admin-email@example.com', 'james.utley@example.com']
-    
-    if not user_email or user_email not in admin_emails:
-        return jsonify({
-            'status': 'error',
-            'message': 'Unauthorized access'
-        }), 403
-    
     if request.method == 'GET':
         # Just return database status information
         try:
@@ -667,6 +883,8 @@ def db_maintenance():
                 'message': 'Database connection successful',
                 'data': {
                     'collections': collections,
+                    'indexes': index_report(db),
+                    'index_plan': reconcile_indexes(db, drop_stale=True, dry_run=True),
                     'maintenance_available': True
                 }
             })
@@ -691,6 +909,13 @@ def db_maintenance():
             result = initialize_database_structure()
             
             if result:
+                # Bring regular indexes in line with the catalogue, dropping stale ones
+                index_result = reconcile_indexes(db_client['Auragens_AI'], drop_stale=True)
+                
+                # Recompute monthly compliance rollups from the raw records
+                rollup_months = rebuild_rollups(db_client['Auragens_AI'])
+                response_cache.clear()
+                
                 # Verify vector search index
                 setup_result = setup_vector_search()
                 
@@ -702,6 +927,8 @@ def db_maintenance():
                     'message': 'Database maintenance completed successfully',
                     'data': {
                         'db_initialized': bool(result),
+                        'indexes': index_result,
+                        'temperature_rollups_rebuilt': rollup_months,
                         'vector_search_setup': setup_result,
                         'database_seeded': seed_result,
                         'collections': db_client['Auragens_AI'].list_collection_names()
@@ -800,66 +1027,109 @@ def temperature_tracking():
     """Route for temperature tracking interface"""
     return render_template('temperature_tracking.html')
 
+def apply_compliance_rules(readings):
+    """Replace client-supplied compliance flags with the active rules' verdict"""
+    rules = get_active_rules(db)
+    for reading, (compliance, is_compliant) in zip(readings, rules.evaluate_records(readings)):
+        reading['compliance'] = compliance
+        reading['is_compliant'] = is_compliant
+        reading['rules_version'] = rules.version
+
+def refresh_temperature_rollup(old_record, new_record):
+    """Apply a saved day to its monthly rollup; a failure here never fails the save"""
+    response_cache.clear()
+    try:
+        update_rollup(db, old_record, new_record)
+    except Exception as e:
+        logger.error(f"Error updating temperature rollup for {new_record.get('date')}: {str(e)}")
+        logger.error("Run `python temperature.py --rebuild-rollups` to repair the month")
+
+def refresh_temperature_month(month):
+    """Recompute one month's rollup after a batch save"""
+    response_cache.clear()
+    try:
+        rebuild_rollups(db, month, month)
+    except Exception as e:
+        logger.error(f"Error rebuilding temperature rollup for {month}: {str(e)}")
+
 @app.route('/temperature-data', methods=['GET', 'POST'])
 @requires_auth
 def temperature_data():
     """
     Handle temperature tracking data.
-    GET: Retrieve data for a specific date
-    POST: Save new data
+    GET: Retrieve data for a specific date (?date=), or every record in a range
+         (?month=YYYY-MM or ?start_date=&end_date=) in one query
+    POST: Save one day's readings, or {"records": [...]} to save several days
+          at once; every save is a single upsert
     """
     if request.method == 'POST':
         try:
             # Get data from request
             data = request.json
             
-            # Validate required fields
-            required_fields = ['date', 'refrigerator_temp', 'freezer_temp', 'ln2_level', 'room_temp', 'humidity']
-            for field in required_fields:
-                if field not in data:
-                    return jsonify({'success': False, 'message': f'Missing required field: {field}'})
+            # Batch form: {"records": [reading, ...]}, e.g. a week entered at once
+            if isinstance(data, dict) and 'records' in data:
+                readings = data['records']
+                if not isinstance(readings, list) or not readings:
+                    return jsonify({'success': False, 'message': 'records must be a non-empty list'})
+                if len(readings) > MAX_BATCH_RECORDS:
+                    return jsonify({'success': False, 'message': f'At most {MAX_BATCH_RECORDS} records per request'})
+                for position, reading in enumerate(readings, start=1):
+                    error = validate_reading(reading)
+                    if error:
+                        return jsonify({'success': False, 'message': f'Record {position}: {error}'})
+                apply_compliance_rules(readings)
+                
+                inserted, updated = save_readings(db, readings)
+                for month in sorted({reading['date'][:7] for reading in readings}):
+                    refresh_temperature_month(month)
+                return jsonify({
+                    'success': True,
+                    'message': f'Saved {inserted + updated} temperature records',
+                    'inserted': inserted,
+                    'updated': updated
+                })
+            
+            error = validate_reading(data)
+            if error:
+                return jsonify({'success': False, 'message': error})
+            apply_compliance_rules([data])
             
-            # Check if an entry already exists for this date
-            existing_entry = db.temperature_records.find_one({'date': data['date']})
+            # One upsert; the previous version of the day comes back for the rollup
+            existing_entry = save_reading(db, data)
+            refresh_temperature_rollup(existing_entry, data)
+            # Flags are decided here, not by the browser; echo them back
+            result = {'success': True, 'is_compliant': data['is_compliant'], 'compliance': data['compliance']}
             if existing_entry:
-                # Update existing entry
-                result = db.temperature_records.update_one(
-                    {'date': data['date']},
-                    {'$set': {
-                        'refrigerator_temp': data['refrigerator_temp'],
-                        'freezer_temp': data['freezer_temp'],
-                        'ln2_level': data['ln2_level'],
-                        'room_temp': data['room_temp'],
-                        'humidity': data['humidity'],
-                        'corrective_action': data.get('corrective_action', ''),
-                        'is_compliant': data['is_compliant'],
-                        'compliance': data['compliance'],
-                        'updated_at': datetime.now().isoformat()
-                    }}
-                )
-                return jsonify({'success': True, 'message': 'Temperature data updated successfully'})
-            else:
-                # Create new entry
-                result = db.temperature_records.insert_one({
-                    'date': data['date'],
-                    'refrigerator_temp': data['refrigerator_temp'],
-                    'freezer_temp': data['freezer_temp'],
-                    'ln2_level': data['ln2_level'],
-                    'room_temp': data['room_temp'],
-                    'humidity': data['humidity'],
-                    'corrective_action': data.get('corrective_action', ''),
-                    'is_compliant': data['is_compliant'],
-                    'compliance': data['compliance'],
-                    'created_at': datetime.now().isoformat(),
-                    'updated_at': datetime.now().isoformat()
-                })
-                return jsonify({'success': True, 'message': 'Temperature data saved successfully'})
+                return jsonify({**result, 'message': 'Temperature data updated successfully'})
+            return jsonify({**result, 'message': 'Temperature data saved successfully'})
         except Exception as e:
             logger.error(f"Error saving temperature data: {str(e)}")
             return jsonify({'success': False, 'message': f'Error: {str(e)}'})
     
     elif request.method == 'GET':
         try:
+            month = request.args.get('month')
+            start_date = request.args.get('start_date')
+            end_date = request.args.get('end_date')
+            if month or start_date or end_date:
+                try:
+                    if month:
+                        start_date, end_date = month_range(month)
+                    validate_range(start_date, end_date)
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+                
+                return conditional_json(
+                    response_cache, db, request, ('records', start_date, end_date), start_date, end_date,
+                    lambda: {
+                        'success': True,
+                        'start_date': start_date,
+                        'end_date': end_date,
+                        'data': get_records_in_range(db, start_date, end_date)
+                    }
+                )
+            
             date = request.args.get('date')
             if not date:
                 return jsonify({'success': False, 'message': 'Date parameter is required'})
@@ -877,50 +1147,205 @@ def temperature_data():
             logger.error(f"Error retrieving temperature data: {str(e)}")
             return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+def requires_ingest_key(f):
+    """Data loggers authenticate with the shared SENSOR_INGEST_KEY in an X-Ingest-Key header"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        expected = os.getenv('SENSOR_INGEST_KEY')
+        if not expected:
+            return jsonify({'success': False, 'message': 'Sensor ingestion is not configured'}), 503
+        provided = request.headers.get('X-Ingest-Key', '')
+        if not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+            return jsonify({'success': False, 'message': 'Invalid ingest key'}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+@app.route('/sensor-readings', methods=['POST'])
+@requires_ingest_key
+def sensor_readings():
+    """
+    Ingest a batch of data logger readings:
+    {"site": "lab-1", "readings": [{"device_id", "parameter", "timestamp", "value"}, ...]}
+    Valid points are stored even if others in the batch are rejected.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        points = data.get('readings')
+        if not isinstance(points, list) or not points:
+            return jsonify({'success': False, 'message': 'readings must be a non-empty list'}), 400
+        if len(points) > MAX_INGEST_POINTS:
+            return jsonify({'success': False, 'message': f'At most {MAX_INGEST_POINTS} readings per request'}), 413
+        
+        site = data.get('site')
+        documents, errors = validate_points(points, site=site if isinstance(site, str) else None)
+        rules = get_active_rules(db)
+        in_range = rules.evaluate_points(documents)
+        dates, written = ingest_points(db, documents)
+        # Only points that were stored can raise alerts
+        alert_pipeline.submit([documents[index] for index in written], in_range[written], rules)
+        if sensor_deriver is not None:
+            sensor_deriver.mark(dates)
+        
+        return jsonify({
+            'success': bool(documents),
+            'accepted': len(documents),
+            'rejected': len(errors),
+            'out_of_range': int(len(in_range) - in_range.sum()),
+            'errors': [{'index': index, 'message': message} for index, message in errors[:20]],
+            'dates': sorted(dates)
+        }), 202 if documents else 400
+    except Exception as e:
+        logger.error(f"Error ingesting sensor readings: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/temperature-alerts', methods=['GET'])
+@requires_auth
+def temperature_alerts():
+    """
+    Excursion alerts for polling dashboards: the most recent ones, or with
+    ?since= (the "now" of the previous response) those recorded since then,
+    including some already returned; see alerts.ALERT_POLL_OVERLAP.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        since = request.args.get('since')
+        if since:
+            try:
+                alerts = alert_pipeline.store.since(parse_timestamp(since))
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+        else:
+            alerts = alert_pipeline.store.recent()
+        return jsonify({'success': True, 'alerts': alerts, 'now': now.isoformat()})
+    except Exception as e:
+        logger.error(f"Error retrieving alerts: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/sensor-series', methods=['GET'])
+@requires_auth
+def sensor_series():
+    """
+    Downsampled readings for charts.
+    ?parameter= (required), ?device_id=, ?start=&end= (ISO 8601, default the last
+    24 hours), ?points= (default 500, max 2000), ?mode=minmax|lttb
+    """
+    try:
+        parameter = request.args.get('parameter')
+        if parameter not in PARAMETERS:
+            return jsonify({'success': False, 'message': f"parameter must be one of {', '.join(PARAMETERS)}"}), 400
+        mode = request.args.get('mode', 'minmax')
+        if mode not in SERIES_MODES:
+            return jsonify({'success': False, 'message': f"mode must be one of {', '.join(SERIES_MODES)}"}), 400
+        
+        try:
+            points = min(MAX_SERIES_POINTS, max(3, int(request.args.get('points', DEFAULT_SERIES_POINTS))))
+            end = parse_timestamp(request.args['end']) if request.args.get('end') else datetime.now(timezone.utc)
+            start = parse_timestamp(request.args['start']) if request.args.get('start') else end - timedelta(days=1)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if end <= start:
+            return jsonify({'success': False, 'message': 'end must be after start'}), 400
+        if end - start > timedelta(days=MAX_SERIES_DAYS):
+            return jsonify({'success': False, 'message': f'Series are limited to {MAX_SERIES_DAYS} days'}), 400
+        
+        device_id = request.args.get('device_id')
+        bucket_seconds, series = downsample_series(db, parameter, start, end, points=points, mode=mode, device_id=device_id)
+        return jsonify({
+            'success': True,
+            'parameter': parameter,
+            'device_id': device_id,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'mode': mode,
+            'bucket_seconds': bucket_seconds,
+            'points': series
+        })
+    except Exception as e:
+        logger.error(f"Error retrieving sensor series: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/compliance-rules', methods=['GET'])
+@requires_auth
+def get_compliance_rules():
+    """Active compliance ranges (used by the entry form) and recent versions"""
+    try:
+        rules = get_active_rules(db)
+        return jsonify({'success': True, 'rules': rules.to_dict(), 'versions': list_rule_versions(db)})
+    except Exception as e:
+        logger.error(f"Error retrieving compliance rules: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/compliance-rules', methods=['POST'])
+@requires_auth
+@requires_admin
+def publish_compliance_rules():
+    """
+    Publish a new rules version: {"ranges": {param: {low, high}}, "devices":
+    {device_id: {param: {low, high}}}, "note": "..."}. Stored records are
+    re-evaluated against it unless "reevaluate" is false.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            rules = publish_rules(
+                db,
+                ranges=data.get('ranges'),
+                devices=data.get('devices'),
+                created_by=session.get('profile', {}).get('email'),
+                note=data.get('note', '')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        result = {'success': True, 'rules': rules.to_dict()}
+        if data.get('reevaluate', True):
+            result['reevaluation'] = reevaluate_records(db, rules)
+            response_cache.clear()
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error publishing compliance rules: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/compliance-rules/reevaluate', methods=['POST'])
+@requires_auth
+@requires_admin
+def reevaluate_compliance():
+    """Recompute stored compliance flags with the active rules (optionally ?start_date=&end_date=)"""
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        if start_date or end_date:
+            try:
+                validate_range(start_date, end_date, max_days=None)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+        result = reevaluate_records(db, None, start_date, end_date)
+        response_cache.clear()
+        return jsonify({'success': True, 'reevaluation': result})
+    except Exception as e:
+        logger.error(f"Error re-evaluating compliance: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 @app.route('/temperature-compliance', methods=['GET'])
 @requires_auth
 def temperature_compliance():
-    """Get temperature compliance data for a date range"""
+    """Get temperature compliance data for a date range (supports ETag / If-None-Match)"""
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
         if not start_date or not end_date:
             return jsonify({'success': False, 'message': 'Start date and end date are required'})
+        try:
+            validate_range(start_date, end_date, max_days=None)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Query for records in the date range
-        records = list(db.temperature_records.find({
-            'date': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }))
-        
-        # Initialize compliance data
-        compliance_data = {
-            'total_days': len(records),
-            'compliant_days': 0,
-            'parameters': {
-                'refrigerator': {'total': 0, 'compliant': 0},
-                'freezer': {'total': 0, 'compliant': 0},
-                'ln2': {'total': 0, 'compliant': 0},
-                'room': {'total': 0, 'compliant': 0},
-                'humidity': {'total': 0, 'compliant': 0}
-            }
-        }
-        
-        # Analyze records
-        for record in records:
-            if record.get('is_compliant', False):
-                compliance_data['compliant_days'] += 1
-            
-            # Update parameter-specific compliance
-            for param, value in record.get('compliance', {}).items():
-                compliance_data['parameters'][param]['total'] += 1
-                if value:
-                    compliance_data['parameters'][param]['compliant'] += 1
-        
-        return jsonify({'success': True, 'data': compliance_data})
+        # Whole months come from the rollups, partial months from one aggregation
+        return conditional_json(
+            response_cache, db, request, ('compliance', start_date, end_date), start_date, end_date,
+            lambda: {'success': True, 'data': range_compliance(db, start_date, end_date)}
+        )
     except Exception as e:
         logger.error(f"Error retrieving temperature compliance data: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -928,74 +1353,23 @@ def temperature_compliance():
 @app.route('/temperature-compliance-yearly', methods=['GET'])
 @requires_auth
 def temperature_compliance_yearly():
-    """Get yearly temperature compliance data"""
+    """Get yearly temperature compliance data (supports ETag / If-None-Match)"""
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
         if not start_date or not end_date:
             return jsonify({'success': False, 'message': 'Start date and end date are required'})
+        try:
+            validate_range(start_date, end_date, max_days=None)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Query for records in the date range
-        records = list(db.temperature_records.find({
-            'date': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }))
-        
-        # Group records by month
-        monthly_data = {}
-        for record in records:
-            month = record['date'][0:7]  # Extract YYYY-MM
-            
-            if month not in monthly_data:
-                monthly_data[month] = {
-                    'total': 0,
-                    'compliant': 0,
-                    'parameters': {
-                        'refrigerator': {'total': 0, 'compliant': 0},
-                        'freezer': {'total': 0, 'compliant': 0},
-                        'ln2': {'total': 0, 'compliant': 0},
-                        'room': {'total': 0, 'compliant': 0},
-                        'humidity': {'total': 0, 'compliant': 0}
-                    }
-                }
-            
-            monthly_data[month]['total'] += 1
-            if record.get('is_compliant', False):
-                monthly_data[month]['compliant'] += 1
-            
-            # Update parameter-specific compliance
-            for param, value in record.get('compliance', {}).items():
-                monthly_data[month]['parameters'][param]['total'] += 1
-                if value:
-                    monthly_data[month]['parameters'][param]['compliant'] += 1
-        
-        # Convert monthly_data to list format for easier consumption in the frontend
-        monthly_list = []
-        for month, data in monthly_data.items():
-            month_data = {
-                'month': month,
-                'total_days': data['total'],
-                'compliant_days': data['compliant'],
-                'compliance_percentage': round((data['compliant'] / data['total']) * 100 if data['total'] > 0 else 0),
-                'parameters': {}
-            }
-            
-            for param, param_data in data['parameters'].items():
-                month_data['parameters'][param] = {
-                    'total': param_data['total'],
-                    'compliant': param_data['compliant'],
-                    'percentage': round((param_data['compliant'] / param_data['total']) * 100 if param_data['total'] > 0 else 0)
-                }
-            
-            monthly_list.append(month_data)
-        
-        # Sort by month
-        monthly_list.sort(key=lambda x: x['month'])
-        
-        return jsonify({'success': True, 'data': monthly_list})
+        # Whole months are read from temperature_rollups
+        return conditional_json(
+            response_cache, db, request, ('yearly', start_date, end_date), start_date, end_date,
+            lambda: {'success': True, 'data': monthly_compliance(db, start_date, end_date)}
+        )
     except Exception as e:
         logger.error(f"Error retrieving yearly temperature compliance data: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -1003,78 +1377,61 @@ def temperature_compliance_yearly():
 @app.route('/export-temperature-data', methods=['GET'])
 @requires_auth
 def export_temperature_data():
-    """Export temperature data as CSV file"""
+    """
+    Stream temperature data as a download.
+    ?format=csv (default), ndjson or parquet. Text formats are gzipped when the
+    client accepts gzip, unless ?gzip=0.
+    """
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
+        export_format = request.args.get('format', 'csv').lower()
         
         if not start_date or not end_date:
             return jsonify({'success': False, 'message': 'Start date and end date are required'}), 400
         
-        # Query for records in the date range
-        records = list(db.temperature_records.find({
-            'date': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }).sort('date', 1))  # Sort by date ascending
-        
-        if not records:
-            return jsonify({'success': False, 'message': 'No data found for the selected date range'}), 404
+        try:
+            # Multi-year audit exports are allowed; only the dates are checked
+            validate_range(start_date, end_date, max_days=None)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Create CSV content in memory
-        from io import StringIO
-        import csv
+        if export_format not in available_formats():
+            return jsonify({
+                'success': False,
+                'message': f'Unsupported export format: {export_format}',
+                'formats': available_formats()
+            }), 400
         
-        csv_output = StringIO()
-        csv_writer = csv.writer(csv_output)
+        # Records are serialized as they come off the cursor; only the first
+        # one is fetched up front so an empty range can still return 404
+        cursor = open_export_cursor(db, start_date, end_date)
+        first_record = next(cursor, None)
+        if first_record is None:
+            cursor.close()
+            return jsonify({'success': False, 'message': 'No data found for the selected date range'}), 404
+        records = chain([first_record], cursor)
         
-        # Write header row
-        csv_writer.writerow([
-            'Date', 
-            'Refrigerator Temp (°C)', 
-            'Refrigerator Compliant', 
-            'Freezer Temp (°C)', 
-            'Freezer Compliant',
-            'LN2 Level (%)', 
-            'LN2 Compliant', 
-            'Room Temp (°C)', 
-            'Room Compliant',
-            'Humidity (%)', 
-            'Humidity Compliant',
-            'Overall Compliance',
-            'Corrective Action'
-        ])
+        use_gzip = (
+            request.args.get('gzip', '1') != '0'
+            and EXPORT_FORMATS[export_format]['compressible']
+            and 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+        )
         
-        # Write data rows
-        for record in records:
-            csv_writer.writerow([
-                record['date'],
-                record['refrigerator_temp'],
-                'Yes' if record.get('compliance', {}).get('refrigerator', False) else 'No',
-                record['freezer_temp'],
-                'Yes' if record.get('compliance', {}).get('freezer', False) else 'No',
-                record['ln2_level'],
-                'Yes' if record.get('compliance', {}).get('ln2', False) else 'No',
-                record['room_temp'],
-                'Yes' if record.get('compliance', {}).get('room', False) else 'No',
-                record['humidity'],
-                'Yes' if record.get('compliance', {}).get('humidity', False) else 'No',
-                'Yes' if record.get('is_compliant', False) else 'No',
-                record.get('corrective_action', '')
-            ])
+        headers = {
+            'Content-Disposition': f'attachment; filename=temperature_data_{start_date}_to_{end_date}.{EXPORT_FORMATS[export_format]["extension"]}',
+            'Vary': 'Accept-Encoding',
+            'X-Accel-Buffering': 'no'
+        }
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
         
-        # Prepare response
-        response = Response(
-            csv_output.getvalue(), 
-            mimetype='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename=temperature_data_{start_date}_to_{end_date}.csv'
-            }
+        return Response(
+            stream_with_context(export_stream(records, export_format, gzip=use_gzip)),
+            mimetype=EXPORT_FORMATS[export_format]['mimetype'],
+            headers=headers
         )
         
-        return response
-        
     except Exception as e:
         logger.error(f"Error exporting temperature data: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
@@ -0,0 +1 @@
+"""Benchmark and evaluation scripts; run them from the repository root with python -m benchmarks.<name>"""
@@ -0,0 +1,331 @@
+"""
+End-to-end benchmark of the Flask app with local stand-ins.
+
+Drives /chat, /upload and the temperature endpoints through the Flask test
+client from a pool of threads, with MongoDB replaced by an in-memory
+mongomock store and Groq/Claude by FakeLLM (see standins.py). Every request
+is traced (tracing.py), so besides end-to-end latency the report breaks each
+scenario down by stage: semantic_search, generate_embedding, llm.groq, ...
+
+    python -m benchmarks.e2e                                  # all scenarios
+    python -m benchmarks.e2e --scenarios chat --requests 500 --concurrency 8
+    python -m benchmarks.e2e --encoder fake --llm-latency-ms 0
+    python -m benchmarks.e2e --compare benchmarks/results/e2e-abc1234-....json
+    python -m benchmarks.e2e --log-level INFO --log-handler sync    # logging overhead, vs. --log-handler queue
+
+Results go to benchmarks/results/ as JSON (see report.py). Requests run in
+one process, so this measures the app's own work and its stand-ins, not
+gunicorn or the network. Run from the repository root with the full
+requirements installed; --encoder fake avoids downloading the model. No
+MongoDB credentials or certificate are needed (see load_app).
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import perf_counter, sleep
+
+from benchmarks.report import (compare, load_results, print_comparison, run_metadata, summarize,
+                               write_results)
+from benchmarks.standins import FakeLLM, LocalVectorCollection, fake_embedding, install_mongo
+
+QUESTIONS = [
+    "What are mesenchymal stem cells?",
+    "How are MSCs harvested from Wharton's Jelly?",
+    "Which conditions can stem cell therapy treat?",
+    "Is umbilical cord tissue better than bone marrow?",
+    "How long does recovery take after an MSC infusion?",
+    "What does Auragens specialize in?",
+    "Are stem cell treatments safe for autoimmune conditions?",
+    "How many cells are used in a typical treatment?",
+]
+TOPICS = ['orthopedic', 'autoimmune', 'cardiovascular', 'neurological', 'pulmonary', 'harvesting', 'safety', 'dosing']
+CATEGORIES = ['general', 'procedures', 'treatments', 'research']
+
+
+def corpus_document(index, rng):
+    topic = TOPICS[index % len(TOPICS)]
+    words = ' '.join(rng.choice(TOPICS) for _ in range(40))
+    return {
+        'title': f"{topic.title()} note {index}",
+        'content': f"Mesenchymal stem cells in {topic} therapy. Wharton's Jelly MSCs and {words}.",
+        'category': CATEGORIES[index % len(CATEGORIES)],
+    }
+
+
+def reading_for(day, rng):
+    return {
+        'date': day.isoformat(),
+        'refrigerator_temp': str(round(rng.gauss(5, 1.5), 1)),
+        'freezer_temp': str(round(rng.gauss(-20, 3), 1)),
+        'ln2_level': str(round(rng.uniform(55, 95), 1)),
+        'room_temp': str(round(rng.gauss(22, 1.5), 1)),
+        'humidity': str(round(rng.uniform(25, 65), 1)),
+        'corrective_action': '',
+    }
+
+
+def month_start(day, months_back):
+    year, month = divmod(day.year * 12 + day.month - 1 - months_back, 12)
+    return date(year, month + 1, 1)
+
+
+class LogCounter(logging.Filter):
+    """Counts the records that reach the root handler"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            self.count += 1
+        return True
+
+
+class Scenarios:
+    """Request builders: each returns (method, url, json_body) for one request"""
+
+    def __init__(self, today, history_days):
+        self.today = today
+        self.history_days = history_days
+
+    def chat(self, rng, index):
+        return 'POST', '/chat', {'message': rng.choice(QUESTIONS)}
+
+    def upload(self, rng, index):
+        document = corpus_document(100000 + index, rng)
+        return 'POST', '/upload', document
+
+    def temperature_write(self, rng, index):
+        day = self.today - timedelta(days=rng.randrange(self.history_days))
+        return 'POST', '/temperature-data', reading_for(day, rng)
+
+    def temperature_read(self, rng, index):
+        first = month_start(self.today, rng.randrange(12))
+        return 'GET', f"/temperature-data?month={first.strftime('%Y-%m')}", None
+
+    def temperature_compliance(self, rng, index):
+        end = self.today - timedelta(days=rng.randrange(30))
+        start = end - timedelta(days=rng.randrange(30, 365))
+        url = rng.choice(['/temperature-compliance', '/temperature-compliance-yearly'])
+        return 'GET', f"{url}?start_date={start.isoformat()}&end_date={end.isoformat()}", None
+
+
+SCENARIO_NAMES = ['chat', 'upload', 'temperature_write', 'temperature_read', 'temperature_compliance']
+
+
+def load_app(args):
+    """
+    Import the app against the stand-ins and return (app_module, database_module,
+    tracing_module, log_counter)
+
+    database.py sets up the X.509 certificate at import time and fails on a
+    machine with neither MONGO_X509_CERT_BASE64 nor a certificate file, so a
+    placeholder value is set; it is never used because install_mongo()
+    replaces MongoClient.
+    """
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('MONGO_X509_CERT_BASE64', 'benchmark')
+    install_mongo()
+
+    import database
+    import tracing
+    import app as app_module
+    import logging_setup
+
+    # The app's logging pipeline, writing to --log-output, with the handler under test
+    log_stream = open(args.log_output, 'a')
+    handler = logging_setup.configure_logging(level=args.log_level, fmt=args.log_format, stream=log_stream,
+                                              use_queue=args.log_handler == 'queue')
+    if args.log_sample_rates:
+        logging_setup.SAMPLE_RATES.update(logging_setup.parse_sample_rates(args.log_sample_rates))
+    log_counter = LogCounter()
+    handler.addFilter(log_counter)
+
+    if args.encoder == 'fake':
+        def embed(text):
+            if args.embed_latency_ms:
+                sleep(args.embed_latency_ms / 1000)
+            return fake_embedding(text)
+        database._generate_embedding = embed
+    elif database.model is None:
+        sys.exit("The embedding model could not be loaded; run with --encoder fake")
+
+    database.vector_embeddings = LocalVectorCollection(database.vector_embeddings)
+    app_module.groq_client = FakeLLM('groq', args.llm_latency_ms, args.llm_jitter,
+                                     failure_rate=args.groq_failure_rate, seed=args.seed)
+    app_module.claude = FakeLLM('claude', args.llm_latency_ms, args.llm_jitter, seed=args.seed + 1)
+    if args.no_response_cache:
+        app_module.response_cache.ttl = 0
+    # One process stands in for one worker: its /chat admission limits apply as in production
+    app_module.chat_rate_limiter.per_second = args.chat_rate_limit / 60.0
+    if args.chat_max_concurrent:
+        app_module.chat_admission.max_concurrent = args.chat_max_concurrent
+
+    # Keep every trace in memory for the per-stage breakdown
+    tracing.tracer.exporter = tracing.MemoryExporter()
+    tracing.tracer.sample_rate = 1.0
+    return app_module, database, tracing, log_counter
+
+
+def seed(database, args, rng):
+    """Fill the stand-in store: a document corpus with embeddings and a history of daily readings"""
+    from compliance_rules import get_active_rules
+    from temperature import rebuild_rollups, save_readings
+
+    database.vector_embeddings.delete_many({})
+    for index in range(args.corpus_size):
+        document = corpus_document(index, rng)
+        document['embedding'] = database.generate_embedding(document['content'])
+        database.vector_embeddings.insert_one(document)
+
+    today = date.today()
+    readings = [reading_for(today - timedelta(days=offset), rng) for offset in range(args.history_days)]
+    rules = get_active_rules(database.db, use_cache=False)
+    for reading, (compliance, is_compliant) in zip(readings, rules.evaluate_records(readings)):
+        reading.update(compliance=compliance, is_compliant=is_compliant, rules_version=rules.version)
+    for start in range(0, len(readings), 62):
+        save_readings(database.db, readings[start:start + 62])
+    rebuild_rollups(database.db)
+
+
+def run_scenario(app, scenario, args, rng_seed):
+    """Issue args.requests requests from args.concurrency threads; returns (latencies, statuses, elapsed)"""
+    local = threading.local()
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            with local.client.session_transaction() as session:
+                session['profile'] = {'user_id': f"bench-{threading.get_ident()}", 'email': 'bench@example.com'}
+        return local.client
+
+    def one(index):
+        test_client = client()
+        # Seeded per request, so the request sequence does not depend on thread scheduling
+        method, url, body = scenario(random.Random(f"{rng_seed}-{index}"), index)
+        start = perf_counter()
+        response = test_client.open(url, method=method, json=body)
+        response.get_data()
+        elapsed = perf_counter() - start
+        ok = response.status_code < 400
+        if ok and response.is_json and isinstance(response.json, dict) and response.json.get('success') is False:
+            ok = False
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code if ok else f"{response.status_code}-failed"] += 1
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    return latencies, statuses, perf_counter() - started
+
+
+def stage_summaries(traces):
+    """Per span name: latency summary and error count across the traces of one scenario"""
+    durations = defaultdict(list)
+    errors = Counter()
+    for trace in traces:
+        durations[trace['name']].append(trace['duration_ms'] / 1000)
+        for span in trace['spans']:
+            durations[span['name']].append(span['duration_ms'] / 1000)
+            if span['status'] == 'error':
+                errors[span['name']] += 1
+    return {name: {**summarize(values), 'errors': errors[name]} for name, values in sorted(durations.items())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIO_NAMES),
+                        help=f"comma separated subset of {', '.join(SCENARIO_NAMES)}")
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    parser.add_argument('--encoder', choices=['real', 'fake'], default='real')
+    parser.add_argument('--embed-latency-ms', type=float, default=0, help='added delay for the fake encoder')
+    parser.add_argument('--llm-latency-ms', type=float, default=800)
+    parser.add_argument('--llm-jitter', type=float, default=0.25, help='lognormal sigma of the LLM delay')
+    parser.add_argument('--groq-failure-rate', type=float, default=0.05,
+                        help='share of Groq calls that fail over to Claude')
+    parser.add_argument('--corpus-size', type=int, default=200)
+    parser.add_argument('--history-days', type=int, default=365)
+    parser.add_argument('--no-response-cache', action='store_true', help='disable the temperature response cache')
+    parser.add_argument('--chat-max-concurrent', type=int, default=0,
+                        help='override CHAT_MAX_CONCURRENT (503s show up in the statuses)')
+    parser.add_argument('--chat-rate-limit', type=float, default=0,
+                        help='chats per minute per client thread (default 0: rate limiting off)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--log-handler', choices=['queue', 'sync'], default='queue',
+                        help='queue: production QueueHandler; sync: format and write in the request thread')
+    parser.add_argument('--log-format', choices=['json', 'text'], default='json')
+    parser.add_argument('--log-output', default=os.devnull, help='where log lines are written')
+    parser.add_argument('--log-sample-rates', help='override LOG_SAMPLE_RATES, e.g. search=1,chat=1')
+    parser.add_argument('--output', help='result file (default benchmarks/results/e2e-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIO_NAMES)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(args.seed)
+    app_module, database, tracing, log_counter = load_app(args)
+    seed(database, args, rng)
+    scenarios = Scenarios(date.today(), args.history_days)
+    meta = run_metadata(vars(args))
+
+    results = {}
+    for name in names:
+        scenario = getattr(scenarios, name)
+        if args.warmup:
+            warmup_args = argparse.Namespace(**{**vars(args), 'requests': args.warmup})
+            run_scenario(app_module.app, scenario, warmup_args, f"{args.seed}-warmup")
+        database.chat_writer.flush()
+        tracing.tracer.exporter.traces.clear()
+        logged_before = log_counter.count
+
+        latencies, statuses, elapsed = run_scenario(app_module.app, scenario, args, args.seed)
+        database.chat_writer.flush()
+        results[name] = {
+            'requests': len(latencies),
+            'concurrency': args.concurrency,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+            'latency_ms': summarize(latencies),
+            'statuses': {str(status): count for status, count in statuses.items()},
+            'stages': stage_summaries(list(tracing.tracer.exporter.traces)),
+            'log_records_per_request': round((log_counter.count - logged_before) / max(len(latencies), 1), 2),
+        }
+        latency = results[name]['latency_ms']
+        print(f"{name:<24} {results[name]['throughput_rps']:>8} req/s  "
+              f"p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f} ms  {dict(statuses)}  "
+              f"{results[name]['log_records_per_request']} log records/request")
+        for stage, summary in results[name]['stages'].items():
+            print(f"    {stage:<22} n={summary['count']:<5} p50 {summary['p50']:.1f}  "
+                  f"p95 {summary['p95']:.1f}  p99 {summary['p99']:.1f} ms  errors={summary['errors']}")
+
+    database.chat_writer.close()
+    path = write_results('e2e', meta, results, args.output)
+    print(f"Results written to {path}")
+
+    if args.compare:
+        print(f"Compared with {args.compare}:")
+        print_comparison(compare(load_results(args.compare), {'results': results}))
+
+
+if __name__ == '__main__':
+    main()
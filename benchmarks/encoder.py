@@ -0,0 +1,277 @@
+"""
+Encoder microbenchmark and regression gate.
+
+Sweeps batch size, sequence length, torch thread count and inference backend
+over the production encoder (embeddings.py: same model, tokenization and
+mean pooling) and records per-batch latency, texts/second and peak RSS for
+each case. Backends:
+
+    torch        eager PyTorch, as served by generate_embedding()
+    torchscript  torch.jit.trace of the same model
+    int8         dynamic int8 quantization of the Linear layers
+    onnx         ONNX Runtime, when onnxruntime is installed
+
+Each backend's vectors are compared with the eager ones; `max_drift` is the
+largest 1 - cosine similarity seen, so a pooling or model change that moves
+embeddings shows up next to the speed numbers. The `production` case times
+embed_text() itself, including its per-call garbage collection.
+
+    python -m benchmarks.encoder
+    python -m benchmarks.encoder --batch-sizes 1,8,32 --seq-lengths 32,128 --threads 1,2
+    python -m benchmarks.encoder --baseline benchmarks/baselines/encoder.json --tolerance 0.25
+    python -m benchmarks.encoder --update-baseline benchmarks/baselines/encoder.json
+
+With --baseline the run exits with status 1 when a case's p50 latency is
+more than --tolerance (or its peak RSS more than --rss-tolerance) above the
+baseline. Baselines are machine specific: record them on the machine that
+runs the gate.
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+import numpy as np
+import psutil
+import torch
+
+from benchmarks.report import compare, load_results, print_comparison, run_metadata, summarize, write_results
+from embeddings import MAX_TOKENS, embed_text, encode_batch, load_encoder, mean_pool, tokenize
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+BACKENDS = ['torch', 'torchscript', 'int8', 'onnx']
+WORDS = ("mesenchymal stem cells harvested from wharton's jelly are expanded and infused to support "
+         "repair of orthopedic autoimmune cardiovascular and neurological conditions").split()
+
+
+class RSSSampler:
+    """Polls the process RSS on a thread; peak is the highest value seen while running"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start_rss = self.peak_rss = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+
+def texts_of_length(tokenizer, tokens, count):
+    """count distinct texts that tokenize to at least `tokens` tokens"""
+    texts = []
+    for index in range(count):
+        words = [WORDS[(index + offset) % len(WORDS)] for offset in range(tokens)]
+        text = ' '.join(words)
+        while len(tokenizer(text)['input_ids']) < tokens:
+            text += ' ' + WORDS[len(text) % len(WORDS)]
+        texts.append(text)
+    return texts
+
+
+def build_backend(name, tokenizer, model, sample_inputs):
+    """Return forward(inputs) -> last_hidden_state for a backend, or None if unavailable"""
+    if name == 'torch':
+        return lambda inputs: model(**inputs).last_hidden_state
+
+    if name == 'torchscript':
+        _, traced_source = load_encoder(torchscript=True)
+        traced = torch.jit.trace(
+            traced_source, (sample_inputs['input_ids'], sample_inputs['attention_mask']), strict=False)
+        traced = torch.jit.freeze(traced.eval())
+        return lambda inputs: traced(inputs['input_ids'], inputs['attention_mask'])[0]
+
+    if name == 'int8':
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return lambda inputs: quantized(**inputs).last_hidden_state
+
+    if name == 'onnx':
+        if onnxruntime is None:
+            return None
+        path = os.path.join(tempfile.mkdtemp(prefix='encoder-onnx-'), 'encoder.onnx')
+        _, export_source = load_encoder(torchscript=True)  # tuple outputs export cleanly
+        torch.onnx.export(
+            export_source, (sample_inputs['input_ids'], sample_inputs['attention_mask']), path,
+            input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'tokens'}, 'attention_mask': {0: 'batch', 1: 'tokens'},
+                          'last_hidden_state': {0: 'batch', 1: 'tokens'}},
+            opset_version=14,
+        )
+        options = onnxruntime.SessionOptions()
+        session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+        def forward(inputs):
+            hidden, = session.run(None, {
+                'input_ids': inputs['input_ids'].numpy(),
+                'attention_mask': inputs['attention_mask'].numpy(),
+            })
+            return torch.from_numpy(hidden)
+        return forward
+
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def encode_with(forward, texts, tokenizer, max_tokens):
+    inputs = tokenize(texts, tokenizer, max_tokens=max_tokens, max_chars=None)
+    with torch.inference_mode():
+        return mean_pool(forward(inputs), inputs['attention_mask']).numpy()
+
+
+def max_drift(vectors, reference):
+    """Largest 1 - cosine similarity between matching rows"""
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    return float(np.max(1 - np.sum(vectors * reference, axis=1)))
+
+
+def time_case(run, iterations, warmup):
+    """Latencies of `iterations` calls after `warmup` unmeasured ones, with the RSS peak"""
+    for _ in range(warmup):
+        run()
+    gc.collect()
+    latencies = []
+    with RSSSampler() as sampler:
+        for _ in range(iterations):
+            start = perf_counter()
+            run()
+            latencies.append(perf_counter() - start)
+    return latencies, sampler
+
+
+def case_result(latencies, sampler, batch_size):
+    total = sum(latencies)
+    return {
+        'latency_ms': summarize(latencies),
+        'texts_per_second': round(batch_size * len(latencies) / total, 2) if total else None,
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+        'rss_growth_mb': round((sampler.peak_rss - sampler.start_rss) / 1024 / 1024, 1),
+    }
+
+
+def print_case(case, result):
+    latency = result['latency_ms']
+    drift = f"  drift {result['max_drift']:.2e}" if 'max_drift' in result else ''
+    print(f"{case:<28} p50 {latency['p50']:8.2f}  p95 {latency['p95']:8.2f}  p99 {latency['p99']:8.2f} ms  "
+          f"{result['texts_per_second']:>9} texts/s  peak {result['peak_rss_mb']} MB{drift}")
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def check_regressions(baseline, results, tolerance, rss_tolerance):
+    """Return a message per case slower (p50) or larger (peak RSS) than the baseline allows"""
+    failures = []
+    for case, result in results.items():
+        before = baseline['results'].get(case)
+        if not before:
+            continue
+        allowed = before['latency_ms']['p50'] * (1 + tolerance)
+        if result['latency_ms']['p50'] > allowed:
+            failures.append(f"{case}: p50 {result['latency_ms']['p50']:.2f} ms > "
+                            f"{allowed:.2f} ms (baseline {before['latency_ms']['p50']:.2f} ms +{tolerance:.0%})")
+        allowed_rss = before['peak_rss_mb'] * (1 + rss_tolerance)
+        if result['peak_rss_mb'] > allowed_rss:
+            failures.append(f"{case}: peak RSS {result['peak_rss_mb']:.1f} MB > {allowed_rss:.1f} MB "
+                            f"(baseline {before['peak_rss_mb']:.1f} MB +{rss_tolerance:.0%})")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backends', default='torch,torchscript,int8,onnx', help=f"subset of {', '.join(BACKENDS)}")
+    parser.add_argument('--batch-sizes', type=int_list, default=[1, 8, 32])
+    parser.add_argument('--seq-lengths', type=int_list, default=[32, MAX_TOKENS],
+                        help=f"tokens per text; production truncates at {MAX_TOKENS}")
+    parser.add_argument('--threads', type=int_list, default=sorted({1, min(4, os.cpu_count() or 1)}))
+    parser.add_argument('--iterations', type=int, default=30, help='measured batches per case')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='result file (default benchmarks/results/encoder-<commit>-<time>.json)')
+    parser.add_argument('--baseline', help='fail if slower than this result file allows')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 slowdown, 0.25 = 25%%')
+    parser.add_argument('--rss-tolerance', type=float, default=0.20, help='allowed peak RSS growth')
+    parser.add_argument('--update-baseline', metavar='PATH', help='also write this run as the baseline')
+    args = parser.parse_args(argv)
+
+    backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+
+    tokenizer, model = load_encoder()
+    sample = tokenize(texts_of_length(tokenizer, 16, 2), tokenizer, max_chars=None)
+    results = {}
+
+    # The served path: one text at a time through embed_text()
+    production_text = texts_of_length(tokenizer, MAX_TOKENS, 1)[0]
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        latencies, sampler = time_case(lambda: embed_text(production_text, tokenizer, model),
+                                       args.iterations, args.warmup)
+        case = f"production/b1/s{MAX_TOKENS}/t{threads}"
+        results[case] = case_result(latencies, sampler, 1)
+        print_case(case, results[case])
+
+    for backend in backends:
+        forward = build_backend(backend, tokenizer, model, sample)
+        if forward is None:
+            print(f"Skipping {backend}: not installed")
+            continue
+        for seq_length in args.seq_lengths:
+            for batch_size in args.batch_sizes:
+                texts = texts_of_length(tokenizer, seq_length, batch_size)
+                reference = encode_batch(texts, tokenizer, model, max_tokens=seq_length, max_chars=None)
+                drift = max_drift(encode_with(forward, texts, tokenizer, seq_length), reference)
+                for threads in args.threads:
+                    torch.set_num_threads(threads)
+                    latencies, sampler = time_case(lambda: encode_with(forward, texts, tokenizer, seq_length),
+                                                   args.iterations, args.warmup)
+                    case = f"{backend}/b{batch_size}/s{seq_length}/t{threads}"
+                    results[case] = {**case_result(latencies, sampler, batch_size), 'max_drift': round(drift, 6)}
+                    print_case(case, results[case])
+        del forward
+        gc.collect()
+
+    meta = run_metadata({**vars(args), 'torch': torch.__version__,
+                         'onnxruntime': onnxruntime.__version__ if onnxruntime else None})
+    path = write_results('encoder', meta, results, args.output)
+    print(f"Results written to {path}")
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.update_baseline)), exist_ok=True)
+        write_results('encoder', meta, results, args.update_baseline)
+        print(f"Baseline updated: {args.update_baseline}")
+
+    if args.baseline:
+        baseline = load_results(args.baseline)
+        print(f"Compared with {args.baseline}:")
+        print_comparison(compare(baseline, {'results': results}))
+        failures = check_regressions(baseline, results, args.tolerance, args.rss_tolerance)
+        if failures:
+            print("Encoder regression gate FAILED:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("Encoder regression gate passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Shared result handling for the benchmark scripts: latency summaries, run
+metadata, JSON result files and comparisons between two runs.
+
+Result files are plain JSON so runs from different commits can be diffed:
+
+    {"benchmark": "e2e", "meta": {"commit": "...", "started_at": "...", ...},
+     "results": {"<case>": {"latency_ms": {"p50": .., "p95": .., "p99": ..}, ...}}}
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(seconds):
+    """count/mean/p50/p95/p99/max in milliseconds for a list of durations in seconds"""
+    if not len(seconds):
+        return {'count': 0}
+    values = np.asarray(seconds, dtype=float) * 1000
+    summary = {'count': int(values.size), 'mean': round(float(values.mean()), 3)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f'p{percentile}'] = round(float(value), 3)
+    summary['max'] = round(float(values.max()), 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_metadata(arguments):
+    return {
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': arguments,
+    }
+
+
+def write_results(benchmark, meta, results, path=None):
+    """Write a result file (default benchmarks/results/<benchmark>-<commit>-<time>.json) and return its path"""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(RESULTS_DIR, f"{benchmark}-{meta.get('commit') or 'nocommit'}-{stamp}.json")
+    with open(path, 'w') as result_file:
+        json.dump({'benchmark': benchmark, 'meta': meta, 'results': results}, result_file, indent=2, default=str)
+    return path
+
+
+def load_results(path):
+    with open(path) as result_file:
+        return json.load(result_file)
+
+
+def compare(baseline, current, key='latency_ms', fields=('p50', 'p95', 'p99')):
+    """
+    Rows of (case, field, baseline, current, change_pct) for every case and
+    latency field present in both runs.
+    """
+    rows = []
+    for case, result in current['results'].items():
+        before = baseline['results'].get(case, {}).get(key)
+        after = result.get(key)
+        if not before or not after:
+            continue
+        for field in fields:
+            if field in before and field in after and before[field]:
+                rows.append((case, field, before[field], after[field],
+                             round((after[field] - before[field]) / before[field] * 100, 1)))
+    return rows
+
+
+def print_comparison(rows):
+    for case, field, before, after, change in rows:
+        print(f"  {case:<40} {field:>4}: {before:10.2f} -> {after:10.2f} ms ({change:+.1f}%)")
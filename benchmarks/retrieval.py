@@ -0,0 +1,335 @@
+"""
+Offline retrieval evaluation for semantic_search.
+
+Scores every retrieval backend on a labeled query set and measures its
+latency alongside, so limit, model, truncation and index choices can be
+decided on numbers:
+
+    exact    brute-force cosine over the snapshot in NumPy (ground truth for the vectors)
+    ann      IVF index (spherical k-means lists, probing the nprobe nearest), swept over nprobe
+    hybrid   BM25 over title + content fused with the exact vector ranking (reciprocal rank fusion)
+    atlas    the production $search knnBeta query against the live vector_embeddings collection
+
+Metrics per backend and k: recall@k, MRR@k and nDCG@k (graded relevance),
+per-query search latency (query embedding excluded, reported once), and for
+the approximate backends the share of the exact top-k they return.
+
+Work from a local snapshot of vector_embeddings:
+
+    python -m benchmarks.retrieval --export-snapshot benchmarks/data/corpus.npz
+    python -m benchmarks.retrieval --snapshot benchmarks/data/corpus.npz
+    python -m benchmarks.retrieval --snapshot corpus.npz --reembed --max-tokens 64 --max-chars 256
+    python -m benchmarks.retrieval --snapshot corpus.npz --backends exact,atlas --ks 1,3,5,10
+
+The query set is JSON lines, one query with the titles (or _ids) of its
+relevant documents and a relevance grade for each:
+
+    {"query": "How are mesenchymal stem cells collected?", "relevant": {"MSC Harvesting Procedure": 2}}
+
+--reembed re-encodes the snapshot with --model/--max-chars/--max-tokens
+instead of using the stored vectors, to compare encoder settings.
+"""
+
+import argparse
+import json
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.report import run_metadata, summarize, write_results
+from embeddings import MAX_INPUT_CHARS, MAX_TOKENS, MODEL_NAME, encode_batch, load_encoder
+
+DEFAULT_QUERIES = 'benchmarks/data/retrieval_queries.jsonl'
+BACKENDS = ['exact', 'ann', 'hybrid', 'atlas']
+RRF_K = 60
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+# Snapshots
+
+def export_snapshot(collection, path):
+    """Write every document with an embedding to a compressed .npz; returns the document count"""
+    documents, vectors = [], []
+    for doc in collection.find({'embedding': {'$exists': True}}, {'title': 1, 'content': 1, 'category': 1, 'embedding': 1}):
+        documents.append({'_id': str(doc['_id']), 'title': doc.get('title', ''),
+                          'content': doc.get('content', ''), 'category': doc.get('category', '')})
+        vectors.append(doc['embedding'])
+    np.savez_compressed(path, embeddings=np.asarray(vectors, dtype=np.float32),
+                        documents=np.array(json.dumps(documents)))
+    return len(documents)
+
+
+def load_snapshot(path):
+    with np.load(path) as snapshot:
+        return json.loads(str(snapshot['documents'])), snapshot['embeddings'].astype(np.float32)
+
+
+def load_queries(path):
+    with open(path) as query_file:
+        return [json.loads(line) for line in query_file if line.strip()]
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+# Backends: each returns document indexes, best first
+
+class ExactIndex:
+    name = 'exact'
+
+    def __init__(self, vectors):
+        self.vectors = normalize(vectors)
+
+    def search(self, query_vector, k, query_text=None):
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+
+class IVFIndex:
+    """Inverted-file ANN: documents are bucketed under k-means centroids and only nprobe buckets are scanned"""
+
+    def __init__(self, vectors, n_lists=None, nprobe=4, iterations=20, seed=0):
+        self.vectors = normalize(vectors)
+        self.n_lists = n_lists or max(1, int(math.sqrt(len(vectors))))
+        self.nprobe = nprobe
+        self.centroids, assignments = self._train(iterations, seed)
+        self.lists = [np.flatnonzero(assignments == index) for index in range(self.n_lists)]
+        self.name = f'ann/nprobe={nprobe}'
+
+    def _train(self, iterations, seed):
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(len(self.vectors), self.n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            for index in range(self.n_lists):
+                members = self.vectors[assignments == index]
+                if len(members):
+                    centroids[index] = members.mean(axis=0)
+            centroids = normalize(centroids)
+        return centroids, np.argmax(self.vectors @ centroids.T, axis=1)
+
+    def with_nprobe(self, nprobe):
+        clone = object.__new__(IVFIndex)
+        clone.__dict__.update(self.__dict__, nprobe=nprobe, name=f'ann/nprobe={nprobe}')
+        return clone
+
+    def search(self, query_vector, k, query_text=None):
+        probes = np.argsort(-(self.centroids @ query_vector))[:self.nprobe]
+        candidates = np.concatenate([self.lists[probe] for probe in probes])
+        if not len(candidates):
+            return candidates
+        scores = self.vectors[candidates] @ query_vector
+        return candidates[np.argsort(-scores)[:k]]
+
+
+class BM25:
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        tokenized = [TOKEN_PATTERN.findall(text.lower()) for text in texts]
+        self.lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if len(tokenized) else 0.0
+        postings = defaultdict(list)
+        for index, tokens in enumerate(tokenized):
+            for term, count in Counter(tokens).items():
+                postings[term].append((index, count))
+        self.postings = {term: (np.array([i for i, _ in entries]), np.array([c for _, c in entries], dtype=np.float32))
+                         for term, entries in postings.items()}
+        self.size = len(tokenized)
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(TOKEN_PATTERN.findall(query.lower())):
+            if term not in self.postings:
+                continue
+            indexes, counts = self.postings[term]
+            idf = math.log(1 + (self.size - len(indexes) + 0.5) / (len(indexes) + 0.5))
+            norm = counts + self.k1 * (1 - self.b + self.b * self.lengths[indexes] / self.average_length)
+            scores[indexes] += idf * counts * (self.k1 + 1) / norm
+        return scores
+
+
+class HybridIndex:
+    """Reciprocal rank fusion of BM25 and the exact vector ranking"""
+
+    name = 'hybrid'
+
+    def __init__(self, documents, vectors, depth=50):
+        self.exact = ExactIndex(vectors)
+        self.bm25 = BM25([f"{doc['title']} {doc['content']}" for doc in documents])
+        self.depth = depth
+
+    def search(self, query_vector, k, query_text=None):
+        depth = min(self.depth, self.bm25.size)
+        fused = defaultdict(float)
+        for rank, index in enumerate(self.exact.search(query_vector, depth)):
+            fused[int(index)] += 1 / (RRF_K + rank + 1)
+        lexical = self.bm25.scores(query_text or '')
+        for rank, index in enumerate(np.argsort(-lexical)[:depth]):
+            if lexical[index] > 0:
+                fused[int(index)] += 1 / (RRF_K + rank + 1)
+        return np.array(sorted(fused, key=fused.get, reverse=True)[:k])
+
+
+class AtlasIndex:
+    """The production knnBeta query; maps results back to snapshot positions by _id"""
+
+    name = 'atlas'
+
+    def __init__(self, documents):
+        from database import vector_embeddings, vector_search_pipeline
+        self.collection = vector_embeddings
+        self.pipeline = vector_search_pipeline
+        self.positions = {doc['_id']: index for index, doc in enumerate(documents)}
+
+    def search(self, query_vector, k, query_text=None):
+        results = self.collection.aggregate(self.pipeline(query_vector.tolist(), k))
+        return np.array([self.positions[str(doc['_id'])] for doc in results if str(doc['_id']) in self.positions])
+
+
+# Metrics
+
+def relevance_for(query, documents):
+    """{document index: grade} for a labeled query; labels match titles or _ids"""
+    labels = query['relevant']
+    if isinstance(labels, list):
+        labels = {label: 1 for label in labels}
+    grades = {}
+    for index, doc in enumerate(documents):
+        grade = labels.get(doc['_id'], labels.get(doc['title']))
+        if grade:
+            grades[index] = grade
+    return grades
+
+
+def score_ranking(ranking, grades, k):
+    """(recall@k, reciprocal rank@k, nDCG@k) for one ranked list"""
+    top = [int(index) for index in ranking[:k]]
+    found = [index for index in top if index in grades]
+    recall = len(found) / len(grades)
+    reciprocal_rank = next((1 / (rank + 1) for rank, index in enumerate(top) if index in grades), 0.0)
+    dcg = sum((2 ** grades.get(index, 0) - 1) / math.log2(rank + 2) for rank, index in enumerate(top))
+    ideal = sorted(grades.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return recall, reciprocal_rank, dcg / idcg if idcg else 0.0
+
+
+def evaluate(index, queries, query_vectors, grades, ks, exact_rankings=None):
+    """
+    Quality per k and search latency for one backend. With exact_rankings,
+    also the share of the exact top-k the backend returned (ANN recall).
+    """
+    depth = max(ks)
+    totals = {k: np.zeros(3) for k in ks}
+    overlap = 0.0
+    latencies = []
+    for position, (query, vector, query_grades) in enumerate(zip(queries, query_vectors, grades)):
+        start = perf_counter()
+        ranking = index.search(vector, depth, query['query'])
+        latencies.append(perf_counter() - start)
+        for k in ks:
+            totals[k] += score_ranking(ranking, query_grades, k)
+        if exact_rankings is not None:
+            expected = set(int(i) for i in exact_rankings[position][:depth])
+            overlap += len(expected & set(int(i) for i in ranking[:depth])) / max(len(expected), 1)
+    count = len(queries)
+    quality = {f'@{k}': {'recall': round(totals[k][0] / count, 4), 'mrr': round(totals[k][1] / count, 4),
+                         'ndcg': round(totals[k][2] / count, 4)} for k in ks}
+    result = {'quality': quality, 'latency_ms': summarize(latencies)}
+    if exact_rankings is not None:
+        result[f'exact_overlap@{depth}'] = round(overlap / count, 4)
+    return result
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--export-snapshot', metavar='PATH', help='export vector_embeddings to PATH and exit')
+    parser.add_argument('--snapshot', help='.npz corpus snapshot to evaluate against')
+    parser.add_argument('--queries', default=DEFAULT_QUERIES, help='labeled queries (JSON lines)')
+    parser.add_argument('--backends', default='exact,ann,hybrid', help=f"subset of {', '.join(BACKENDS)}")
+    parser.add_argument('--ks', type=int_list, default=[1, 3, 5, 10])
+    parser.add_argument('--nprobe', type=int_list, default=[1, 2, 4, 8], help='IVF lists probed, swept')
+    parser.add_argument('--n-lists', type=int, help='IVF lists (default sqrt of the corpus size)')
+    parser.add_argument('--model', default=MODEL_NAME, help='encoder for queries (and documents with --reembed)')
+    parser.add_argument('--max-chars', type=int, default=MAX_INPUT_CHARS)
+    parser.add_argument('--max-tokens', type=int, default=MAX_TOKENS)
+    parser.add_argument('--reembed', action='store_true', help='re-encode the snapshot instead of using stored vectors')
+    parser.add_argument('--output', help='result file (default benchmarks/results/retrieval-<commit>-<time>.json)')
+    args = parser.parse_args(argv)
+
+    if args.export_snapshot:
+        from database import vector_embeddings
+        count = export_snapshot(vector_embeddings, args.export_snapshot)
+        print(f"Exported {count} documents to {args.export_snapshot}")
+        return
+    if not args.snapshot:
+        parser.error('--snapshot is required (create one with --export-snapshot)')
+
+    backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+
+    documents, vectors = load_snapshot(args.snapshot)
+    queries = load_queries(args.queries)
+    grades = [relevance_for(query, documents) for query in queries]
+    unmatched = [query['query'] for query, query_grades in zip(queries, grades) if not query_grades]
+    if unmatched:
+        print(f"Skipping {len(unmatched)} queries with no relevant document in the snapshot")
+    queries = [query for query, query_grades in zip(queries, grades) if query_grades]
+    grades = [query_grades for query_grades in grades if query_grades]
+    if not queries:
+        sys.exit("No labeled query matches a document in the snapshot")
+
+    tokenizer, model = load_encoder(args.model)
+    if args.reembed:
+        texts = [doc['content'] for doc in documents]
+        vectors = np.concatenate([encode_batch(texts[start:start + 64], tokenizer, model, args.max_tokens, args.max_chars)
+                                  for start in range(0, len(texts), 64)])
+    start = perf_counter()
+    query_vectors = normalize(encode_batch([query['query'] for query in queries], tokenizer, model,
+                                           args.max_tokens, args.max_chars))
+    embed_seconds = perf_counter() - start
+
+    indexes = []
+    for backend in backends:
+        if backend == 'exact':
+            indexes.append(ExactIndex(vectors))
+        elif backend == 'ann':
+            ivf = IVFIndex(vectors, n_lists=args.n_lists)
+            indexes.extend(ivf.with_nprobe(nprobe) for nprobe in args.nprobe if nprobe <= ivf.n_lists)
+        elif backend == 'hybrid':
+            indexes.append(HybridIndex(documents, vectors))
+        elif backend == 'atlas':
+            indexes.append(AtlasIndex(documents))
+
+    exact = ExactIndex(vectors)
+    exact_rankings = [exact.search(vector, max(args.ks)) for vector in query_vectors]
+    results = {}
+    for index in indexes:
+        reference = None if isinstance(index, ExactIndex) else exact_rankings
+        results[index.name] = evaluate(index, queries, query_vectors, grades, args.ks, reference)
+        quality = results[index.name]['quality']
+        latency = results[index.name]['latency_ms']
+        cells = '  '.join(f"{k} R {quality[k]['recall']:.3f} MRR {quality[k]['mrr']:.3f} nDCG {quality[k]['ndcg']:.3f}"
+                          for k in quality)
+        print(f"{index.name:<16} {cells}  p50 {latency['p50']:.2f} ms  p99 {latency['p99']:.2f} ms")
+
+    meta = run_metadata({**vars(args), 'documents': len(documents), 'queries': len(queries),
+                         'query_embedding_ms_per_query': round(embed_seconds * 1000 / len(queries), 3)})
+    path = write_results('retrieval', meta, results, args.output)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Local stand-ins for the external services the app talks to, so benchmarks
+run on one machine without Atlas, Groq or Anthropic:
+
+- MongoDB: every MongoClient created after install_mongo() is one shared
+  in-memory mongomock client. Atlas-only features get minimal local
+  equivalents: `$substrBytes` is mapped to `$substr`, and LocalVectorCollection
+  answers the `$search`/knnBeta stage with an exact cosine scan in numpy.
+- LLM providers: FakeLLM answers both the OpenAI-style (Groq) and the
+  Anthropic-style call with a canned response after a scripted, seeded delay,
+  and can fail a share of calls to exercise the Claude fallback.
+- Encoder: fake_embedding() hashes words into a normalized 384-d vector, for
+  machines without the sentence-transformers model.
+
+install_mongo() has to run before `database` is imported; the other pieces
+are patched onto the imported modules by the benchmark scripts.
+"""
+
+import hashlib
+import random
+import re
+import threading
+from time import sleep
+from types import SimpleNamespace
+
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 384
+
+
+def install_mongo():
+    """Route every pymongo MongoClient to one shared mongomock client; returns it"""
+    import mongomock
+    import mongomock.aggregate
+    import pymongo
+    import pymongo.mongo_client
+
+    shared = mongomock.MongoClient()
+
+    def local_client(*args, **kwargs):
+        return shared
+
+    pymongo.MongoClient = local_client
+    pymongo.mongo_client.MongoClient = local_client
+
+    # Atlas and MongoDB 4.4+ accept $substrBytes; the pipelines only use it on ASCII dates
+    parser = mongomock.aggregate._Parser
+    if not getattr(parser, '_substr_bytes_patched', False):
+        handle_string_operator = parser._handle_string_operator
+
+        def _handle_string_operator(self, operator, values):
+            if operator == '$substrBytes':
+                operator = '$substr'
+            return handle_string_operator(self, operator, values)
+
+        parser._handle_string_operator = _handle_string_operator
+        parser._substr_bytes_patched = True
+    return shared
+
+
+class LocalVectorCollection:
+    """
+    Wraps a mongomock collection and serves Atlas `$search` knnBeta queries
+    with an exact cosine scan. Everything else is passed through.
+    """
+
+    def __init__(self, collection, path='embedding'):
+        self._collection = collection
+        self._path = path
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._documents = None
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def insert_one(self, document, *args, **kwargs):
+        self._invalidate()
+        return self._collection.insert_one(document, *args, **kwargs)
+
+    def insert_many(self, documents, *args, **kwargs):
+        self._invalidate()
+        return self._collection.insert_many(documents, *args, **kwargs)
+
+    def create_search_index(self, *args, **kwargs):
+        return 'default'
+
+    def _invalidate(self):
+        with self._lock:
+            self._matrix = None
+            self._documents = None
+
+    def _load(self):
+        with self._lock:
+            if self._matrix is None:
+                documents = list(self._collection.find({self._path: {'$exists': True}}))
+                vectors = np.asarray([doc[self._path] for doc in documents], dtype=np.float32)
+                if len(documents):
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                self._matrix = vectors.reshape(len(documents), -1)
+                self._documents = documents
+            return self._matrix, self._documents
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        if not pipeline or '$search' not in pipeline[0]:
+            return self._collection.aggregate(pipeline, *args, **kwargs)
+        knn = pipeline[0]['$search']['knnBeta']
+        matrix, documents = self._load()
+        if not documents:
+            return iter([])
+        query = np.asarray(knn['vector'], dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        # Atlas reports cosine similarity rescaled to 0..1
+        scores = (matrix @ query + 1) / 2
+        k = min(int(knn.get('k', 10)), len(documents))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = [dict(documents[index], _score=float(scores[index])) for index in top]
+        for stage in pipeline[1:]:
+            if '$project' in stage:
+                results = [_project(doc, stage['$project']) for doc in results]
+            elif '$limit' in stage:
+                results = results[:stage['$limit']]
+            else:
+                raise NotImplementedError(f"Stage after $search not supported locally: {list(stage)}")
+        for doc in results:
+            doc.pop('_score', None)
+        return iter(results)
+
+
+def _project(document, projection):
+    projected = {'_id': document['_id']} if projection.get('_id', 1) else {}
+    for field, spec in projection.items():
+        if field == '_id':
+            continue
+        if isinstance(spec, dict) and spec.get('$meta') == 'searchScore':
+            projected[field] = document['_score']
+        elif spec and field in document:
+            projected[field] = document[field]
+    projected['_score'] = document['_score']
+    return projected
+
+
+class FakeLLM:
+    """
+    Canned completions with a lognormal delay around latency_ms (seeded, so a
+    run is reproducible). failure_rate raises on that share of calls.
+    Usable both as the Groq (OpenAI) client and the Anthropic client.
+    """
+
+    def __init__(self, name, latency_ms=800, jitter=0.25, failure_rate=0.0, response_words=60, seed=0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.response_words = response_words
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._openai_create))
+        self.messages = SimpleNamespace(create=self._anthropic_create)
+
+    def _respond(self, messages):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms * self._random.lognormvariate(0, self.jitter) / 1000 if self.latency_ms else 0
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        sleep(delay)
+        if failed:
+            raise RuntimeError(f"{self.name}: scripted failure")
+        question = messages[-1]['content'] if messages else ''
+        words = (f"<span style=\"color:#0066cc\">MSCs</span> answer to: {question} ".split() * self.response_words)
+        return ' '.join(words[:self.response_words])
+
+    def _openai_create(self, model=None, messages=None, **kwargs):
+        text = self._respond(messages or [])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    def _anthropic_create(self, model=None, messages=None, **kwargs):
+        text = self._respond(messages or [])
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+
+def fake_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    """Normalized hashed bag of words: texts sharing words get similar vectors"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"[a-z0-9']+", text.lower()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
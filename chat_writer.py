@@ -0,0 +1,247 @@
+"""
+Write-behind persistence for chat logs.
+
+Chat records are accepted into an in-memory queue and written to MongoDB in
+batches with insert_many from a background thread, so the /chat request never
+waits on the database. Batches that cannot be written are appended to a local
+JSONL spill file and replayed on the next successful flush.
+"""
+
+import atexit
+import glob
+import logging
+import os
+import queue
+import threading
+from time import monotonic, time
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from logging_setup import log_event
+from metrics import CHAT_WRITE_QUEUE, MONGO_WRITE_SECONDS, record_mongo_write, timed
+
+try:
+    import fcntl  # POSIX only, used to serialise access to the spill file
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ChatWriteBehind:
+    """Queue chat records and flush them to a collection in batches"""
+
+    def __init__(self, collection, batch_size=50, flush_interval=2.0,
+                 max_queue_size=10000, spill_path='/tmp/auragens_chat_spill.jsonl'):
+        self.collection = collection
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.05, float(flush_interval))
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {'queued': 0, 'written': 0, 'spilled': 0, 'replayed': 0, 'batches': 0}
+
+    def submit(self, record):
+        """Accept a chat record for persistence and return its pre-assigned _id"""
+        record.setdefault('_id', ObjectId())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            self._count('queued')
+            CHAT_WRITE_QUEUE.set(self._queue.qsize())
+        except queue.Full:
+            logger.warning("⚠️ Chat write queue full, spilling record to disk")
+            self._spill([record])
+        return record['_id']
+
+    def _count(self, key, amount=1):
+        # Updated from request threads and the writer thread
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        """Stop the background thread and flush what is left in the queue"""
+        self._stop.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 1)
+        remaining = self._queue.qsize()
+        if remaining:
+            logger.info(f"Flushing {remaining} queued chat records before shutdown...")
+        self.flush()
+
+    def _ensure_started(self):
+        # The thread is started lazily so that it belongs to the gunicorn
+        # worker process rather than to a parent that forked it.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                if self._stop.is_set():
+                    break
+            if batch:
+                self._write(batch)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._write_lock:
+            start = time()
+            try:
+                self._insert(batch)
+            except Exception as e:
+                logger.error(f"❌ Error writing {len(batch)} chat records, spilling to {self.spill_path}: {str(e)}")
+                self._spill(batch)
+                return False
+            self._count('written', len(batch))
+            self._count('batches')
+            CHAT_WRITE_QUEUE.set(self._queue.qsize())
+            log_event(logger, 'chat_writer', 'chat records flushed', records=len(batch),
+                      duration_s=round(time() - start, 3), pending=self._queue.qsize())
+            self._replay_spill()
+            return True
+
+    def _insert(self, batch):
+        try:
+            with timed(MONGO_WRITE_SECONDS, operation='chats'):
+                self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Records carry their _id from submit(), so a duplicate key means
+            # the record was already written by an earlier (replayed) flush.
+            errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != DUPLICATE_KEY_ERROR for err in errors):
+                raise
+        record_mongo_write('chats', len(batch))
+
+    def _spill(self, records):
+        try:
+            spill_dir = os.path.dirname(self.spill_path)
+            if spill_dir:
+                os.makedirs(spill_dir, exist_ok=True)
+            lines = ''.join(json_util.dumps(record) + '\n' for record in records)
+            while True:
+                with open(self.spill_path, 'a') as spill_file:
+                    if fcntl:
+                        fcntl.flock(spill_file, fcntl.LOCK_EX)
+                    # A replay may have moved the file aside while we waited for the lock
+                    try:
+                        current = os.stat(self.spill_path).st_ino == os.fstat(spill_file.fileno()).st_ino
+                    except FileNotFoundError:
+                        current = False
+                    if not current:
+                        continue
+                    spill_file.write(lines)
+                    spill_file.flush()
+                    os.fsync(spill_file.fileno())
+                    break
+            self._count('spilled', len(records))
+        except Exception as e:
+            logger.error(f"❌ Could not spill {len(records)} chat records to {self.spill_path}: {str(e)}")
+
+    def _replay_spill(self):
+        """
+        Move the spill file aside and write its records; a replay file is only
+        deleted once every record in it has been inserted, so a crash or a
+        failed insert leaves it to be replayed on a later flush.
+        """
+        if os.path.exists(self.spill_path):
+            try:
+                with open(self.spill_path, 'r') as spill_file:
+                    if fcntl:
+                        fcntl.flock(spill_file, fcntl.LOCK_EX)  # wait for in-progress spills
+                    os.replace(self.spill_path, f"{self.spill_path}.replay-{os.getpid()}-{int(time() * 1000)}")
+            except FileNotFoundError:
+                pass  # another worker moved it first
+            except Exception as e:
+                logger.error(f"❌ Could not move chat spill file {self.spill_path} aside: {str(e)}")
+
+        for replay_path in sorted(glob.glob(glob.escape(self.spill_path) + '.replay-*')):
+            if not self._replay_file(replay_path):
+                return
+
+    def _replay_file(self, replay_path):
+        try:
+            with open(replay_path, 'r') as replay_file:
+                records = [json_util.loads(line) for line in replay_file if line.strip()]
+        except FileNotFoundError:
+            return True  # replayed by another worker
+        except Exception as e:
+            logger.error(f"❌ Could not read chat replay file {replay_path}: {str(e)}")
+            return False
+
+        if records:
+            logger.info(f"Replaying {len(records)} spilled chat records...")
+        for i in range(0, len(records), self.batch_size):
+            chunk = records[i:i + self.batch_size]
+            try:
+                # Records keep their _id, so chunks written before a failure are skipped as duplicates next time
+                self._insert(chunk)
+            except Exception as e:
+                logger.error(f"❌ Replay of spilled chat records failed, keeping {replay_path}: {str(e)}")
+                return False
+            self._count('replayed', len(chunk))
+
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
+        if records:
+            logger.info(f"✅ Replayed {len(records)} spilled chat records")
+        return True
+
+
+def create_chat_writer(collection):
+    """Build a write-behind writer configured from the environment"""
+    writer = ChatWriteBehind(
+        collection,
+        batch_size=int(os.getenv('CHAT_WRITE_BATCH_SIZE', '50')),
+        flush_interval=float(os.getenv('CHAT_WRITE_FLUSH_INTERVAL', '2.0')),
+        max_queue_size=int(os.getenv('CHAT_WRITE_QUEUE_SIZE', '10000')),
+        spill_path=os.getenv('CHAT_SPILL_PATH', '/tmp/auragens_chat_spill.jsonl'),
+    )
+    atexit.register(writer.close)
+    return writer
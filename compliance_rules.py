@@ -0,0 +1,325 @@
+"""
+Server-side compliance evaluation for the temperature tracker.
+
+Acceptable ranges live in the `compliance_rules` collection as immutable,
+numbered versions; the highest version is active:
+
+    {
+        "_id": 3,                                   # version
+        "ranges": {"refrigerator": {"low": 2, "high": 8}, "ln2": {"low": 60, "high": 100}, ...},
+        "devices": {"freezer-ult-1": {"freezer": {"low": -86, "high": -70}}},
+        "created_at": datetime, "created_by": "...", "note": "..."
+    }
+
+`devices` overrides the default range for a parameter on a specific data
+logger. Until a version is published, REFERENCE_RANGES from temperature.py
+act as version 0.
+
+Evaluation is vectorized with numpy: a daily record is reduced to
+(parameter, device, min, max) observations, every observation of a batch is
+checked against its bounds in one pass, and the results are folded back per
+record and parameter. reevaluate_records() re-applies the active version to
+stored days in bulk after the rules change:
+    python compliance_rules.py --reevaluate [START_DATE END_DATE]
+"""
+
+import logging
+import math
+import sys
+from datetime import datetime
+from time import monotonic
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from temperature import PARAMETERS, PARAMETER_FIELDS, REFERENCE_RANGES, rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+RULES_COLLECTION = 'compliance_rules'
+# Workers pick up a newly published version within this many seconds
+RULES_CACHE_SECONDS = 30
+# Records fetched and updated per round trip during re-evaluation
+REEVALUATE_BATCH_SIZE = 1000
+
+
+def _bound(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"Range bounds must be finite numbers or null, got {value!r}")
+    return float(value)
+
+
+def _parse_range(parameter, spec):
+    if not isinstance(spec, dict):
+        raise ValueError(f"Range for {parameter} must be an object with low and high")
+    low, high = _bound(spec.get('low')), _bound(spec.get('high'))
+    if low is not None and high is not None and low > high:
+        raise ValueError(f"Range for {parameter} has low above high")
+    return {'low': low, 'high': high}
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class RuleSet:
+    """One version of the compliance ranges"""
+
+    def __init__(self, version, ranges, devices=None):
+        self.version = version
+        self.ranges = ranges
+        self.devices = devices or {}
+
+    @classmethod
+    def default(cls):
+        return cls(0, {param: {'low': low, 'high': high} for param, (low, high) in REFERENCE_RANGES.items()})
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document['_id'], document['ranges'], document.get('devices'))
+
+    def to_dict(self):
+        return {'version': self.version, 'ranges': self.ranges, 'devices': self.devices}
+
+    def range_for(self, parameter, device_id=None):
+        """(low, high) for a parameter, with -inf/inf for open ends"""
+        spec = self.devices.get(device_id, {}).get(parameter) if device_id else None
+        spec = spec or self.ranges[parameter]
+        low = -math.inf if spec['low'] is None else spec['low']
+        high = math.inf if spec['high'] is None else spec['high']
+        return low, high
+
+    def bounds(self, parameters, device_ids):
+        """Arrays of low and high bounds for each (parameter, device) pair"""
+        lookup = {}
+        lows = np.empty(len(parameters))
+        highs = np.empty(len(parameters))
+        for index, key in enumerate(zip(parameters, device_ids)):
+            if key not in lookup:
+                lookup[key] = self.range_for(*key)
+            lows[index], highs[index] = lookup[key]
+        return lows, highs
+
+    def evaluate(self, parameters, device_ids, minimums, maximums):
+        """
+        Vectorized check of observations; each is compliant when its minimum
+        and maximum are both inside the range. NaN values are never compliant.
+        """
+        lows, highs = self.bounds(parameters, device_ids)
+        minimums = np.asarray(minimums, dtype=float)
+        maximums = np.asarray(maximums, dtype=float)
+        return (minimums >= lows) & (maximums <= highs)
+
+    def evaluate_points(self, documents):
+        """Boolean array: is each sensor_readings document inside its range"""
+        if not documents:
+            return np.zeros(0, dtype=bool)
+        values = [doc['value'] for doc in documents]
+        return self.evaluate(
+            [doc['meta']['parameter'] for doc in documents],
+            [doc['meta']['device_id'] for doc in documents],
+            values, values
+        )
+
+    def evaluate_records(self, records):
+        """
+        Return [(compliance, is_compliant), ...] for daily records. Parameters
+        with nothing to judge are left out of compliance; a record with no
+        observations at all is not compliant.
+        """
+        record_index, parameter_index = [], []
+        parameters, device_ids, minimums, maximums = [], [], [], []
+        for index, record in enumerate(records):
+            for parameter, device_id, low_value, high_value in observations_for(record):
+                record_index.append(index)
+                parameter_index.append(PARAMETERS.index(parameter))
+                parameters.append(parameter)
+                device_ids.append(device_id)
+                minimums.append(low_value)
+                maximums.append(high_value)
+
+        compliant = np.ones((len(records), len(PARAMETERS)), dtype=bool)
+        present = np.zeros((len(records), len(PARAMETERS)), dtype=bool)
+        if parameters:
+            ok = self.evaluate(parameters, device_ids, minimums, maximums)
+            cells = (np.asarray(record_index), np.asarray(parameter_index))
+            np.logical_and.at(compliant, cells, ok)
+            present[cells] = True
+
+        results = []
+        for index in range(len(records)):
+            compliance = {
+                parameter: bool(compliant[index, column])
+                for column, parameter in enumerate(PARAMETERS) if present[index, column]
+            }
+            results.append((compliance, bool(compliance) and all(compliance.values())))
+        return results
+
+
+def observations_for(record):
+    """
+    (parameter, device_id, min, max) for everything a daily record is judged on:
+    per-device extremes for sensor-derived days, the entered value otherwise.
+    """
+    summary = record.get('sensor_summary') or {}
+    if record.get('source') == 'sensor' and summary:
+        for parameter, stats in summary.items():
+            if parameter not in PARAMETERS:
+                continue
+            for device_id, device_stats in (stats.get('by_device') or {}).items():
+                yield parameter, device_id, device_stats['min'], device_stats['max']
+        return
+    for parameter, field in PARAMETER_FIELDS.items():
+        if field in record:
+            value = _to_float(record[field])
+            yield parameter, None, value, value
+
+
+_cache = {'rules': None, 'loaded_at': 0.0}
+
+
+def get_active_rules(db, use_cache=True):
+    """The highest published RuleSet, or the defaults if none has been published"""
+    if use_cache and _cache['rules'] is not None and monotonic() - _cache['loaded_at'] < RULES_CACHE_SECONDS:
+        return _cache['rules']
+    rules = RuleSet.default()
+    try:
+        document = db[RULES_COLLECTION].find_one(sort=[('_id', -1)])
+        if document:
+            rules = RuleSet.from_document(document)
+    except Exception as e:
+        logger.error(f"Error loading compliance rules, using defaults: {str(e)}")
+        if _cache['rules'] is not None:
+            return _cache['rules']
+    _cache['rules'] = rules
+    _cache['loaded_at'] = monotonic()
+    return rules
+
+
+def list_rule_versions(db, limit=20):
+    return [
+        {**RuleSet.from_document(document).to_dict(),
+         'created_at': document.get('created_at'), 'created_by': document.get('created_by'), 'note': document.get('note', '')}
+        for document in db[RULES_COLLECTION].find().sort('_id', -1).limit(limit)
+    ]
+
+
+def publish_rules(db, ranges=None, devices=None, created_by=None, note=''):
+    """
+    Validate and store a new version built from the active one: `ranges`
+    replaces individual default ranges, `devices` replaces the device
+    overrides as a whole when given. Raises ValueError on bad input.
+    """
+    current = get_active_rules(db, use_cache=False)
+    new_ranges = {param: dict(spec) for param, spec in current.ranges.items()}
+    for parameter, spec in (ranges or {}).items():
+        if parameter not in PARAMETERS:
+            raise ValueError(f"Unknown parameter: {parameter}")
+        new_ranges[parameter] = _parse_range(parameter, spec)
+
+    new_devices = current.devices
+    if devices is not None:
+        if not isinstance(devices, dict):
+            raise ValueError("devices must map device ids to ranges")
+        new_devices = {}
+        for device_id, device_ranges in devices.items():
+            if '.' in device_id or device_id.startswith('$'):
+                raise ValueError(f"Invalid device id: {device_id}")
+            if not isinstance(device_ranges, dict):
+                raise ValueError(f"Ranges for device {device_id} must be an object")
+            for parameter, spec in device_ranges.items():
+                if parameter not in PARAMETERS:
+                    raise ValueError(f"Unknown parameter for device {device_id}: {parameter}")
+                new_devices.setdefault(device_id, {})[parameter] = _parse_range(parameter, spec)
+
+    document = {
+        '_id': current.version + 1,
+        'ranges': new_ranges,
+        'devices': new_devices,
+        'created_at': datetime.utcnow(),
+        'created_by': created_by,
+        'note': note,
+    }
+    try:
+        db[RULES_COLLECTION].insert_one(document)
+    except DuplicateKeyError:
+        raise ValueError("Another rules version was published at the same time, reload and retry")
+
+    rules = RuleSet.from_document(document)
+    _cache['rules'] = rules
+    _cache['loaded_at'] = monotonic()
+    logger.info(f"Published compliance rules version {rules.version}")
+    return rules
+
+
+def reevaluate_records(db, rules=None, start_date=None, end_date=None):
+    """
+    Recompute compliance and is_compliant on stored daily records with the
+    active (or given) rules, in batches, writing only the days whose flags
+    changed. Monthly rollups are rebuilt for the months that changed.
+    Returns {'checked': n, 'updated': n, 'months': [...]}.
+    """
+    rules = rules or get_active_rules(db, use_cache=False)
+    query = {}
+    if start_date or end_date:
+        query['date'] = {}
+        if start_date:
+            query['date']['$gte'] = start_date
+        if end_date:
+            query['date']['$lte'] = end_date
+    projection = {field: 1 for field in PARAMETER_FIELDS.values()}
+    projection.update({'date': 1, 'source': 1, 'sensor_summary': 1, 'compliance': 1, 'is_compliant': 1})
+
+    checked = 0
+    updated = 0
+    months = set()
+    cursor = db.temperature_records.find(query, projection).sort('date', 1).batch_size(REEVALUATE_BATCH_SIZE)
+    batch = []
+    for record in cursor:
+        batch.append(record)
+        if len(batch) >= REEVALUATE_BATCH_SIZE:
+            updated += _reevaluate_batch(db, rules, batch, months)
+            checked += len(batch)
+            batch = []
+    if batch:
+        updated += _reevaluate_batch(db, rules, batch, months)
+        checked += len(batch)
+
+    for month in sorted(months):
+        rebuild_rollups(db, month, month)
+    logger.info(f"Re-evaluated {checked} temperature records with rules v{rules.version}, {updated} changed")
+    return {'checked': checked, 'updated': updated, 'months': sorted(months), 'rules_version': rules.version}
+
+
+def _reevaluate_batch(db, rules, records, months):
+    operations = []
+    for record, (compliance, is_compliant) in zip(records, rules.evaluate_records(records)):
+        if compliance == record.get('compliance') and is_compliant == record.get('is_compliant'):
+            continue
+        operations.append(UpdateOne(
+            {'_id': record['_id']},
+            {'$set': {'compliance': compliance, 'is_compliant': is_compliant, 'rules_version': rules.version}}
+        ))
+        months.add(record['date'][:7])
+    if operations:
+        db.temperature_records.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--reevaluate' not in sys.argv or len(arguments) not in (0, 2):
+        print("Usage: python compliance_rules.py --reevaluate [START_DATE END_DATE]")
+        sys.exit(1)
+
+    from database import db
+
+    result = reevaluate_records(db, None, *arguments)
+    print(f"Checked {result['checked']} records with rules v{result['rules_version']}, updated {result['updated']}")
@@ -0,0 +1,73 @@
+"""
+Compact storage for long text fields.
+
+Long values are stored as BSON binary compressed with zstd. `zstandard` is
+pinned in requirements.txt so every worker writes the same codec; zlib is
+only the fallback for environments installed without it, and each row
+records its codec so either can be read back. A document field
+`<name>` holding plain text is replaced by `<name>_z` (the compressed bytes),
+`<name>_codec` and `<name>_size` (original UTF-8 length); short values are
+kept as plain text because compressing them costs more than it saves.
+"""
+
+import zlib
+
+from bson.binary import Binary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Values shorter than this many UTF-8 bytes are stored uncompressed
+COMPRESSION_THRESHOLD = 256
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+DEFAULT_CODEC = 'zstd' if zstandard else 'zlib'
+
+
+def compress_text(text, codec=DEFAULT_CODEC):
+    """Compress text, returning the compressed bytes"""
+    raw = text.encode('utf-8')
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    if codec == 'zlib':
+        return zlib.compress(raw, ZLIB_LEVEL)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def decompress_text(data, codec):
+    """Reverse compress_text"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed fields")
+        return zstandard.ZstdDecompressor().decompress(bytes(data)).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(bytes(data)).decode('utf-8')
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def pack_text_field(document, field, text):
+    """Store text in document[field], compressed when it is long enough to benefit"""
+    size = len(text.encode('utf-8'))
+    if size < COMPRESSION_THRESHOLD:
+        document[field] = text
+        return document
+
+    document[f'{field}_z'] = Binary(compress_text(text))
+    document[f'{field}_codec'] = DEFAULT_CODEC
+    document[f'{field}_size'] = size
+    return document
+
+
+def unpack_text_field(document, field):
+    """Return the text stored by pack_text_field, decompressing if needed"""
+    if f'{field}_z' in document:
+        return decompress_text(document[f'{field}_z'], document[f'{field}_codec'])
+    return document.get(field, '')
+
+
+def packed_projection(field):
+    """Projection entries needed to read a field written by pack_text_field"""
+    return {field: 1, f'{field}_z': 1, f'{field}_codec': 1}
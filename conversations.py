@@ -0,0 +1,235 @@
+"""
+Conversation threads for multi-turn chat.
+
+Each thread is one document in the `conversations` collection:
+
+    {
+        "_id": "<thread id>",
+        "user_id": "...",
+        "turn_count": 12,
+        "recent_turns": [{"turn": 5, "user": "...", "assistant": "..."}, ...],
+        "summary": "Rolling summary of turns 1..summarized_through",
+        "summarized_through": 4,
+        "created_at": datetime, "updated_at": datetime
+    }
+
+Turns that fall out of the context window are folded into the summary a
+batch at a time: the summarizer only sees the previous summary plus the new
+turns, never the whole history. A turn stays in recent_turns until
+summarized_through has passed it, so a thread document stays small however
+long the conversation runs and nothing is lost while the summarizer is
+failing or behind. Summaries are refreshed by one background worker per
+process, at most one pending refresh per thread.
+"""
+
+import logging
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from metrics import MONGO_WRITE_SECONDS, record_mongo_write, timed
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Turns always eligible for the prompt (subject to the token budget)
+CONTEXT_WINDOW_TURNS = int(os.getenv('CONVERSATION_WINDOW_TURNS', '6'))
+# Turns folded into the summary at a time once they leave the window
+SUMMARY_BATCH_TURNS = int(os.getenv('CONVERSATION_SUMMARY_BATCH', '4'))
+# Approximate prompt budget for summary + history, in tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '1500'))
+
+# Hard ceiling on stored turns, only reached if summaries fail for a long time;
+# it keeps the thread document far below MongoDB's 16 MB limit
+MAX_STORED_TURNS = int(os.getenv('CONVERSATION_MAX_STORED_TURNS', '200'))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + 4
+
+
+def new_thread_id():
+    return uuid.uuid4().hex
+
+
+@traced()
+def load_conversation(collection, thread_id, user_id):
+    """Return the thread document if it exists and belongs to user_id, else None"""
+    if collection is None or not thread_id:
+        return None
+    try:
+        conversation = collection.find_one({'_id': thread_id})
+    except Exception as e:
+        logger.error(f"Error loading conversation {thread_id}: {str(e)}")
+        return None
+    if conversation and conversation.get('user_id') != user_id:
+        logger.warning(f"⚠️ Conversation {thread_id} does not belong to user {user_id[:5]}, starting a new one")
+        return None
+    return conversation
+
+
+def build_context(conversation, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Return (summary, messages) for the prompt. Messages are the newest unsummarized
+    turns that fit in the token budget left after the summary, oldest first.
+    """
+    if not conversation:
+        return '', []
+
+    summary = conversation.get('summary', '')
+    remaining = token_budget - (estimate_tokens(summary) if summary else 0)
+    summarized_through = conversation.get('summarized_through', 0)
+
+    selected = []
+    for turn in reversed(conversation.get('recent_turns', [])):
+        if turn['turn'] <= summarized_through:
+            break
+        cost = estimate_tokens(turn['user']) + estimate_tokens(turn['assistant'])
+        if cost > remaining:
+            break
+        remaining -= cost
+        selected.append(turn)
+
+    messages = []
+    for turn in reversed(selected):
+        messages.append({'role': 'user', 'content': turn['user']})
+        messages.append({'role': 'assistant', 'content': turn['assistant']})
+    return summary, messages
+
+
+@traced()
+def record_turn(collection, thread_id, user_id, user_message, response, summarizer=None):
+    """
+    Append a turn to the thread in a single upsert and return its turn number.
+    If enough turns have left the window, a summary refresh is queued.
+    """
+    if collection is None:
+        return None
+    now = datetime.utcnow()
+    # A pipeline update numbers the turn from the stored turn_count, so two
+    # concurrent turns on one thread get consecutive numbers, and drops only
+    # the turns the summary already covers
+    update = [
+        {'$set': {
+            'user_id': {'$ifNull': ['$user_id', {'$literal': user_id}]},
+            'created_at': {'$ifNull': ['$created_at', now]},
+            'summary': {'$ifNull': ['$summary', '']},
+            'summarized_through': {'$ifNull': ['$summarized_through', 0]},
+            'turn_count': {'$add': [{'$ifNull': ['$turn_count', 0]}, 1]},
+            'updated_at': now,
+        }},
+        {'$set': {'recent_turns': {'$concatArrays': [
+            {'$filter': {
+                'input': {'$ifNull': ['$recent_turns', []]},
+                'as': 'turn',
+                'cond': {'$gt': ['$$turn.turn', '$summarized_through']}
+            }},
+            [{'turn': '$turn_count', 'user': {'$literal': user_message}, 'assistant': {'$literal': response}}]
+        ]}}},
+        {'$set': {'recent_turns': {'$slice': ['$recent_turns', -MAX_STORED_TURNS]}}},
+    ]
+    try:
+        with timed(MONGO_WRITE_SECONDS, operation='conversations'):
+            conversation = collection.find_one_and_update(
+                {'_id': thread_id}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        record_mongo_write('conversations')
+    except Exception as e:
+        logger.error(f"Error recording turn for conversation {thread_id}: {str(e)}")
+        return None
+
+    if summarizer and _turns_to_summarize(conversation):
+        summary_worker.submit(collection, thread_id, summarizer)
+    return conversation['turn_count']
+
+
+def _turns_to_summarize(conversation):
+    summarized_through = conversation.get('summarized_through', 0)
+    cutoff = conversation['turn_count'] - CONTEXT_WINDOW_TURNS
+    if cutoff - summarized_through < SUMMARY_BATCH_TURNS:
+        return []
+    return [turn for turn in conversation.get('recent_turns', [])
+            if summarized_through < turn['turn'] <= cutoff]
+
+
+def refresh_summary(collection, conversation, summarizer):
+    """Fold turns that left the window into the rolling summary"""
+    turns = _turns_to_summarize(conversation)
+    if not turns:
+        return False
+    previous_summary = conversation.get('summary', '')
+    try:
+        summary = summarizer(previous_summary, turns)
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation['_id']}: {str(e)}")
+        return False
+    if not summary:
+        return False
+
+    # Only apply if no other worker has advanced the summary in the meantime
+    result = collection.update_one(
+        {'_id': conversation['_id'], 'summarized_through': conversation.get('summarized_through', 0)},
+        {'$set': {'summary': summary, 'summarized_through': turns[-1]['turn']}}
+    )
+    if result.modified_count:
+        logger.info(f"Conversation {conversation['_id'][:8]} summarized through turn {turns[-1]['turn']}")
+    return bool(result.modified_count)
+
+
+class SummaryWorker:
+    """One background thread refreshing summaries, with at most one pending refresh per thread"""
+
+    def __init__(self, max_queue_size=1000):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, collection, thread_id, summarizer):
+        """Queue a refresh of thread_id unless one is already waiting; never blocks"""
+        self._ensure_started()
+        with self._lock:
+            if thread_id in self._pending:
+                return False
+            self._pending.add(thread_id)
+        try:
+            self._queue.put_nowait((collection, thread_id, summarizer))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(thread_id)
+            logger.error(f"Summary queue full, not refreshing conversation {thread_id[:8]} now")
+            return False
+        return True
+
+    def _ensure_started(self):
+        # Started lazily so the thread belongs to the gunicorn worker
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='conversation-summaries', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            collection, thread_id, summarizer = self._queue.get()
+            # Turns recorded while this was queued are picked up by the refresh
+            with self._lock:
+                self._pending.discard(thread_id)
+            try:
+                conversation = collection.find_one({'_id': thread_id})
+                if conversation:
+                    refresh_summary(collection, conversation, summarizer)
+            except Exception as e:
+                logger.error(f"Error refreshing summary for conversation {thread_id[:8]}: {str(e)}")
+
+
+summary_worker = SummaryWorker()
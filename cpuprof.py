@@ -0,0 +1,191 @@
+"""
+Sampling CPU profiler for live workers.
+
+A background thread wakes CPU_PROFILE_HZ times a second, reads the stack of
+every other thread in the process with sys._current_frames() and counts
+identical stacks. Nothing is hooked into the profiled code, so the cost is
+the sampler's own wake-ups (well under a few percent at 100 Hz) and it can be
+switched on in a serving worker without a restart.
+
+The result is a collapsed-stack ("folded") file, one stack per line, root
+first, with its sample count:
+
+    MainThread;handle (gunicorn/workers/sync.py);chat (app.py);semantic_search (database.py);... 42
+
+which flamegraph.pl, speedscope or inferno render directly. Time spent in
+native code (torch kernels, tokenizers, the pymongo socket) is attributed to
+the Python frame that called it. Waiting threads are sampled too; their
+stacks end in the wait (queue.get, Event.wait), so filter by the root
+(thread name) frame when only request threads matter.
+
+A profile runs in the worker that received the request for `seconds`, while
+that worker keeps serving traffic. It is written to CPU_PROFILE_DIR as
+<profile_id>.folded, where any worker can serve it once it is complete.
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from time import monotonic, sleep, time
+
+logger = logging.getLogger(__name__)
+
+CPU_PROFILE_DIR = os.getenv('CPU_PROFILE_DIR', '/tmp/auragens_profiles')
+CPU_PROFILE_HZ = int(os.getenv('CPU_PROFILE_HZ', '100'))
+CPU_PROFILE_MAX_SECONDS = int(os.getenv('CPU_PROFILE_MAX_SECONDS', '60'))
+# Profiles kept in CPU_PROFILE_DIR; older ones are deleted when a new one starts
+CPU_PROFILE_KEEP = int(os.getenv('CPU_PROFILE_KEEP', '20'))
+MAX_STACK_DEPTH = 128
+
+PROFILE_ID_PATTERN = re.compile(r'^\d+-\d{8}T\d{6}$')
+
+
+def frame_label(code):
+    """'function (package/module.py)' with the path shortened to its last two parts"""
+    path = code.co_filename
+    parts = path.replace('\\', '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(parts[-2:])})"
+
+
+def collapse(frame, depth=MAX_STACK_DEPTH):
+    """Frame labels from the outermost caller to `frame`"""
+    labels = []
+    while frame is not None and len(labels) < depth:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """Counts the stacks of every thread except its own for a fixed duration"""
+
+    def __init__(self, seconds, hz=CPU_PROFILE_HZ):
+        self.seconds = seconds
+        self.interval = 1.0 / max(1, hz)
+        self.stacks = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._thread = threading.Thread(target=self._run, name='cpu-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        started = monotonic()
+        deadline = started + self.seconds
+        while True:
+            now = monotonic()
+            if now >= deadline:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = (names.get(thread_id, f"thread-{thread_id}"), *collapse(frame))
+                self.stacks[stack] += 1
+            self.samples += 1
+            sleep(max(0.0, self.interval - (monotonic() - now)))
+        self.elapsed = monotonic() - started
+        self.on_finish()
+
+    def on_finish(self):
+        pass
+
+    def folded(self):
+        """The profile in collapsed-stack format, heaviest stacks first"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileRecorder(SamplingProfiler):
+    """A SamplingProfiler that writes its result to CPU_PROFILE_DIR when done"""
+
+    def __init__(self, profile_id, seconds, hz=CPU_PROFILE_HZ, directory=CPU_PROFILE_DIR):
+        super().__init__(seconds, hz)
+        self.profile_id = profile_id
+        self.directory = directory
+
+    def on_finish(self):
+        path = profile_path(self.profile_id, self.directory)
+        try:
+            with open(path + '.tmp', 'w') as profile_file:
+                profile_file.write(self.folded())
+            os.replace(path + '.tmp', path)
+            os.remove(running_path(self.profile_id, self.directory))
+        except OSError as e:
+            logger.error(f"❌ Could not write CPU profile {self.profile_id}: {str(e)}")
+            return
+        logger.info(f"CPU profile {self.profile_id}: {self.samples} samples over {self.elapsed:.1f}s, "
+                    f"{len(self.stacks)} distinct stacks")
+
+
+def profile_path(profile_id, directory=CPU_PROFILE_DIR):
+    return os.path.join(directory, f"{profile_id}.folded")
+
+
+def running_path(profile_id, directory=CPU_PROFILE_DIR):
+    return os.path.join(directory, f"{profile_id}.running")
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def start_profile(seconds, hz=CPU_PROFILE_HZ, directory=CPU_PROFILE_DIR):
+    """
+    Start profiling this worker for `seconds` and return the profile id.
+    Raises ValueError for a bad duration or rate and RuntimeError when a
+    profile is already running in this worker.
+    """
+    global _active
+    if not 0 < seconds <= CPU_PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be between 1 and {CPU_PROFILE_MAX_SECONDS}")
+    if not 1 <= hz <= 1000:
+        raise ValueError("hz must be between 1 and 1000")
+    with _active_lock:
+        if _active is not None and _active.is_running():
+            raise RuntimeError(f"Profile {_active.profile_id} is still running in this worker")
+        os.makedirs(directory, exist_ok=True)
+        _prune(directory)
+        profile_id = f"{os.getpid()}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+        if os.path.exists(profile_path(profile_id, directory)):
+            raise RuntimeError(f"Profile {profile_id} already exists; try again in a second")
+        open(running_path(profile_id, directory), 'w').close()
+        _active = ProfileRecorder(profile_id, seconds, hz, directory).start()
+    logger.info(f"CPU profile {profile_id} started for {seconds}s at {hz} Hz")
+    return profile_id
+
+
+def profile_status(profile_id, directory=CPU_PROFILE_DIR):
+    """'complete', 'running', 'failed' (its worker exited first) or None for an unknown profile id"""
+    if not PROFILE_ID_PATTERN.match(profile_id or ''):
+        return None
+    if os.path.exists(profile_path(profile_id, directory)):
+        return 'complete'
+    try:
+        started = os.path.getmtime(running_path(profile_id, directory))
+    except OSError:
+        return None
+    return 'running' if time() - started < CPU_PROFILE_MAX_SECONDS + 30 else 'failed'
+
+
+def _prune(directory):
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.folded')]
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:-CPU_PROFILE_KEEP] if CPU_PROFILE_KEEP else []:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
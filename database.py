@@ -4,7 +4,6 @@ import os
 from dotenv import load_dotenv
 from datetime import datetime
 from bson import ObjectId
-from transformers import AutoTokenizer, AutoModel
 import torch
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
@@ -20,6 +19,18 @@ import sys
 import traceback
 import platform
 import pymongo
+from chat_writer import create_chat_writer
+from db_indexes import reconcile_indexes
+from temperature import rebuild_rollups
+from sensors import create_sensor_collection
+from alerts import ALERT_COLLECTION, create_alert_collection
+from compression import pack_text_field, unpack_text_field, packed_projection
+from embeddings import load_encoder, embed_text
+from db_stats import install_pool_listener
+from logging_setup import log_event
+from metrics import (EMBEDDING_SECONDS, MONGO_WRITE_SECONDS, VECTOR_SEARCH_SECONDS, VECTOR_SEARCH_RESULTS,
+                     record_mongo_write, timed)
+from tracing import span, set_attribute, traced
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,6 +43,10 @@ load_dotenv(override=True)
 print(f"Current working directory: {os.getcwd()}")
 print(f"Environment variables available: {', '.join([k for k in os.environ.keys() if not k.startswith('_')])}")
 
+# Create collections, indexes and seed data on import; tools that must not
+# change the database (python db_indexes.py without --apply) set this to 0
+DATABASE_INIT_ON_IMPORT = os.getenv('DATABASE_INIT_ON_IMPORT', '1').lower() not in ('0', 'false', 'no')
+
 # Get MongoDB URI and X.509 certificate from environment variables
 uri = os.getenv("MONGO_URI")
 if not uri:
@@ -182,8 +197,12 @@ if not uri:
 db = None
 chats = None
 vector_embeddings = None
+conversations = None
 client = None
 
+# Pool metrics for every client created below
+install_pool_listener()
+
 try:
     # Log connection attempt details
     logger.info(f"MongoDB connection attempt - URI: {uri[:30]}... Certificate exists: {cert_exists}, Path: {cert_path}")
@@ -321,14 +340,7 @@ try:
     db = client['Auragens_AI']
     chats = db['chats']
     vector_embeddings = db['vector_embeddings']
-    
-    # Create index for semantic search with error handling
-    try:
-        logger.info("Setting up vector search index...")
-        vector_embeddings.create_index([("embedding", "2dsphere")])
-        logger.info("✅ Vector search index created successfully")
-    except Exception as index_error:
-        logger.error(f"Error creating search index: {str(index_error)}")
+    conversations = db['conversations']
         
 except Exception as e:
     logger.error(f"❌ MongoDB connection error: {str(e)}")
@@ -376,6 +388,10 @@ except Exception as e:
             logger.error("Attempted to list collections but database is unavailable")
             return []
         
+        def list_collections(self, *args, **kwargs):
+            logger.error("Attempted to list collections but database is unavailable")
+            return []
+        
         def create_collection(self, name):
             logger.error(f"Attempted to create collection {name} but database is unavailable")
             return DummyCollection(name)
@@ -394,6 +410,7 @@ except Exception as e:
     db = DummyDB()
     chats = DummyCollection('chats')
     vector_embeddings = DummyCollection('vector_embeddings')
+    conversations = DummyCollection('conversations')
 
 # Set environment variables for better memory management
 os.environ['TRANSFORMERS_CACHE'] = '/tmp/transformers_cache'
@@ -402,38 +419,8 @@ os.environ['HF_HOME'] = '/tmp/huggingface'
 
 # Initialize model with better memory handling
 def initialize_models():
-    logger.info("🔄 Initializing NLP models...")
     try:
-        # Use the smallest possible model to save memory
-        model_name = 'sentence-transformers/paraphrase-MiniLM-L3-v2'  # Very small model
-        
-        # Add memory optimization settings
-        os.environ['PYTORCH_NO_CUDA_MEMORY_CACHING'] = '1'  # Disable CUDA caching
-        
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            cache_dir='/tmp/transformers_cache',
-            local_files_only=False
-        )
-        
-        # Load model with maximum memory optimizations
-        model = AutoModel.from_pretrained(
-            model_name,
-            cache_dir='/tmp/transformers_cache',
-            local_files_only=False,
-            low_cpu_mem_usage=True  # Reduce memory usage
-        )
-        
-        # Move model to CPU and aggressively clear memory
-        model = model.cpu()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        
-        # Force garbage collection
-        gc.collect()
-        
-        logger.info(f"Model loaded: {model_name} (lightweight version)")
-        return tokenizer, model
+        return load_encoder()
     except Exception as e:
         logger.error(f"❌ Error initializing models: {str(e)}")
         raise
@@ -448,127 +435,136 @@ except Exception as model_error:
     tokenizer = None
     model = None
 
-def save_chat(user_id, user_message, bot_response):
+# Chat logs are persisted write-behind so /chat never waits on MongoDB
+chat_writer = create_chat_writer(chats)
+
+@traced('save_chat')
+def save_chat(user_id, user_message, bot_response, thread_id=None, turn=None):
+    """Queue a chat for batched persistence and return its pre-assigned ID"""
     try:
-        # Verify connection before saving
-        logger.info(f"Attempting to save chat for user: {user_id[:5]}...")
-        client.admin.command('ping')
-        
         chat = {
             'user_id': user_id,
             'user_message': user_message,
-            'bot_response': bot_response[:100] + "..." if len(bot_response) > 100 else bot_response,  # Truncate for logging
             'timestamp': datetime.utcnow()
         }
+        if thread_id:
+            chat['thread_id'] = thread_id
+            chat['turn'] = turn
+        # Full response, compressed when long enough to benefit
+        pack_text_field(chat, 'bot_response', bot_response)
         
-        logger.info(f"Inserting chat document into MongoDB: {chat['user_message'][:50]}...")
-        result = chats.insert_one(chat)
-        
-        if result and result.inserted_id:
-            logger.info(f"✅ Chat saved successfully with ID: {result.inserted_id}")
-            return result.inserted_id
-        else:
-            logger.warning("⚠️ No insert_id returned, but no error thrown")
-            return None
-            
+        chat_id = chat_writer.submit(chat)
+        logger.info(f"Queued chat {chat_id} for user {user_id[:5]} ({chat_writer.pending()} pending)")
+        return chat_id
     except Exception as e:
-        logger.error(f"❌ Error saving chat: {str(e)}")
-        logger.info("Attempting to reconnect and retry...")
-        try:
-            # Try to reconnect
-            if isinstance(client, MongoClient):
-                client.admin.command('ping')
-                logger.info("Reconnected to MongoDB successfully")
-                result = chats.insert_one(chat)
-                logger.info(f"✅ Chat saved successfully after retry with ID: {result.inserted_id}")
-                return result.inserted_id
-        except Exception as retry_error:
-            logger.error(f"❌ Retry failed: {str(retry_error)}")
+        logger.error(f"❌ Error queueing chat: {str(e)}")
         return None
 
-def get_user_chats(user_id):
+# Chat history paging: newest first, keyset on (timestamp, _id)
+CHAT_HISTORY_DEFAULT_LIMIT = 20
+CHAT_HISTORY_MAX_LIMIT = 100
+CHAT_HISTORY_PROJECTION = {'user_message': 1, 'timestamp': 1, **packed_projection('bot_response')}
+
+def encode_chat_cursor(chat):
+    """Encode the (timestamp, _id) position of a chat as an opaque cursor"""
+    raw = f"{chat['timestamp'].isoformat()}|{chat['_id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_chat_cursor(cursor):
+    """Decode a cursor from encode_chat_cursor, raising ValueError if malformed"""
     try:
-        return list(chats.find({'user_id': user_id}).sort('timestamp', -1))
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, chat_id = raw.split('|', 1)
+        return datetime.fromisoformat(timestamp), ObjectId(chat_id)
+    except Exception:
+        raise ValueError("Invalid chat history cursor")
+
+def serialize_chat(chat):
+    """Convert a chat document into a JSON-safe dict"""
+    return {
+        'id': str(chat['_id']),
+        'user_message': chat.get('user_message', ''),
+        'bot_response': unpack_text_field(chat, 'bot_response'),
+        'timestamp': chat['timestamp'].isoformat() if chat.get('timestamp') else None
+    }
+
+def get_user_chats(user_id, limit=CHAT_HISTORY_DEFAULT_LIMIT, cursor=None):
+    """
+    Return one page of a user's chats, newest first, and the cursor for the next page.
+    Served from the (user_id, timestamp, _id) index so cost is O(limit).
+    """
+    limit = max(1, min(int(limit), CHAT_HISTORY_MAX_LIMIT))
+    query = {'user_id': user_id}
+    if cursor:
+        before_timestamp, before_id = decode_chat_cursor(cursor)
+        query['$or'] = [
+            {'timestamp': {'$lt': before_timestamp}},
+            {'timestamp': before_timestamp, '_id': {'$lt': before_id}}
+        ]
+    
+    try:
+        page = list(
+            chats.find(query, CHAT_HISTORY_PROJECTION)
+            .sort([('timestamp', -1), ('_id', -1)])
+            .limit(limit + 1)
+        )
     except Exception as e:
-        print(f"Error retrieving chats: {str(e)}")
-        return []
+        logger.error(f"Error retrieving chats: {str(e)}")
+        return [], None
+    
+    next_cursor = encode_chat_cursor(page[limit - 1]) if len(page) > limit else None
+    return [serialize_chat(chat) for chat in page[:limit]], next_cursor
 
-def get_chat_by_id(chat_id):
+def get_chat_by_id(chat_id, user_id=None):
+    """Return a JSON-safe chat with its full bot response, optionally restricted to one user"""
     try:
-        return chats.find_one({'_id': ObjectId(chat_id)})
+        query = {'_id': ObjectId(chat_id)}
+        if user_id is not None:
+            query['user_id'] = user_id
+        chat = chats.find_one(query)
+        return serialize_chat(chat) if chat else None
     except Exception as e:
-        print(f"Error retrieving chat: {str(e)}")
+        logger.error(f"Error retrieving chat: {str(e)}")
         return None
 
+def chat_compression_stats():
+    """Report how much space compressed bot responses save"""
+    try:
+        result = list(chats.aggregate([
+            {'$match': {'bot_response_z': {'$exists': True}}},
+            {'$group': {
+                '_id': '$bot_response_codec',
+                'chats': {'$sum': 1},
+                'original_bytes': {'$sum': '$bot_response_size'},
+                'stored_bytes': {'$sum': {'$binarySize': '$bot_response_z'}}
+            }}
+        ]))
+    except Exception as e:
+        logger.error(f"Error computing chat compression stats: {str(e)}")
+        return {}
+    
+    stats = {}
+    for row in result:
+        stats[row['_id']] = {
+            'chats': row['chats'],
+            'original_bytes': row['original_bytes'],
+            'stored_bytes': row['stored_bytes'],
+            'ratio': round(row['original_bytes'] / row['stored_bytes'], 2) if row['stored_bytes'] else None
+        }
+    return stats
+
 # Function to generate embeddings with memory optimization
 def generate_embedding(text):
+    with span('generate_embedding', chars=len(text)), timed(EMBEDDING_SECONDS):
+        return _generate_embedding(text)
+
+def _generate_embedding(text):
     try:
-        # Limit input text length to conserve memory
-        max_length = 512
-        if len(text) > max_length:
-            logger.info(f"Truncating input text from {len(text)} to {max_length} chars to save memory")
-            text = text[:max_length]
-        
-        # Tokenize with max length limit
-        inputs = tokenizer(
-            text, 
-            padding=True, 
-            truncation=True, 
-            max_length=128,  # Reduced from 256 to save memory
-            return_tensors="pt"
-        )
-        
-        # Move inputs to CPU explicitly
-        inputs = {k: v.cpu() for k, v in inputs.items()}
-        
-        # Generate embeddings with memory optimization
-        with torch.no_grad():
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
-            
-        # Convert to list and clear memory immediately
-        result = embeddings[0].cpu().numpy().tolist()
-        
-        # Force aggressive garbage collection
-        del inputs, outputs, embeddings
-        torch.cuda.empty_cache() if torch.cuda.is_available() else None
-        gc.collect()
-            
-        return result
+        return embed_text(text, tokenizer, model)
     except Exception as e:
         logger.error(f"❌ Error generating embedding: {str(e)}")
-        # Try to free memory even if there's an error
-        gc.collect()
-        torch.cuda.empty_cache() if torch.cuda.is_available() else None
         raise
 
-# Add monitoring class
-class SearchMetrics:
-    def __init__(self):
-        self.total_searches = 0
-        self.total_time = 0
-        self.successful_searches = 0
-        self.failed_searches = 0
-        
-    def log_search(self, duration: float, success: bool, results_count: int):
-        self.total_searches += 1
-        self.total_time += duration
-        if success:
-            self.successful_searches += 1
-        else:
-            self.failed_searches += 1
-        
-        logger.info(f"""
-🔍 Search Metrics:
-   - Duration: {duration:.3f}s
-   - Results found: {results_count}
-   - Success rate: {(self.successful_searches/self.total_searches)*100:.1f}%
-   - Avg response time: {(self.total_time/self.total_searches)*1000:.2f}ms
-""")
-
-# Initialize metrics
-search_metrics = SearchMetrics()
-
 def setup_vector_search():
     """Set up or update the vector search index"""
     try:
@@ -595,55 +591,46 @@ def setup_vector_search():
         logger.error(f"❌ Error creating vector search index: {str(e)}")
         return False
 
-def semantic_search(query: str, limit: int = 5) -> List[Dict[str, Any]]:
-    start_time = time()
-    try:
-        logger.info(f"🔄 Processing search query: '{query[:50]}...'")
-        query_embedding = generate_embedding(query)
-        
-        results = vector_embeddings.aggregate([
-            {
-                "$search": {
-                    "index": "default",
-                    "knnBeta": {
-                        "vector": query_embedding,
-                        "path": "embedding",
-                        "k": limit
-                    }
-                }
-            },
-            {
-                "$project": {
-                    "title": 1,
-                    "content": 1,
-                    "category": 1,
-                    "score": { "$meta": "searchScore" }
+def vector_search_pipeline(query_embedding, limit):
+    """Atlas knnBeta search for the `limit` nearest documents, with their search score"""
+    return [
+        {
+            "$search": {
+                "index": "default",
+                "knnBeta": {
+                    "vector": query_embedding,
+                    "path": "embedding",
+                    "k": limit
                 }
             }
-        ])
-        
-        results_list = list(results)
-        duration = time() - start_time
-        
-        # Log detailed results
-        if results_list:
-            scores = [doc.get('score', 0) for doc in results_list]
-            logger.info(f"""
-📊 Search Results:
-   - Query: '{query[:50]}...'
-   - Found: {len(results_list)} documents
-   - Top score: {max(scores):.3f}
-   - Avg score: {sum(scores)/len(scores):.3f}
-   - Categories: {set(doc.get('category') for doc in results_list)}
-""")
+        },
+        {
+            "$project": {
+                "title": 1,
+                "content": 1,
+                "category": 1,
+                "score": { "$meta": "searchScore" }
+            }
+        }
+    ]
+
+def semantic_search(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    try:
+        with span('semantic_search', limit=limit), timed(VECTOR_SEARCH_SECONDS):
+            log_event(logger, 'search', 'search query', level=logging.DEBUG, query=query[:50], limit=limit)
+            query_embedding = generate_embedding(query)
+            
+            with span('vector_search'):
+                results_list = list(vector_embeddings.aggregate(vector_search_pipeline(query_embedding, limit)))
+            set_attribute('results', len(results_list))
         
-        search_metrics.log_search(duration, True, len(results_list))
+        VECTOR_SEARCH_RESULTS.inc(len(results_list))
+        log_event(logger, 'search', 'search completed', results=len(results_list),
+                  top_score=max((doc.get('score', 0) for doc in results_list), default=None))
         return results_list
         
     except Exception as e:
-        duration = time() - start_time
         logger.error(f"❌ Search failed: {str(e)}")
-        search_metrics.log_search(duration, False, 0)
         return []
 
 def insert_document_with_embedding(title: str, content: str, category: str) -> bool:
@@ -674,14 +661,11 @@ def insert_document_with_embedding(title: str, content: str, category: str) -> b
             
         # Verify we can reach the database
         client.admin.command('ping')
-        logger.info("✅ Database connection verified before document insertion")
     except Exception as conn_error:
         logger.error(f"❌ Database connection failed before document insertion: {str(conn_error)}")
         return False
     
     try:
-        logger.info(f"📝 Processing document for vector database: '{title}'")
-        
         # Generate embedding with timing and memory tracking
         embed_start = time()
         start_mem = psutil.Process().memory_info().rss / 1024 / 1024 if 'psutil' in sys.modules else 0
@@ -697,7 +681,8 @@ def insert_document_with_embedding(title: str, content: str, category: str) -> b
             end_mem = psutil.Process().memory_info().rss / 1024 / 1024 if 'psutil' in sys.modules else 0
             mem_diff = end_mem - start_mem
             
-            logger.info(f"✅ Generated embedding in {embed_time:.3f}s | Size: {len(embedding)} | Memory use: {mem_diff:.1f}MB")
+            log_event(logger, 'upload', 'document embedded', level=logging.DEBUG, title=title,
+                      embed_s=round(embed_time, 3), dimensions=len(embedding), memory_mb=round(mem_diff, 1))
         except Exception as embed_error:
             logger.error(f"❌ Embedding generation failed: {str(embed_error)}")
             # Free memory and attempt to continue
@@ -715,42 +700,30 @@ def insert_document_with_embedding(title: str, content: str, category: str) -> b
         
         # Insert document with timing
         insert_start = time()
-        result = vector_embeddings.insert_one(document)
+        with span('insert_document'), timed(MONGO_WRITE_SECONDS, operation='vector_embeddings'):
+            result = vector_embeddings.insert_one(document)
+        record_mongo_write('vector_embeddings')
         insert_time = time() - insert_start
         total_time = time() - start_time
         
         if result and result.inserted_id:
-            logger.info(f"""
-✅ Document inserted successfully:
-   - ID: {result.inserted_id}
-   - Title: {title}
-   - Category: {category}
-   - Total processing time: {total_time:.3f}s
-   - Embedding generation: {embed_time:.3f}s
-   - Database insertion: {insert_time:.3f}s
-   - Embedding size: {len(embedding)}
-""")
+            log_event(logger, 'upload', 'document inserted', document_id=str(result.inserted_id), title=title,
+                      doc_category=category, duration_s=round(total_time, 3), embed_s=round(embed_time, 3),
+                      insert_s=round(insert_time, 3))
             return True
         else:
             logger.error(f"❌ Document insertion failed: No insert ID returned")
             return False
         
     except Exception as e:
-        logger.error(f"""
-❌ Document insertion failed:
-   - Title: {title}
-   - Error: {str(e)}
-   - Error type: {type(e).__name__}
-   - Duration: {time() - start_time:.3f}s
-""")
-        # Log stack trace for debugging
-        logger.error(f"Stack trace: {traceback.format_exc()}")
+        logger.error(f"❌ Document insertion failed: {type(e).__name__}: {str(e)}", exc_info=True,
+                     extra={'title': title, 'duration_s': round(time() - start_time, 3)})
         return False
 
 # Initialize database and collections after successful connection
 def initialize_database_structure():
     """Initialize the database collections and indexes"""
-    if not db:
+    if db is None:
         logger.error("Database not initialized")
         return False
     
@@ -762,9 +735,7 @@ def initialize_database_structure():
     if 'chats' not in collections:
         try:
             db.create_collection('chats')
-            db.chats.create_index([('user_id', 1)])
-            db.chats.create_index([('timestamp', -1)])
-            logger.info("Created chats collection with indexes")
+            logger.info("Created chats collection")
         except Exception as e:
             logger.error(f"Error creating chats collection: {str(e)}")
             success = False
@@ -773,8 +744,7 @@ def initialize_database_structure():
     if 'users' not in collections:
         try:
             db.create_collection('users')
-            db.users.create_index([('user_id', 1)], unique=True)
-            logger.info("Created users collection with user_id index")
+            logger.info("Created users collection")
         except Exception as e:
             logger.error(f"Error creating users collection: {str(e)}")
             success = False
@@ -783,9 +753,7 @@ def initialize_database_structure():
     if 'vector_embeddings' not in collections:
         try:
             db.create_collection('vector_embeddings')
-            db.vector_embeddings.create_index([('title', 1)])
-            db.vector_embeddings.create_index([('category', 1)])
-            logger.info("Created vector_embeddings collection with indexes")
+            logger.info("Created vector_embeddings collection")
             
             # Now let's create a vector search index
             setup_vector_search()
@@ -797,25 +765,52 @@ def initialize_database_structure():
     if 'temperature_records' not in collections:
         try:
             db.create_collection('temperature_records')
-            db.temperature_records.create_index([('date', 1)], unique=True)
-            logger.info("Created temperature_records collection with date index")
+            logger.info("Created temperature_records collection")
         except Exception as e:
             logger.error(f"Error creating temperature_records collection: {str(e)}")
             success = False
     
+    # Create the sensor_readings time-series collection if it doesn't exist
+    if 'sensor_readings' not in collections:
+        try:
+            create_sensor_collection(db)
+        except Exception as e:
+            logger.error(f"Error creating sensor_readings collection: {str(e)}")
+            success = False
+    
+    # Create the capped collection excursion alerts are streamed from
+    if ALERT_COLLECTION not in collections:
+        try:
+            create_alert_collection(db)
+        except Exception as e:
+            logger.error(f"Error creating {ALERT_COLLECTION} collection: {str(e)}")
+            success = False
+    
+    # Create temperature_rollups and backfill it from any existing records
+    if 'temperature_rollups' not in collections:
+        try:
+            db.create_collection('temperature_rollups')
+            logger.info("Created temperature_rollups collection")
+            rebuild_rollups(db)
+        except Exception as e:
+            logger.error(f"Error creating temperature_rollups collection: {str(e)}")
+            success = False
+    
+    # Create missing indexes from the catalogue; stale ones are only reported here
+    # and dropped through /db-maintenance or `python db_indexes.py --apply`
+    index_actions = reconcile_indexes(db)
+    if any(action.get('error') for actions in index_actions.values() for action in actions):
+        success = False
+    
     return success
 
 # Call initialization after connection succeeds
-if client:
+if client and DATABASE_INIT_ON_IMPORT:
     try:
-        db = initialize_database_structure()
-        if db:
-            # Set up global references to collections
-            chats = db['chats']
-            vector_embeddings = db['vector_embeddings']
+        if initialize_database_structure():
             logger.info("Database collections initialized and ready")
         else:
-            logger.warning("Database initialization returned None, using dummy collections")
+            logger.warning("Database initialization reported errors")
     except Exception as init_error:
         logger.error(f"Error during database initialization: {str(init_error)}")
 
@@ -883,7 +878,7 @@ def seed_database_if_empty():
         return False
 
 # Call seeding function after initialization
-if db and vector_embeddings:
+if db is not None and vector_embeddings is not None and DATABASE_INIT_ON_IMPORT:
     seed_database_if_empty()
 
 def connect_to_mongodb():
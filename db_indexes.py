@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Declarative index catalogue for the Auragens_AI database.
+
+Every regular (non-Atlas-Search) index the application relies on is declared
+in build_index_catalogue(). reconcile_indexes() compares the live database
+against the catalogue, creates what is missing, fixes TTL values in place and,
+when asked, drops indexes that are not in the catalogue. Indexes the server
+manages itself (_id, names starting with '_', and the meta/time index of a
+time-series collection) are never dropped. index_report()
+returns per-index sizes and usage counters from $indexStats.
+
+Run directly to reconcile the configured database:
+    python db_indexes.py            # dry run, prints the plan
+    python db_indexes.py --apply    # create, update and drop indexes
+"""
+
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+
+# Options that make two indexes with the same keys behave differently
+SIGNIFICANT_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+def build_index_catalogue():
+    """Return {collection: [index spec, ...]} for the current environment"""
+    chat_indexes = [
+        # /chat-history: newest-first pages of one user's chats
+        {'name': 'user_history', 'keys': [('user_id', 1), ('timestamp', -1), ('_id', -1)]},
+    ]
+    chat_retention_days = os.getenv('CHAT_RETENTION_DAYS')
+    if chat_retention_days:
+        chat_indexes.append({
+            'name': 'chat_retention',
+            'keys': [('timestamp', 1)],
+            'expireAfterSeconds': int(float(chat_retention_days) * DAY_SECONDS),
+        })
+
+    return {
+        'chats': chat_indexes,
+        # Threads are only read by _id
+        'conversations': [],
+        'users': [
+            {'name': 'user_id_unique', 'keys': [('user_id', 1)], 'unique': True},
+        ],
+        # Feedback is looked up per chat, newest first
+        'feedback': [
+            {'name': 'chat_feedback', 'keys': [('chat_id', 1), ('timestamp', -1)]},
+        ],
+        # Similarity search goes through the Atlas Search index managed by
+        # setup_vector_search(); no regular index serves any query here.
+        'vector_embeddings': [],
+        'temperature_records': [
+            {'name': 'date_unique', 'keys': [('date', 1)], 'unique': True},
+        ],
+        # Keyed and range-scanned by month on _id
+        'temperature_rollups': [],
+        # Versions are the _id; the active one is the highest
+        'compliance_rules': [],
+        # Time-series: daily derivation and series queries select by parameter and time
+        'sensor_readings': [
+            {'name': 'parameter_time', 'keys': [('meta.parameter', 1), ('timestamp', 1)]},
+        ],
+        # Rows written by test_db_connection.py are only useful for a day
+        'connection_tests': [
+            {'name': 'connection_test_ttl', 'keys': [('timestamp', 1)], 'expireAfterSeconds': DAY_SECONDS},
+        ],
+    }
+
+
+def _key_tuple(keys):
+    return tuple((field, direction) for field, direction in keys)
+
+
+def _options(index):
+    return {option: index[option] for option in SIGNIFICANT_OPTIONS if option in index}
+
+
+def _same_options_ignoring_ttl(existing, wanted):
+    existing_options = {k: v for k, v in _options(existing).items() if k != 'expireAfterSeconds'}
+    wanted_options = {k: v for k, v in _options(wanted).items() if k != 'expireAfterSeconds'}
+    return existing_options == wanted_options and \
+        ('expireAfterSeconds' in existing) == ('expireAfterSeconds' in wanted)
+
+
+def is_server_managed(index, timeseries=None):
+    """
+    True for indexes MongoDB creates and owns: _id, internal names starting
+    with '_', and the automatic meta/time index of a time-series collection
+    (timeseries is the collection's timeseries options, if any).
+    """
+    if index['name'].startswith('_'):
+        return True
+    if timeseries:
+        fields = [field for field, _ in index['key'].items()]
+        meta, time_field = timeseries.get('metaField'), timeseries.get('timeField')
+        managed_fields = [meta, time_field] if meta else [time_field]
+        if fields == managed_fields:
+            return True
+    return False
+
+
+def plan_collection(collection_name, existing_indexes, wanted_indexes, timeseries=None):
+    """
+    Compare live indexes (list_indexes() output) with catalogue specs.
+    Returns a list of (action, details) tuples: create, update_ttl, drop, ok.
+    Server-managed indexes are left out unless the catalogue declares them.
+    """
+    plan = []
+    existing = [idx for idx in existing_indexes if idx['name'] != '_id_']
+    matched = set()
+
+    for wanted in wanted_indexes:
+        wanted_keys = _key_tuple(wanted['keys'])
+        match = None
+        for idx in existing:
+            if idx['name'] not in matched and _key_tuple(idx['key'].items()) == wanted_keys \
+                    and _same_options_ignoring_ttl(idx, wanted):
+                match = idx
+                break
+
+        if match is None:
+            plan.append(('create', wanted))
+            continue
+
+        matched.add(match['name'])
+        if match.get('expireAfterSeconds') != wanted.get('expireAfterSeconds'):
+            plan.append(('update_ttl', {'name': match['name'], 'expireAfterSeconds': wanted['expireAfterSeconds']}))
+        else:
+            plan.append(('ok', {'name': match['name']}))
+
+    for idx in existing:
+        if idx['name'] not in matched and not is_server_managed(idx, timeseries):
+            plan.append(('drop', {'name': idx['name'], 'key': dict(idx['key'])}))
+
+    return plan
+
+
+def reconcile_indexes(db, drop_stale=False, dry_run=False, catalogue=None):
+    """
+    Bring the database's indexes in line with the catalogue.
+    Stale indexes are only dropped when drop_stale is True; otherwise they are reported.
+    """
+    catalogue = catalogue or build_index_catalogue()
+    # name -> collection options, which carry the timeseries settings
+    existing_collections = {info['name']: info.get('options', {}) for info in db.list_collections()}
+    report = {}
+
+    for collection_name, wanted_indexes in catalogue.items():
+        collection = db[collection_name]
+        if collection_name in existing_collections:
+            existing_indexes = list(collection.list_indexes())
+        else:
+            existing_indexes = []
+
+        timeseries = existing_collections.get(collection_name, {}).get('timeseries')
+        plan = plan_collection(collection_name, existing_indexes, wanted_indexes, timeseries)
+        # Drops go first so a replacement with the same key pattern can be built
+        plan.sort(key=lambda step: step[0] != 'drop')
+        actions = []
+        for action, details in plan:
+            if action == 'ok':
+                continue
+            if action == 'drop' and not drop_stale:
+                logger.warning(f"⚠️ Stale index {collection_name}.{details['name']} {details['key']} (not in catalogue)")
+                actions.append({'action': 'stale', **details})
+                continue
+            if dry_run:
+                actions.append({'action': action, 'name': details['name'], 'applied': False})
+                continue
+
+            try:
+                if action == 'create':
+                    options = _options(details)
+                    collection.create_index(details['keys'], name=details['name'], **options)
+                    logger.info(f"✅ Created index {collection_name}.{details['name']}")
+                elif action == 'update_ttl':
+                    db.command('collMod', collection_name, index={
+                        'name': details['name'],
+                        'expireAfterSeconds': details['expireAfterSeconds'],
+                    })
+                    logger.info(f"✅ Updated TTL of {collection_name}.{details['name']} to {details['expireAfterSeconds']}s")
+                elif action == 'drop':
+                    collection.drop_index(details['name'])
+                    logger.info(f"✅ Dropped index {collection_name}.{details['name']}")
+                actions.append({'action': action, 'name': details['name'], 'applied': True})
+            except Exception as e:
+                logger.error(f"❌ Error applying {action} for index {collection_name}.{details['name']}: {str(e)}")
+                actions.append({'action': action, 'name': details['name'], 'applied': False, 'error': str(e)})
+
+        report[collection_name] = actions
+
+    return report
+
+
+def index_report(db, catalogue=None):
+    """Return size and usage for every index of the catalogued collections"""
+    catalogue = catalogue or build_index_catalogue()
+    existing_collections = set(db.list_collection_names())
+    report = {}
+
+    for collection_name in catalogue:
+        if collection_name not in existing_collections:
+            continue
+        try:
+            index_sizes = db.command('collStats', collection_name).get('indexSizes', {})
+        except Exception as e:
+            logger.error(f"Error reading collStats for {collection_name}: {str(e)}")
+            index_sizes = {}
+
+        usage = {}
+        try:
+            for stat in db[collection_name].aggregate([{'$indexStats': {}}]):
+                usage[stat['name']] = {
+                    'ops': stat.get('accesses', {}).get('ops', 0),
+                    'since': stat.get('accesses', {}).get('since').isoformat() if stat.get('accesses', {}).get('since') else None,
+                }
+        except Exception as e:
+            logger.error(f"Error reading $indexStats for {collection_name}: {str(e)}")
+
+        report[collection_name] = [
+            {
+                'name': name,
+                'size_bytes': index_sizes.get(name),
+                'ops': usage.get(name, {}).get('ops'),
+                'since': usage.get(name, {}).get('since'),
+            }
+            for name in sorted(set(index_sizes) | set(usage))
+        ]
+
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    apply_changes = '--apply' in sys.argv
+
+    # Importing database would otherwise create every missing index before the dry run plans them
+    os.environ['DATABASE_INIT_ON_IMPORT'] = '0'
+    from database import db
+
+    result = reconcile_indexes(db, drop_stale=True, dry_run=not apply_changes)
+    for collection_name, actions in result.items():
+        for action in actions:
+            print(f"{collection_name}: {action}")
+    for collection_name, indexes in index_report(db).items():
+        for index in indexes:
+            print(f"{collection_name}.{index['name']}: {index['size_bytes']} bytes, {index['ops']} ops since {index['since']}")
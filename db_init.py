@@ -20,6 +20,7 @@ from transformers import AutoTokenizer, AutoModel
 import torch
 import numpy as np
 import gc
+from db_indexes import reconcile_indexes
 
 # Configure logging
 logging.basicConfig(
@@ -274,54 +275,27 @@ def setup_database_structure(client):
         db = client['Auragens_AI']
         logger.info(f"Using database: Auragens_AI")
         
-        # Required collections and their indexes
-        required_collections = {
-            'chats': [
-                ('user_id', 1),
-                ('timestamp', -1)
-            ],
-            'vector_embeddings': [
-                ('category', 1),
-                ('timestamp', -1)
-            ],
-            'users': [
-                ('user_id', 1),
-                ('email', 1)
-            ],
-            'feedback': [
-                ('chat_id', 1),
-                ('timestamp', -1)
-            ]
-        }
+        # Required collections; their indexes come from the shared catalogue
+        required_collections = ['chats', 'vector_embeddings', 'users', 'feedback']
         
         # Get existing collections
         existing_collections = db.list_collection_names()
         logger.info(f"Existing collections: {existing_collections}")
         
-        # Create missing collections and indexes
-        for collection_name, indexes in required_collections.items():
+        # Create missing collections
+        for collection_name in required_collections:
             if collection_name not in existing_collections:
                 logger.info(f"Creating collection: {collection_name}")
                 db.create_collection(collection_name)
-            
-            collection = db[collection_name]
-            
-            # Create indexes
-            for index in indexes:
-                if isinstance(index, tuple):
-                    field, direction = index
-                    index_name = f"{field}_{direction}"
-                    logger.info(f"Creating index on {collection_name}.{field}")
-                    collection.create_index([(field, direction)], name=index_name)
+        
+        # Create missing indexes and drop ones the application no longer uses
+        reconcile_indexes(db, drop_stale=True)
         
         # Vector search index setup for vector_embeddings collection
         if 'vector_embeddings' in db.list_collection_names():
             try:
                 logger.info("Setting up vector search index...")
                 
-                # Create 2dsphere index for basic vector support
-                db.vector_embeddings.create_index([("embedding", "2dsphere")])
-                
                 # Try to create knnVector index if Atlas supports it
                 try:
                     db.vector_embeddings.create_search_index({
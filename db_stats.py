@@ -0,0 +1,186 @@
+"""
+Cheap MongoDB diagnostics for /db-diagnostics and /metrics.
+
+Document counts come from collStats (the same metadata
+estimated_document_count reads), never from count_documents, which scans
+the collection. Sizes come from the same collStats call, so one command per
+collection yields counts, data/storage size and every index size.
+
+A DatabaseDiagnostics snapshot is recomputed at most once per
+DB_DIAGNOSTICS_TTL seconds per worker; requests in between are served from
+memory and the auragens_mongo_collection_* gauges are refreshed with it.
+Connection pool state comes from a pymongo pool listener, which keeps the
+auragens_mongo_pool_* metrics current without asking the server.
+
+Sections that scan a collection (chat compression totals) are not part of
+the snapshot: they are CachedStat objects, computed only when a request
+asks for them and then kept for DB_SCAN_STATS_TTL seconds.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+
+from pymongo import monitoring
+
+from metrics import MONGO_COLLECTION_BYTES, MONGO_COLLECTION_DOCUMENTS, MONGO_POOL_CONNECTIONS, MONGO_POOL_EVENTS
+
+logger = logging.getLogger(__name__)
+
+DB_DIAGNOSTICS_TTL = float(os.getenv('DB_DIAGNOSTICS_TTL', '60'))
+# Stats that need a collection scan change slowly and are cached much longer
+DB_SCAN_STATS_TTL = float(os.getenv('DB_SCAN_STATS_TTL', '3600'))
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Tracks open, checked out and waiting connections for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'open': 0, 'checked_out': 0, 'waiting': 0, 'created': 0, 'closed': 0,
+                       'checkout_failed': 0, 'cleared': 0}
+
+    def _change(self, key, amount):
+        with self._lock:
+            self.counts[key] += amount
+        if key in ('open', 'checked_out', 'waiting'):
+            MONGO_POOL_CONNECTIONS.labels(state=key).inc(amount)
+        else:
+            MONGO_POOL_EVENTS.labels(event=key).inc(amount)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._change('cleared', 1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._change('created', 1)
+        self._change('open', 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._change('closed', 1)
+        self._change('open', -1)
+
+    def connection_check_out_started(self, event):
+        self._change('waiting', 1)
+
+    def connection_check_out_failed(self, event):
+        self._change('waiting', -1)
+        self._change('checkout_failed', 1)
+
+    def connection_checked_out(self, event):
+        self._change('waiting', -1)
+        self._change('checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self._change('checked_out', -1)
+
+
+pool_listener = PoolListener()
+
+
+def install_pool_listener():
+    """Register the pool listener for every MongoClient created after this call"""
+    monitoring.register(pool_listener)
+
+
+def collection_stats(db, name):
+    """Counts and sizes of one collection from collStats, or an estimated count if collStats is not allowed"""
+    try:
+        stats = db.command('collStats', name)
+        return {
+            'documents': stats.get('count', 0),
+            'data_bytes': stats.get('size', 0),
+            'storage_bytes': stats.get('storageSize', 0),
+            'index_bytes': stats.get('totalIndexSize', 0),
+            'avg_document_bytes': stats.get('avgObjSize', 0),
+            'index_sizes': stats.get('indexSizes', {}),
+            'source': 'collStats',
+        }
+    except Exception as e:
+        logger.warning(f"collStats unavailable for {name}, using estimated_document_count: {str(e)}")
+        return {'documents': db[name].estimated_document_count(), 'source': 'estimate'}
+
+
+def pool_options(client):
+    try:
+        options = client.options.pool_options
+        return {'max_pool_size': options.max_pool_size, 'min_pool_size': options.min_pool_size}
+    except AttributeError:
+        return {}
+
+
+class CachedStat:
+    """A per-worker value recomputed by compute() only when asked for and older than ttl"""
+
+    def __init__(self, compute, ttl=DB_SCAN_STATS_TTL):
+        self.compute = compute
+        self.ttl = ttl
+        self._value = None
+        self._computed_at = None
+        self._lock = threading.Lock()
+
+    def get(self, force=False):
+        """Return (value, age_seconds); recomputes when stale, one caller at a time"""
+        with self._lock:
+            if force or self._computed_at is None or monotonic() - self._computed_at > self.ttl:
+                self._value = self.compute()
+                self._computed_at = monotonic()
+            return self._value, round(monotonic() - self._computed_at, 1)
+
+
+class DatabaseDiagnostics(CachedStat):
+    """A per-worker, TTL-cached snapshot of database health and size"""
+
+    def __init__(self, client, db, ttl=DB_DIAGNOSTICS_TTL):
+        super().__init__(self.collect, ttl)
+        self.client = client
+        self.db = db
+
+    def collect(self):
+        start = perf_counter()
+        self.client.admin.command('ping')
+        ping_ms = round((perf_counter() - start) * 1000, 1)
+
+        collections = {}
+        for name in sorted(self.db.list_collection_names()):
+            if name.startswith('system.'):
+                continue
+            stats = collection_stats(self.db, name)
+            collections[name] = stats
+            MONGO_COLLECTION_DOCUMENTS.labels(collection=name).set(stats['documents'])
+            for kind in ('data', 'storage', 'index'):
+                if f'{kind}_bytes' in stats:
+                    MONGO_COLLECTION_BYTES.labels(collection=name, kind=kind).set(stats[f'{kind}_bytes'])
+
+        snapshot = {
+            'connection': 'Connected',
+            'database_name': self.db.name,
+            'ping_ms': ping_ms,
+            'collections': collections,
+            'totals': {
+                'documents': sum(stats['documents'] for stats in collections.values()),
+                'storage_bytes': sum(stats.get('storage_bytes', 0) for stats in collections.values()),
+                'index_bytes': sum(stats.get('index_bytes', 0) for stats in collections.values()),
+            },
+            'pool': {**pool_options(self.client), **pool_listener.snapshot(), 'pid': os.getpid()},
+        }
+        snapshot['computed_in_ms'] = round((perf_counter() - start) * 1000, 1)
+        snapshot['timestamp'] = datetime.now(timezone.utc).isoformat()
+        return snapshot
@@ -0,0 +1,110 @@
+"""
+The sentence encoder behind semantic search and document ingest.
+
+Loading, tokenization and pooling live here so that database.py and the
+encoder benchmark (benchmarks/encoder.py) run exactly the same code:
+
+    tokenizer, model = load_encoder()
+    vectors = encode_batch(["first text", "second text"], tokenizer, model)   # (2, 384) float32
+    vector = embed_text("one text", tokenizer, model)                         # list, as stored in MongoDB
+
+Texts are cut to MAX_INPUT_CHARS characters and MAX_TOKENS tokens, and token
+vectors are mean-pooled over the attention mask (padding excluded), so a text
+embeds the same alone or in a batch.
+"""
+
+import gc
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'sentence-transformers/paraphrase-MiniLM-L3-v2'  # Very small model
+MODEL_CACHE_DIR = '/tmp/transformers_cache'
+EMBEDDING_DIMENSIONS = 384
+# Limit input text length to conserve memory
+MAX_INPUT_CHARS = 512
+MAX_TOKENS = 128  # Reduced from 256 to save memory
+
+# gunicorn runs several request threads per worker, and the fast tokenizer is
+# not safe to call from two of them at once ("Already borrowed"); the forward
+# pass already uses every core, so serializing costs little
+_encode_lock = threading.Lock()
+
+
+def load_encoder(model_name=MODEL_NAME, **model_kwargs):
+    """Load (tokenizer, model) on CPU with the memory-saving options used in production"""
+    logger.info("🔄 Initializing NLP models...")
+    # Add memory optimization settings
+    os.environ['PYTORCH_NO_CUDA_MEMORY_CACHING'] = '1'  # Disable CUDA caching
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        cache_dir=MODEL_CACHE_DIR,
+        local_files_only=False
+    )
+    # Load model with maximum memory optimizations
+    model = AutoModel.from_pretrained(
+        model_name,
+        cache_dir=MODEL_CACHE_DIR,
+        local_files_only=False,
+        low_cpu_mem_usage=True,  # Reduce memory usage
+        **model_kwargs
+    )
+    # Move model to CPU and aggressively clear memory
+    model = model.cpu().eval()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    gc.collect()
+
+    logger.info(f"Model loaded: {model_name} (lightweight version)")
+    return tokenizer, model
+
+
+def tokenize(texts, tokenizer, max_tokens=MAX_TOKENS, max_chars=MAX_INPUT_CHARS):
+    """CPU tensors for a batch of texts, truncated to max_chars characters and max_tokens tokens"""
+    if max_chars:
+        texts = [text[:max_chars] for text in texts]
+    inputs = tokenizer(
+        texts,
+        padding=True,
+        truncation=True,
+        max_length=max_tokens,
+        return_tensors="pt"
+    )
+    return {key: value.cpu() for key, value in inputs.items()}
+
+
+def mean_pool(last_hidden_state, attention_mask):
+    """Average the token vectors of each text, ignoring padding"""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    return (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+
+def encode_batch(texts, tokenizer, model, max_tokens=MAX_TOKENS, max_chars=MAX_INPUT_CHARS):
+    """Embed a list of texts; returns a (len(texts), EMBEDDING_DIMENSIONS) float32 array"""
+    with _encode_lock, torch.no_grad():
+        inputs = tokenize(texts, tokenizer, max_tokens, max_chars)
+        outputs = model(**inputs)
+        pooled = mean_pool(outputs.last_hidden_state, inputs['attention_mask'])
+    return pooled.cpu().numpy().astype(np.float32, copy=False)
+
+
+def embed_text(text, tokenizer, model):
+    """
+    Embed one text for storage or search. Memory is released eagerly after
+    every call, which keeps the single small dyno within its quota.
+    """
+    if len(text) > MAX_INPUT_CHARS:
+        logger.debug(f"Truncating input text from {len(text)} to {MAX_INPUT_CHARS} chars to save memory")
+    try:
+        return encode_batch([text], tokenizer, model)[0].tolist()
+    finally:
+        # Force aggressive garbage collection
+        torch.cuda.empty_cache() if torch.cuda.is_available() else None
+        gc.collect()
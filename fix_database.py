@@ -9,6 +9,7 @@ import sys
 import logging
 from pymongo import MongoClient
 from pymongo.server_api import ServerApi
+from db_indexes import reconcile_indexes
 from dotenv import load_dotenv
 import ssl
 import tempfile
@@ -162,15 +163,8 @@ def test_mongodb_connection():
             db.create_collection('users')
             db.create_collection('feedback')
             
-            # Create indexes
-            db.chats.create_index([('user_id', 1)])
-            db.chats.create_index([('timestamp', -1)])
-            db.vector_embeddings.create_index([('category', 1)])
-            db.vector_embeddings.create_index([('timestamp', -1)])
-            db.users.create_index([('user_id', 1)], unique=True)
-            db.users.create_index([('email', 1)])
-            db.feedback.create_index([('chat_id', 1)])
-            db.feedback.create_index([('timestamp', -1)])
+            # Create indexes from the shared catalogue
+            reconcile_indexes(db)
             
             logger.info("Created collections and indexes successfully")
             
@@ -0,0 +1,60 @@
+"""
+Gunicorn server hooks for Auragens AI.
+
+Gunicorn loads ./gunicorn.conf.py automatically; settings passed on the
+command line in the Procfile still take precedence over anything set here.
+"""
+
+import os
+import shutil
+import sys
+
+# Workers share metrics through files here (see metrics.py); set before any
+# worker imports prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/auragens_metrics')
+
+# Request threads per worker (gthread); admission.py budgets /chat against the same WEB_THREADS
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+
+def on_starting(server):
+    """Start every deploy with an empty metrics directory"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Start memory profiling (MEMORY_PROFILING=1) before the worker imports the app"""
+    from memprof import profiler
+    profiler.ensure_started()
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that has exited (runs in the master)"""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Flush queued chat logs, sensor derivations and alerts before a worker process exits"""
+    database = sys.modules.get('database')
+    writer = getattr(database, 'chat_writer', None)
+    if writer is not None:
+        try:
+            writer.close()
+        except Exception as e:
+            server.log.error(f"Error flushing chat writer on worker exit: {str(e)}")
+
+    memprof = sys.modules.get('memprof')
+    if memprof is not None:
+        memprof.profiler.close()
+
+    app_module = sys.modules.get('app')
+    for name in ('sensor_deriver', 'alert_pipeline'):
+        component = getattr(app_module, name, None)
+        if component is not None:
+            try:
+                component.close()
+            except Exception as e:
+                server.log.error(f"Error closing {name} on worker exit: {str(e)}")
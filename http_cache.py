@@ -0,0 +1,143 @@
+"""
+Conditional GET support for the temperature views.
+
+Every write to a day bumps the `version` of its month in temperature_rollups
+(see temperature.update_rollup), so the versions of the months a date range
+touches identify the data behind any response for that range. The ETag is a
+hash of those versions and Last-Modified is the newest rollup `updated_at`.
+
+Each worker keeps the ETag of a range, and its body once computed, in a
+per-process ResponseCache for RESPONSE_CACHE_SECONDS. Entries are tagged
+with the global rollups version (temperature.ROLLUPS_VERSION_ID, bumped by
+every rollup write), which is read at most once per RESPONSE_CACHE_SECONDS
+per worker. So a 304 or a cached body normally costs no query. A write from
+this worker clears the cache at once. A write from another worker changes
+the global version, and this worker drops its entries at its next version
+check, within RESPONSE_CACHE_SECONDS.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from time import monotonic
+
+from temperature import ROLLUPS_VERSION_ID
+
+# How long an ETag, body or the global rollups version is trusted without a query
+RESPONSE_CACHE_SECONDS = float(os.getenv('RESPONSE_CACHE_SECONDS', '10'))
+RESPONSE_CACHE_ENTRIES = 256
+
+
+class ResponseCache:
+    """Small thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, ttl=RESPONSE_CACHE_SECONDS, max_entries=RESPONSE_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._rollups_version = None
+        self._version_checked_at = None
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version_checked_at = None
+
+    def rollups_version(self, db):
+        """The global rollups version, re-read at most once per ttl; a change empties the cache"""
+        with self._lock:
+            if self._version_checked_at is not None and monotonic() - self._version_checked_at <= self.ttl:
+                return self._rollups_version
+        document = db.temperature_rollups.find_one({'_id': ROLLUPS_VERSION_ID}, {'version': 1})
+        version = (document or {}).get('version', 0)
+        with self._lock:
+            if version != self._rollups_version:
+                self._entries.clear()
+            self._rollups_version = version
+            self._version_checked_at = monotonic()
+        return version
+
+
+def data_version(db, start_date, end_date):
+    """
+    (etag, last_modified) for the data between two dates, from the rollup
+    versions of the months involved. One small _id range query.
+    """
+    first_month, last_month = start_date[:7], end_date[:7]
+    rollups = db.temperature_rollups.find(
+        {'_id': {'$gte': first_month, '$lte': last_month}},
+        {'version': 1, 'updated_at': 1}
+    ).sort('_id', 1)
+
+    digest = hashlib.sha1(f"{start_date}:{end_date}".encode('utf-8'))
+    last_modified = None
+    for rollup in rollups:
+        updated_at = rollup.get('updated_at')
+        digest.update(f"|{rollup['_id']}:{rollup.get('version', 0)}:{updated_at}".encode('utf-8'))
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return digest.hexdigest()[:20], last_modified
+
+
+def conditional_json(cache, db, request, cache_key, start_date, end_date, compute):
+    """
+    Answer a GET for a date range with ETag/Last-Modified, a 304 when the
+    client's copy is current, and the cached or freshly computed body
+    otherwise. compute() returns the JSON-serializable body.
+    """
+    from flask import jsonify, make_response
+
+    # Versions first: a write landing during compute() can only make the body
+    # newer than its ETag, and the version check after it drops the entry
+    cache.rollups_version(db)
+    entry = cache.get(cache_key)
+    if entry is None:
+        cache.stats['misses'] += 1
+        etag, last_modified = data_version(db, start_date, end_date)
+        entry = {'etag': etag, 'last_modified': last_modified, 'body': None}
+        cache.set(cache_key, entry)
+    else:
+        cache.stats['hits'] += 1
+
+    if request.if_none_match.contains(entry['etag']) or (
+            not request.if_none_match and entry['last_modified'] and request.if_modified_since
+            and entry['last_modified'].replace(microsecond=0) <= request.if_modified_since):
+        cache.stats['not_modified'] += 1
+        response = make_response('', 304)
+    else:
+        # Filled in place, so the entry keeps its original insert time
+        if entry['body'] is None:
+            entry['body'] = compute()
+        response = jsonify(entry['body'])
+
+    response.set_etag(entry['etag'])
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    # Browsers keep the copy but revalidate it on every navigation
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
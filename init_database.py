@@ -14,6 +14,7 @@ from datetime import datetime
 from dotenv import load_dotenv
 from transformers import AutoTokenizer, AutoModel
 import torch
+from db_indexes import reconcile_indexes
 
 # Configure logging
 logging.basicConfig(
@@ -116,53 +117,25 @@ def setup_database_structure(client):
         # Get or create database
         db = client['Auragens_AI']
         
-        # Required collections and their indexes
-        required_collections = {
-            'chats': [
-                ('user_id', 1),
-                ('timestamp', -1)
-            ],
-            'vector_embeddings': [
-                ('category', 1),
-                ('timestamp', -1)
-            ],
-            'users': [
-                ('user_id', 1, True),  # Unique index
-                ('email', 1)
-            ],
-            'feedback': [
-                ('chat_id', 1),
-                ('timestamp', -1)
-            ]
-        }
+        # Required collections; their indexes come from the shared catalogue
+        required_collections = ['chats', 'vector_embeddings', 'users', 'feedback']
         
         # Get existing collections
         existing_collections = db.list_collection_names()
         logger.info(f"Existing collections: {existing_collections}")
         
-        # Create missing collections and indexes
-        for collection_name, indexes in required_collections.items():
+        # Create missing collections
+        for collection_name in required_collections:
             if collection_name not in existing_collections:
                 logger.info(f"Creating collection: {collection_name}")
                 db.create_collection(collection_name)
-            
-            collection = db[collection_name]
-            
-            # Create indexes
-            for index in indexes:
-                if len(index) == 2:
-                    field, direction = index
-                    unique = False
-                else:
-                    field, direction, unique = index
-                
-                logger.info(f"Creating index on {collection_name}.{field} (unique={unique})")
-                collection.create_index([(field, direction)], unique=unique)
+        
+        # Create missing indexes and drop ones the application no longer uses
+        reconcile_indexes(db, drop_stale=True)
         
         # Try to create vector search index for vector_embeddings
         try:
             logger.info("Setting up vector search index...")
-            db.vector_embeddings.create_index([("embedding", "2dsphere")])
             
             # Try creating a MongoDB Atlas Search index if available
             try:
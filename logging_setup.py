@@ -0,0 +1,196 @@
+"""
+Structured, non-blocking logging for the web app.
+
+configure_logging() replaces the root handlers with a QueueHandler: a log
+call only formats its message and puts the record on an in-memory queue,
+and a QueueListener thread writes it to stderr as one JSON object per line:
+
+    {"ts": "2024-05-01T12:00:00.123+00:00", "level": "INFO", "logger": "app", "msg": "chat completed",
+     "request_id": "9f1c...", "category": "chat", "duration_s": 2.31, "docs": 5}
+
+When the queue is full (LOG_QUEUE_SIZE) records are dropped and counted
+rather than blocking the request. LOG_FORMAT=text keeps the classic
+one-line format with the fields appended as key=value.
+
+Hot paths log through log_event() with a category. Each category has a
+sample rate (LOG_SAMPLE_RATES, e.g. "search=0.1,chat=1"); a skipped event
+costs one random number and builds no record. Per-request detail is logged
+at DEBUG and is on demand: it is emitted for requests bound with
+debug=True (see bind_request; the app does this for admins sending
+X-Debug-Log: 1) or everywhere with LOG_LEVEL=DEBUG. Warnings and errors are
+never sampled.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from metrics import LOG_RECORDS_DROPPED
+
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Share of hot-path events logged per category; unlisted categories are always logged
+DEFAULT_SAMPLE_RATES = 'search=0.1,chat=1,upload=1,chat_writer=0.1'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_request_id = ContextVar('auragens_request_id', default=None)
+_request_debug = ContextVar('auragens_request_debug', default=False)
+
+# Attributes every LogRecord has; anything else was passed as extra=
+RESERVED_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+def parse_sample_rates(value):
+    """'search=0.1,chat=1' -> {'search': 0.1, 'chat': 1.0}"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        category, rate = item.split('=', 1)
+        try:
+            rates[category.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', DEFAULT_SAMPLE_RATES))
+
+
+def bind_request(request_id, debug=False):
+    """Attach a request id (and the on-demand debug flag) to this context; returns tokens for unbind_request"""
+    return _request_id.set(request_id), _request_debug.set(debug)
+
+
+def unbind_request(tokens):
+    request_token, debug_token = tokens
+    _request_id.reset(request_token)
+    _request_debug.reset(debug_token)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def log_event(logger, category, message, level=logging.INFO, **fields):
+    """
+    Log a hot-path event with structured fields, subject to the category's
+    sample rate. DEBUG events are emitted only for debug requests (promoted
+    to the logger's level) or when the logger itself is at DEBUG.
+    """
+    if level < logging.WARNING:
+        debug = _request_debug.get()
+        if not debug:
+            if not logger.isEnabledFor(level):
+                return
+            rate = SAMPLE_RATES.get(category, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        elif not logger.isEnabledFor(level):
+            level = logger.getEffectiveLevel()
+    fields['category'] = category
+    logger.log(level, message, extra=fields, stacklevel=2)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps the current request id on records, in the thread that logged them"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic format with extra fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f"{key}={value}" for key, value in record.__dict__.items()
+                          if key not in RESERVED_ATTRIBUTES and value is not None)
+        return f"{line} {fields}" if fields else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: a full queue drops the record and counts it"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """Waits for room for its stop sentinel instead of failing when the queue is full"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None, use_queue=True, queue_size=LOG_QUEUE_SIZE):
+    """
+    Route the root logger through a JSON (or text) formatter, behind a
+    QueueHandler when use_queue is set. Safe to call again to reconfigure.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else TextFormatter())
+    if use_queue:
+        handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _listener = DrainingQueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def flush_logging():
+    """Write out everything queued so far and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(flush_logging)
@@ -0,0 +1,265 @@
+"""
+Opt-in memory profiling for the gunicorn workers.
+
+With MEMORY_PROFILING=1 every worker starts tracemalloc and a background
+thread that, every MEMORY_PROFILE_INTERVAL seconds, records:
+
+    rss / uss        resident and unique set size of the worker (psutil)
+    traced           bytes currently allocated through Python (tracemalloc)
+    top              the largest allocation sites right now
+    growth           the sites that grew most since the baseline sample
+
+Samples are kept in memory for /memory-profile and exported as the
+auragens_process_memory_bytes gauge. Every MEMORY_SNAPSHOT_EVERY samples the
+full tracemalloc snapshot is written to MEMORY_SNAPSHOT_DIR (one file per
+worker and sample, the oldest pruned past MEMORY_SNAPSHOT_KEEP) so growth
+between two points in time can be inspected offline:
+
+    python memprof.py diff /tmp/auragens_memory/1234-20240501T120000.tracemalloc \\
+                           /tmp/auragens_memory/1234-20240501T130000.tracemalloc --top 20
+
+tracemalloc slows allocation-heavy code noticeably, so profiling is off by
+default and meant to be switched on for a while on one dyno. When RSS rises
+in every one of MEMORY_GROWTH_WINDOW consecutive samples by more than
+MEMORY_GROWTH_WARN_MB in total, a warning with the top growing sites is
+logged.
+"""
+
+import argparse
+import gc
+import glob
+import logging
+import os
+import threading
+import tracemalloc
+from collections import deque
+from datetime import datetime, timezone
+
+import psutil
+
+from metrics import PROCESS_MEMORY_BYTES
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROFILING = os.getenv('MEMORY_PROFILING', '').lower() in ('1', 'true', 'yes')
+MEMORY_PROFILE_INTERVAL = float(os.getenv('MEMORY_PROFILE_INTERVAL', '60'))
+# Frames kept per allocation; more frames cost more memory and time
+MEMORY_PROFILE_FRAMES = int(os.getenv('MEMORY_PROFILE_FRAMES', '10'))
+MEMORY_PROFILE_TOP = int(os.getenv('MEMORY_PROFILE_TOP', '15'))
+MEMORY_SNAPSHOT_DIR = os.getenv('MEMORY_SNAPSHOT_DIR', '/tmp/auragens_memory')
+MEMORY_SNAPSHOT_EVERY = int(os.getenv('MEMORY_SNAPSHOT_EVERY', '10'))
+MEMORY_SNAPSHOT_KEEP = int(os.getenv('MEMORY_SNAPSHOT_KEEP', '20'))
+MEMORY_GROWTH_WINDOW = int(os.getenv('MEMORY_GROWTH_WINDOW', '5'))
+MEMORY_GROWTH_WARN_MB = float(os.getenv('MEMORY_GROWTH_WARN_MB', '50'))
+# Samples kept in memory for the endpoint
+MAX_SAMPLES = 120
+
+# Allocation sites that only describe the profiler itself
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def megabytes(value):
+    return round(value / 1024 / 1024, 2)
+
+
+def process_memory(process=None):
+    """RSS and, where the platform allows it, USS of a process in bytes"""
+    process = process or psutil.Process()
+    try:
+        info = process.memory_full_info()
+        return {'rss': info.rss, 'uss': getattr(info, 'uss', None)}
+    except (psutil.AccessDenied, OSError):
+        return {'rss': process.memory_info().rss, 'uss': None}
+
+
+def statistic_rows(statistics, limit, growth=False):
+    """JSON rows for tracemalloc Statistic or StatisticDiff objects"""
+    rows = []
+    for statistic in statistics[:limit]:
+        frame = statistic.traceback[0]
+        row = {'site': f"{frame.filename}:{frame.lineno}", 'size_mb': megabytes(statistic.size),
+               'count': statistic.count}
+        if growth:
+            row['size_diff_mb'] = megabytes(statistic.size_diff)
+            row['count_diff'] = statistic.count_diff
+        rows.append(row)
+    return rows
+
+
+class MemoryProfiler:
+    """Samples tracemalloc and process memory on a background thread in each worker"""
+
+    def __init__(self, enabled=MEMORY_PROFILING, interval=MEMORY_PROFILE_INTERVAL, frames=MEMORY_PROFILE_FRAMES,
+                 top=MEMORY_PROFILE_TOP, snapshot_dir=MEMORY_SNAPSHOT_DIR, snapshot_every=MEMORY_SNAPSHOT_EVERY,
+                 snapshot_keep=MEMORY_SNAPSHOT_KEEP):
+        self.enabled = enabled
+        self.interval = max(1.0, float(interval))
+        self.frames = max(1, int(frames))
+        self.top = top
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        self.snapshot_keep = snapshot_keep
+        self.samples = deque(maxlen=MAX_SAMPLES)
+        self._baseline = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """Start tracing and sampling in this process if profiling is enabled; cheap to call repeatedly"""
+        if not self.enabled:
+            return
+        # Started per worker, after gunicorn has forked it
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+            self._stop.clear()
+            self._pid = os.getpid()
+            self.samples.clear()
+            self._baseline = None
+            self._thread = threading.Thread(target=self._run, name='memory-profiler', daemon=True)
+            self._thread.start()
+            logger.info(f"Memory profiling started in worker {self._pid} "
+                        f"(every {self.interval:.0f}s, {self.frames} frames)")
+
+    def close(self):
+        self._stop.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Memory profiling sample failed: {str(e)}")
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def sample(self):
+        """Take one sample now and return it"""
+        memory = process_memory()
+        traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        sample = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'rss_mb': megabytes(memory['rss']),
+            'uss_mb': megabytes(memory['uss']) if memory['uss'] is not None else None,
+            'traced_mb': megabytes(traced),
+            'traced_peak_mb': megabytes(traced_peak),
+            'gc_objects': len(gc.get_objects()),
+        }
+        PROCESS_MEMORY_BYTES.labels(kind='rss').set(memory['rss'])
+        if memory['uss'] is not None:
+            PROCESS_MEMORY_BYTES.labels(kind='uss').set(memory['uss'])
+        PROCESS_MEMORY_BYTES.labels(kind='traced').set(traced)
+
+        if tracemalloc.is_tracing():
+            snapshot = self._snapshot()
+            sample['top'] = statistic_rows(snapshot.statistics('lineno'), self.top)
+            if self._baseline is None:
+                self._baseline = snapshot
+                sample['growth'] = []
+            else:
+                sample['growth'] = statistic_rows(snapshot.compare_to(self._baseline, 'lineno'), self.top, growth=True)
+            if self.snapshot_every and (len(self.samples) + 1) % self.snapshot_every == 0:
+                sample['snapshot'] = self.write_snapshot(snapshot)
+
+        with self._lock:
+            self.samples.append(sample)
+        self._check_growth()
+        return sample
+
+    def _check_growth(self):
+        window = list(self.samples)[-(MEMORY_GROWTH_WINDOW + 1):]
+        if len(window) <= MEMORY_GROWTH_WINDOW:
+            return
+        rss = [sample['rss_mb'] for sample in window]
+        rising = all(later > earlier for earlier, later in zip(rss, rss[1:]))
+        if rising and rss[-1] - rss[0] > MEMORY_GROWTH_WARN_MB:
+            growth = ', '.join(f"{row['site']} +{row['size_diff_mb']} MB" for row in window[-1].get('growth', [])[:3])
+            logger.warning(f"⚠️ Worker {os.getpid()} RSS grew {rss[-1] - rss[0]:.1f} MB over the last "
+                           f"{MEMORY_GROWTH_WINDOW} samples; top growth since start: {growth or 'n/a'}")
+
+    def write_snapshot(self, snapshot=None):
+        """Dump a tracemalloc snapshot to the snapshot directory and return its path"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not tracing; set MEMORY_PROFILING=1")
+        snapshot = snapshot or self._snapshot()
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(self.snapshot_dir, f"{os.getpid()}-{stamp}.tracemalloc")
+        snapshot.dump(path)
+        self._prune_snapshots()
+        return path
+
+    def _prune_snapshots(self):
+        paths = sorted(glob.glob(os.path.join(self.snapshot_dir, f"{os.getpid()}-*.tracemalloc")))
+        for path in paths[:-self.snapshot_keep] if self.snapshot_keep else []:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def report(self, samples=10):
+        """Current memory of this worker plus its most recent samples"""
+        memory = process_memory()
+        with self._lock:
+            recent = list(self.samples)[-samples:] if samples else []
+        report = {
+            'pid': os.getpid(),
+            'enabled': self.enabled,
+            'tracing': tracemalloc.is_tracing(),
+            'rss_mb': megabytes(memory['rss']),
+            'uss_mb': megabytes(memory['uss']) if memory['uss'] is not None else None,
+            'interval_seconds': self.interval,
+            'samples': recent,
+        }
+        if tracemalloc.is_tracing():
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            report.update(traced_mb=megabytes(traced), traced_peak_mb=megabytes(traced_peak))
+        return report
+
+
+profiler = MemoryProfiler()
+
+
+def diff_snapshots(old_path, new_path, top=25, group_by='lineno'):
+    """Rows for the allocation sites that changed most between two snapshot files"""
+    old = tracemalloc.Snapshot.load(old_path)
+    new = tracemalloc.Snapshot.load(new_path)
+    return statistic_rows(new.compare_to(old, group_by), top, growth=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect tracemalloc snapshots written by the memory profiler')
+    commands = parser.add_subparsers(dest='command', required=True)
+    diff = commands.add_parser('diff', help='allocation sites that grew between two snapshots')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--top', type=int, default=25)
+    diff.add_argument('--group-by', choices=['lineno', 'filename', 'traceback'], default='lineno')
+    show = commands.add_parser('top', help='largest allocation sites in one snapshot')
+    show.add_argument('snapshot')
+    show.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+
+    if args.command == 'diff':
+        for row in diff_snapshots(args.old, args.new, args.top, args.group_by):
+            print(f"{row['size_diff_mb']:+10.2f} MB {row['count_diff']:+9d} blocks  "
+                  f"{row['size_mb']:10.2f} MB  {row['site']}")
+    else:
+        snapshot = tracemalloc.Snapshot.load(args.snapshot)
+        for row in statistic_rows(snapshot.statistics('lineno'), args.top):
+            print(f"{row['size_mb']:10.2f} MB {row['count']:9d} blocks  {row['site']}")
@@ -0,0 +1,114 @@
+"""
+Prometheus metrics for Auragens AI.
+
+All metrics are defined here and shared by the app, database and background
+writers. Histograms record latency in seconds; the quantiles (p50/p95/p99)
+come from histogram_quantile() on the scraping side, aggregated across workers.
+
+Under gunicorn, gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a shared
+directory before any worker starts. prometheus_client then keeps each
+worker's values in memory-mapped files there, and /metrics merges every
+worker (live and exited) into one exposition. Without the variable (e.g.
+`python app.py`) metrics are simply per process.
+"""
+
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+# Buckets tuned per stage: local work is milliseconds, LLM calls are seconds
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+EMBEDDING_SECONDS = Histogram(
+    'auragens_embedding_seconds', 'Time to embed one text', buckets=FAST_BUCKETS)
+VECTOR_SEARCH_SECONDS = Histogram(
+    'auragens_vector_search_seconds', 'Semantic search latency including the query embedding',
+    ['outcome'], buckets=FAST_BUCKETS)
+VECTOR_SEARCH_RESULTS = Counter(
+    'auragens_vector_search_results_total', 'Documents returned by semantic search')
+LLM_REQUEST_SECONDS = Histogram(
+    'auragens_llm_request_seconds', 'LLM completion latency per provider',
+    ['provider', 'purpose', 'outcome'], buckets=LLM_BUCKETS)
+MONGO_WRITE_SECONDS = Histogram(
+    'auragens_mongo_write_seconds', 'MongoDB write latency per operation',
+    ['operation', 'outcome'], buckets=FAST_BUCKETS)
+MONGO_WRITE_DOCUMENTS = Counter(
+    'auragens_mongo_write_documents_total', 'Documents written to MongoDB per operation', ['operation'])
+HTTP_REQUEST_SECONDS = Histogram(
+    'auragens_http_request_seconds', 'Request handling time per route',
+    ['method', 'route', 'status'], buckets=REQUEST_BUCKETS)
+CHAT_WRITE_QUEUE = Gauge(
+    'auragens_chat_write_queue', 'Chat records waiting in the write-behind queue',
+    multiprocess_mode='livesum')
+MONGO_COLLECTION_DOCUMENTS = Gauge(
+    'auragens_mongo_collection_documents', 'Estimated documents per collection (collStats)',
+    ['collection'], multiprocess_mode='mostrecent')
+MONGO_COLLECTION_BYTES = Gauge(
+    'auragens_mongo_collection_bytes', 'Collection size by kind (data, storage, index) from collStats',
+    ['collection', 'kind'], multiprocess_mode='mostrecent')
+MONGO_POOL_CONNECTIONS = Gauge(
+    'auragens_mongo_pool_connections', 'MongoDB connections by state (open, checked_out, waiting)',
+    ['state'], multiprocess_mode='livesum')
+MONGO_POOL_EVENTS = Counter(
+    'auragens_mongo_pool_events_total', 'MongoDB pool events (created, closed, checkout_failed, cleared)', ['event'])
+ADMISSION_IN_FLIGHT = Gauge(
+    'auragens_admission_in_flight', 'Requests holding an admission slot', ['route'], multiprocess_mode='livesum')
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'auragens_admission_queue_depth', 'Requests waiting for an admission slot', ['route'], multiprocess_mode='livesum')
+ADMISSION_WAIT_SECONDS = Histogram(
+    'auragens_admission_wait_seconds', 'Time admitted requests waited for a slot', ['route'], buckets=FAST_BUCKETS)
+ADMISSION_SHED = Counter(
+    'auragens_admission_shed_total', 'Requests refused by admission control', ['route', 'reason'])
+LOG_RECORDS_DROPPED = Counter(
+    'auragens_log_records_dropped_total', 'Log records dropped because the logging queue was full')
+PROCESS_MEMORY_BYTES = Gauge(
+    'auragens_process_memory_bytes', 'Worker memory by kind (rss, uss, traced) while memory profiling is on',
+    ['kind'], multiprocess_mode='liveall')
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """
+    Observe the duration of the block. An 'outcome' label, if the histogram
+    has one, is filled in with success or error.
+    """
+    start = perf_counter()
+    outcome = 'success'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        if 'outcome' in histogram._labelnames:
+            labels['outcome'] = outcome
+        metric = histogram.labels(**labels) if labels else histogram
+        metric.observe(perf_counter() - start)
+
+
+def record_mongo_write(operation, documents=1):
+    """Count documents written by a MongoDB operation; time it with timed(MONGO_WRITE_SECONDS, ...)"""
+    MONGO_WRITE_DOCUMENTS.labels(operation=operation).inc(documents)
+
+
+def render_metrics():
+    """Return (body, content_type) for the /metrics endpoint"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Called by gunicorn when a worker exits so its live gauges are dropped"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
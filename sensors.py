@@ -0,0 +1,441 @@
+"""
+High-frequency sensor ingestion for the temperature tracker.
+
+Data loggers post batches of (device_id, parameter, timestamp, value) points,
+which are stored in the `sensor_readings` time-series collection:
+
+    {"timestamp": datetime, "meta": {"device_id": "...", "parameter": "freezer", "site": "..."}, "value": -19.6}
+
+The calendar and compliance routes keep reading one document per day from
+`temperature_records`. Those daily documents are derived from the readings
+(min/max/mean per parameter, compliance per device from compliance_rules) by a
+background deriver that re-derives every day touched by an ingest once per
+SENSOR_DERIVE_INTERVAL seconds, however many points arrive in between.
+A day that already has a manually entered reading keeps it; the sensor
+summary is attached alongside.
+
+Charts read the raw readings through downsample_series(), which buckets them
+server-side so a response never exceeds the requested point count.
+
+Backfill derived days with:
+    python sensors.py --derive START_DATE END_DATE
+"""
+
+import atexit
+import logging
+import math
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from compliance_rules import get_active_rules
+from metrics import MONGO_WRITE_SECONDS, record_mongo_write, timed
+from temperature import PARAMETERS, PARAMETER_FIELDS, DATE_FORMAT, parse_date, update_rollup
+
+logger = logging.getLogger(__name__)
+
+SENSOR_COLLECTION = 'sensor_readings'
+TIMESERIES_OPTIONS = {'timeField': 'timestamp', 'metaField': 'meta', 'granularity': 'minutes'}
+
+# Largest batch a single ingest request may carry
+MAX_INGEST_POINTS = 10000
+MAX_DEVICE_ID_LENGTH = 64
+# Device ids become field names in rules and summaries, so no "." or "$"
+DEVICE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_:-]{1,%d}$' % MAX_DEVICE_ID_LENGTH)
+# Points stamped further ahead than this are rejected as clock errors
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Days are cut at local midnight in this zone
+SENSOR_TIMEZONE = ZoneInfo(os.getenv('SENSOR_TIMEZONE', 'UTC'))
+
+
+def create_sensor_collection(db):
+    """Create the time-series collection for sensor readings"""
+    db.create_collection(SENSOR_COLLECTION, timeseries=TIMESERIES_OPTIONS)
+    logger.info(f"Created {SENSOR_COLLECTION} time-series collection")
+
+
+def parse_timestamp(value):
+    """Accept ISO 8601 strings or epoch seconds; naive times are taken as UTC"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp {value!r}")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid timestamp {value!r}, expected ISO 8601 or epoch seconds")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
+    raise ValueError(f"Invalid timestamp {value!r}")
+
+
+def local_date(timestamp):
+    """The tracker date (YYYY-MM-DD) a UTC timestamp falls on"""
+    return timestamp.astimezone(SENSOR_TIMEZONE).strftime(DATE_FORMAT)
+
+
+def day_bounds(date):
+    """UTC [start, end) datetimes of a tracker date"""
+    start = parse_date(date).replace(tzinfo=SENSOR_TIMEZONE)
+    end = (parse_date(date) + timedelta(days=1)).replace(tzinfo=SENSOR_TIMEZONE)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+
+def validate_points(points, site=None, now=None):
+    """
+    Turn raw points into sensor_readings documents.
+    Returns (documents, errors) where errors is a list of (index, message).
+    """
+    now = now or datetime.now(timezone.utc)
+    documents = []
+    errors = []
+    for index, point in enumerate(points):
+        if not isinstance(point, dict):
+            errors.append((index, 'Reading must be an object'))
+            continue
+        device_id = point.get('device_id')
+        parameter = point.get('parameter')
+        value = point.get('value')
+        if not isinstance(device_id, str) or not DEVICE_ID_PATTERN.match(device_id):
+            errors.append((index, f'device_id must be 1-{MAX_DEVICE_ID_LENGTH} letters, digits, "_", "-" or ":"'))
+            continue
+        if parameter not in PARAMETERS:
+            errors.append((index, f"parameter must be one of {', '.join(PARAMETERS)}"))
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            errors.append((index, 'value must be a finite number'))
+            continue
+        try:
+            timestamp = parse_timestamp(point.get('timestamp'))
+        except ValueError as e:
+            errors.append((index, str(e)))
+            continue
+        if timestamp > now + MAX_CLOCK_SKEW:
+            errors.append((index, 'timestamp is in the future'))
+            continue
+
+        meta = {'device_id': device_id, 'parameter': parameter}
+        if site:
+            meta['site'] = site
+        documents.append({'timestamp': timestamp, 'meta': meta, 'value': float(value)})
+    return documents, errors
+
+
+def ingest_points(db, documents):
+    """
+    Insert validated readings in one unordered insert_many. Returns
+    (dates, written): the set of tracker dates they touched and the indexes
+    into documents of the points actually stored.
+    """
+    if not documents:
+        return set(), []
+    written = list(range(len(documents)))
+    try:
+        with timed(MONGO_WRITE_SECONDS, operation='sensor_readings'):
+            db[SENSOR_COLLECTION].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Unordered: everything except the failed points was still written
+        failed = {error['index'] for error in e.details.get('writeErrors', [])}
+        logger.error(f"Sensor ingest wrote {len(documents) - len(failed)} of {len(documents)} points")
+        written = [index for index in written if index not in failed]
+    record_mongo_write('sensor_readings', len(written))
+    return {local_date(documents[index]['timestamp']) for index in written}, written
+
+
+def daily_summary_pipeline(date):
+    """Per-parameter, per-device min/max/sum/count for one tracker date"""
+    start, end = day_bounds(date)
+    return [
+        {'$match': {'meta.parameter': {'$in': PARAMETERS}, 'timestamp': {'$gte': start, '$lt': end}}},
+        {'$group': {
+            '_id': {'parameter': '$meta.parameter', 'device_id': '$meta.device_id'},
+            'min': {'$min': '$value'},
+            'max': {'$max': '$value'},
+            'sum': {'$sum': '$value'},
+            'count': {'$sum': 1},
+        }}
+    ]
+
+
+def summarize_day(db, date):
+    """Return {parameter: summary} for the readings of one date, with a by_device breakdown"""
+    summary = {}
+    totals = {}
+    for row in db[SENSOR_COLLECTION].aggregate(daily_summary_pipeline(date)):
+        parameter = row['_id']['parameter']
+        if parameter not in PARAMETERS:
+            continue
+        stats = summary.setdefault(parameter, {'min': row['min'], 'max': row['max'], 'count': 0, 'by_device': {}})
+        stats['min'] = min(stats['min'], row['min'])
+        stats['max'] = max(stats['max'], row['max'])
+        stats['count'] += row['count']
+        totals[parameter] = totals.get(parameter, 0.0) + row['sum']
+        stats['by_device'][row['_id']['device_id']] = {
+            'min': row['min'],
+            'max': row['max'],
+            'mean': round(row['sum'] / row['count'], 2),
+            'count': row['count'],
+        }
+    for parameter, stats in summary.items():
+        stats['mean'] = round(totals[parameter] / stats['count'], 2)
+    return summary
+
+
+def derive_daily_record(db, date, rules=None):
+    """
+    Write the daily temperature_records document for one date from its sensor
+    readings, judged per device by the active compliance rules. Days with a
+    manual entry only get the sensor_summary attached.
+    Returns 'derived', 'annotated' or None when the day has no readings.
+    """
+    summary = summarize_day(db, date)
+    if not summary:
+        return None
+
+    rules = rules or get_active_rules(db)
+    now = datetime.now().isoformat()
+    fields = {PARAMETER_FIELDS[parameter]: stats['mean'] for parameter, stats in summary.items()}
+    compliance, is_compliant = rules.evaluate_records([{'source': 'sensor', 'sensor_summary': summary}])[0]
+    record = {
+        'date': date,
+        **fields,
+        'compliance': compliance,
+        'is_compliant': is_compliant,
+        'rules_version': rules.version,
+    }
+    try:
+        previous = db.temperature_records.find_one_and_update(
+            {'date': date, 'source': 'sensor'},
+            {
+                '$set': {**record, 'sensor_summary': summary, 'updated_at': now},
+                '$setOnInsert': {'source': 'sensor', 'corrective_action': '', 'created_at': now}
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # The day was entered by hand; keep those readings
+        db.temperature_records.update_one({'date': date}, {'$set': {'sensor_summary': summary}})
+        return 'annotated'
+
+    update_rollup(db, previous, record)
+    return 'derived'
+
+
+def derive_range(db, start_date, end_date):
+    """Derive every date in a range; returns the number of days written"""
+    day = parse_date(start_date)
+    last = parse_date(end_date)
+    written = 0
+    while day <= last:
+        if derive_daily_record(db, day.strftime(DATE_FORMAT)):
+            written += 1
+        day += timedelta(days=1)
+    return written
+
+
+# --- Downsampled series for charts ---
+
+DEFAULT_SERIES_POINTS = 500
+MAX_SERIES_POINTS = 2000
+MAX_SERIES_DAYS = 400
+# Loggers sample once a minute; finer buckets would just be raw points
+MIN_BUCKET_SECONDS = 60
+# LTTB picks from this many mean buckets per output point
+LTTB_OVERSAMPLING = 4
+SERIES_MODES = ('minmax', 'lttb')
+
+
+def bucket_seconds_for(start, end, points):
+    """Bucket width that splits [start, end) into at most `points` buckets"""
+    span = (end - start).total_seconds()
+    return max(MIN_BUCKET_SECONDS, math.ceil(span / max(1, points)))
+
+
+def series_pipeline(parameter, start, end, bucket_seconds, device_id=None):
+    """Fixed-width buckets over [start, end) with min/max/mean/count per bucket"""
+    match = {'meta.parameter': parameter, 'timestamp': {'$gte': start, '$lt': end}}
+    if device_id:
+        match['meta.device_id'] = device_id
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': {'$floor': {'$divide': [{'$subtract': ['$timestamp', start]}, bucket_seconds * 1000]}},
+            'min': {'$min': '$value'},
+            'max': {'$max': '$value'},
+            'mean': {'$avg': '$value'},
+            'count': {'$sum': 1},
+        }},
+        {'$sort': {'_id': 1}}
+    ]
+
+
+def query_buckets(db, parameter, start, end, bucket_seconds, device_id=None):
+    """Run series_pipeline and return bucket dicts with their start time"""
+    buckets = []
+    for row in db[SENSOR_COLLECTION].aggregate(series_pipeline(parameter, start, end, bucket_seconds, device_id)):
+        bucket_start = start + timedelta(seconds=int(row['_id']) * bucket_seconds)
+        buckets.append({
+            't': bucket_start.isoformat(),
+            'min': row['min'],
+            'max': row['max'],
+            'mean': round(row['mean'], 3),
+            'count': row['count'],
+        })
+    return buckets
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    the visual shape of the (x, y) series. x must be increasing.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample_series(db, parameter, start, end, points=DEFAULT_SERIES_POINTS, mode='minmax', device_id=None):
+    """
+    Return (bucket_seconds, points) for a chart of one parameter between two
+    UTC datetimes. The response never exceeds `points` entries whatever the
+    range: 'minmax' returns min/max/mean buckets; 'lttb' runs LTTB over
+    LTTB_OVERSAMPLING times as many mean buckets and returns {t, value} points.
+    """
+    if mode == 'lttb':
+        bucket_seconds = bucket_seconds_for(start, end, points * LTTB_OVERSAMPLING)
+        buckets = query_buckets(db, parameter, start, end, bucket_seconds, device_id)
+        if not buckets:
+            return bucket_seconds, []
+        x = [datetime.fromisoformat(bucket['t']).timestamp() for bucket in buckets]
+        y = [bucket['mean'] for bucket in buckets]
+        return bucket_seconds, [
+            {'t': buckets[index]['t'], 'value': buckets[index]['mean']}
+            for index in lttb_indices(x, y, points)
+        ]
+
+    bucket_seconds = bucket_seconds_for(start, end, points)
+    return bucket_seconds, query_buckets(db, parameter, start, end, bucket_seconds, device_id)
+
+
+class DailyDeriver:
+    """
+    Collect the dates touched by ingests and re-derive each of them at most
+    once per interval from a background thread.
+    """
+
+    def __init__(self, db, interval=60.0):
+        self.db = db
+        self.interval = max(1.0, float(interval))
+        self._dates = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {'marked': 0, 'derived': 0, 'errors': 0}
+
+    def mark(self, dates):
+        if not dates:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._dates.update(dates)
+            self.stats['marked'] += len(dates)
+
+    def pending(self):
+        with self._lock:
+            return sorted(self._dates)
+
+    def flush(self):
+        """Derive every pending date now"""
+        with self._lock:
+            dates, self._dates = self._dates, set()
+        for date in sorted(dates):
+            try:
+                derive_daily_record(self.db, date)
+                self.stats['derived'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error deriving daily record for {date}: {str(e)}")
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def _ensure_started(self):
+        # Started lazily so the thread belongs to the gunicorn worker
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='sensor-daily-deriver', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            self.flush()
+
+
+def create_daily_deriver(db):
+    """Build the process-wide deriver from SENSOR_DERIVE_INTERVAL and flush it on exit"""
+    deriver = DailyDeriver(db, interval=float(os.getenv('SENSOR_DERIVE_INTERVAL', '60')))
+    atexit.register(deriver.close)
+    return deriver
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--derive' not in sys.argv or len(arguments) != 2:
+        print("Usage: python sensors.py --derive START_DATE END_DATE")
+        sys.exit(1)
+
+    from database import db
+
+    written = derive_range(db, *arguments)
+    print(f"Derived {written} daily records")
@@ -4,6 +4,9 @@ $(document).ready(function() {
         🚀 I'm Auragens-AI, the digital offspring of Dr. James Utley, PhD—your personal cellular therapy AI expert! I am here to answer all your questions about stem cell therapy. 🧠 Let's get started! ⚡
     </div>`;
 
+    // Conversation thread returned by the server; null starts a new thread
+    let threadId = null;
+
     function addMessage(message, isUser) {
         const messageDiv = $('<div></div>')
             .addClass('message')
@@ -99,16 +102,19 @@ $(document).ready(function() {
                 url: '/chat',
                 method: 'POST',
                 contentType: 'application/json',
-                data: JSON.stringify({ message: message }),
+                data: JSON.stringify({ message: message, thread_id: threadId }),
                 success: function(response) {
                     // Remove loading dots
                     loadingDots.remove();
+                    threadId = response.thread_id || null;
                     addMessage(response.response, false);
                 },
-                error: function() {
+                error: function(xhr) {
                     // Remove loading dots
                     loadingDots.remove();
-                    addMessage("Sorry, there was an error processing your request.", false);
+                    // Busy (503) and rate limited (429) responses explain themselves
+                    const busy = (xhr.status === 429 || xhr.status === 503) && xhr.responseJSON;
+                    addMessage(busy ? xhr.responseJSON.message : "Sorry, there was an error processing your request.", false);
                 },
                 complete: function() {
                     userInput.prop('disabled', false);
@@ -142,6 +148,7 @@ $(document).ready(function() {
 
     // New Chat
     $('#new-chat').click(function() {
+        threadId = null;  // Start a new conversation thread
         $('#chat-messages').empty();  // Clear all messages
         // Add back the welcome message
         $('#chat-messages').html(WELCOME_MESSAGE);
@@ -150,6 +157,7 @@ $(document).ready(function() {
     // Clear Chat
     $('#clear-chat').click(function() {
         if (confirm('Are you sure you want to clear this chat?')) {
+            threadId = null;  // Start a new conversation thread
             $('#chat-messages').empty();  // Clear all messages
             // Add back only the welcome message
             $('#chat-messages').html(WELCOME_MESSAGE);
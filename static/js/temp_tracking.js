@@ -44,7 +44,12 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // Reference ranges
+    // Incremented on every calendar render so stale month responses are dropped
+    let calendarRenderToken = 0;
+    
+    // Reference ranges, used to prompt for corrective action while entering
+    // readings. The server decides the stored compliance flags; these defaults
+    // are replaced by its active rules as soon as they load.
     const referenceRanges = {
         refrigerator: { min: 2, max: 8 },
         freezer: { min: -30, max: -15 },
@@ -54,6 +59,8 @@ document.addEventListener('DOMContentLoaded', function() {
     };
     
     // Initialize
+    loadReferenceRanges();
+    subscribeToAlerts();
     renderCalendar();
     updateMonthlyCompliance();
     
@@ -199,23 +206,41 @@ document.addEventListener('DOMContentLoaded', function() {
             calendarDaysElem.appendChild(dayElement);
         }
         
-        // Current month's days
+        // Current month's days, as placeholders until the month's data arrives
+        const renderToken = ++calendarRenderToken;
+        const dayPlaceholders = [];
         for (let i = 1; i <= daysInMonth; i++) {
-            const date = new Date(currentYear, currentMonth, i);
-            const dateString = formatDate(date);
-            
-            // Get temperature data for this day if it exists
-            fetchTemperatureData(dateString)
-                .then(data => {
-                    const dayElement = createDayElement(i, false, date, data);
-                    calendarDaysElem.appendChild(dayElement);
+            const dayElement = createDayElement(i, false, new Date(currentYear, currentMonth, i));
+            calendarDaysElem.appendChild(dayElement);
+            dayPlaceholders.push(dayElement);
+        }
+        
+        // One request for the whole month, then fill in the days in order
+        const monthKey = `${currentYear}-${String(currentMonth + 1).padStart(2, '0')}`;
+        const renderYear = currentYear;
+        const renderMonth = currentMonth;
+        fetchMonthTemperatureData(monthKey)
+            .then(records => {
+                // Ignore responses for a month the user has already navigated away from
+                if (renderToken !== calendarRenderToken) {
+                    return;
+                }
+                
+                const recordsByDate = {};
+                (records || []).forEach(record => {
+                    recordsByDate[record.date] = record;
+                });
+                
+                dayPlaceholders.forEach((placeholder, index) => {
+                    const date = new Date(renderYear, renderMonth, index + 1);
+                    const data = recordsByDate[formatDate(date)] || null;
+                    const dayElement = createDayElement(index + 1, false, date, data);
                     
                     // Add click event to open modal
-                    if (!dayElement.classList.contains('inactive')) {
-                        dayElement.addEventListener('click', () => openTemperatureModal(date, data));
-                    }
+                    dayElement.addEventListener('click', () => openTemperatureModal(date, data));
+                    calendarDaysElem.replaceChild(dayElement, placeholder);
                 });
-        }
+            });
         
         // Next month's days
         const totalCalendarCells = 42; // 6 rows x 7 days
@@ -563,10 +588,94 @@ document.addEventListener('DOMContentLoaded', function() {
                date1.getDate() === date2.getDate();
     }
     
+    // Live excursion alerts from the data loggers, one banner per device/parameter.
+    // Polled rather than streamed so an open page holds no server thread; each
+    // poll asks for what was recorded since the previous one (the server
+    // repeats a few already seen, which are skipped by their timestamps).
+    const ALERT_POLL_MS = 15000;
+    
+    function subscribeToAlerts() {
+        const alertBanner = document.createElement('div');
+        alertBanner.className = 'excursion-alerts';
+        document.querySelector('.tracking-container').prepend(alertBanner);
+        
+        // Reading time of the newest event applied per device/parameter
+        const appliedAt = {};
+        let alertsSince = null;
+        
+        function applyAlert(alertEvent) {
+            const key = `${alertEvent.device_id}-${alertEvent.parameter}`;
+            const eventTime = Date.parse(alertEvent.timestamp);
+            if (appliedAt[key] !== undefined && eventTime <= appliedAt[key]) {
+                return;
+            }
+            appliedAt[key] = eventTime;
+            
+            let item = alertBanner.querySelector(`[data-alert-key="${CSS.escape(key)}"]`);
+            if (alertEvent.type === 'cleared') {
+                if (item) {
+                    item.remove();
+                }
+                return;
+            }
+            if (!item) {
+                item = document.createElement('div');
+                item.className = 'excursion-alert';
+                item.dataset.alertKey = key;
+                alertBanner.appendChild(item);
+            }
+            const [low, high] = alertEvent.range || [null, null];
+            const rangeText = alertEvent.range ? ` (range ${low ?? '−∞'} to ${high ?? '∞'})` : '';
+            item.textContent = `⚠️ ${alertEvent.device_id}: ${alertEvent.parameter} at ${alertEvent.value}${rangeText} since ${new Date(alertEvent.since).toLocaleTimeString()}`;
+        }
+        
+        async function pollAlerts() {
+            if (document.hidden) {
+                return;
+            }
+            try {
+                const url = alertsSince
+                    ? `/temperature-alerts?since=${encodeURIComponent(alertsSince)}`
+                    : '/temperature-alerts';
+                const response = await fetch(url);
+                const result = await response.json();
+                if (!result.success) {
+                    return;
+                }
+                result.alerts.forEach(applyAlert);
+                alertsSince = result.now;
+            } catch (error) {
+                console.error('Error polling excursion alerts:', error);
+            }
+        }
+        
+        pollAlerts();
+        setInterval(pollAlerts, ALERT_POLL_MS);
+        document.addEventListener('visibilitychange', pollAlerts);
+    }
+    
     // API calls
-    async function fetchTemperatureData(date) {
+    async function loadReferenceRanges() {
+        try {
+            const response = await fetch('/compliance-rules');
+            const result = await response.json();
+            if (!result.success) {
+                return;
+            }
+            for (const [parameter, range] of Object.entries(result.rules.ranges)) {
+                referenceRanges[parameter] = {
+                    min: range.low === null ? -Infinity : range.low,
+                    max: range.high === null ? Infinity : range.high
+                };
+            }
+        } catch (error) {
+            console.error('Error loading compliance rules:', error);
+        }
+    }
+    
+    async function fetchMonthTemperatureData(month) {
         try {
-            const response = await fetch(`/temperature-data?date=${date}`);
+            const response = await fetch(`/temperature-data?month=${month}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -0,0 +1,480 @@
+"""
+Data access helpers for the laboratory temperature tracker.
+
+Daily readings live in the `temperature_records` collection, one document per
+`date` (YYYY-MM-DD string, unique index). Routes in app.py call these helpers
+instead of querying the collection directly.
+
+Monthly compliance counts are kept precomputed in `temperature_rollups`, one
+document per month:
+
+    {
+        "_id": "YYYY-MM",
+        "total": 30, "compliant": 28,
+        "parameters": {"refrigerator": {"total": 30, "compliant": 29}, ...},
+        "version": 41,
+        "updated_at": datetime
+    }
+
+A single {"_id": "_version", "version": n} document in the same collection
+(outside every YYYY-MM range) is bumped by every rollup write, so readers can
+tell cheaply whether anything changed at all.
+
+Every save applies the difference between the old and new record with $inc,
+and rebuild_rollups() recomputes months from the raw records for backfills:
+    python temperature.py --rebuild-rollups [YYYY-MM YYYY-MM]
+"""
+
+import logging
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from metrics import MONGO_WRITE_SECONDS, record_mongo_write, timed
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Longest span a single range request may cover
+MAX_RANGE_DAYS = 400
+
+# Fields the calendar needs for each day
+RECORD_PROJECTION = {
+    '_id': 0,
+    'date': 1,
+    'refrigerator_temp': 1,
+    'freezer_temp': 1,
+    'ln2_level': 1,
+    'room_temp': 1,
+    'humidity': 1,
+    'corrective_action': 1,
+    'is_compliant': 1,
+    'compliance': 1,
+}
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string, raising ValueError with a readable message"""
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+
+def month_range(month):
+    """Return the (start_date, end_date) strings covering a YYYY-MM month"""
+    try:
+        first = datetime.strptime(month, '%Y-%m')
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid month '{month}', expected YYYY-MM")
+    next_month = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    last = next_month - timedelta(days=1)
+    return first.strftime(DATE_FORMAT), last.strftime(DATE_FORMAT)
+
+
+def validate_range(start_date, end_date, max_days=MAX_RANGE_DAYS):
+    """Check a date range is well formed, ordered and not longer than max_days"""
+    start = parse_date(start_date)
+    end = parse_date(end_date)
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+    if max_days is not None and (end - start).days + 1 > max_days:
+        raise ValueError(f"Date range is limited to {max_days} days")
+    return start_date, end_date
+
+
+def get_records_in_range(db, start_date, end_date):
+    """Return every daily record between two dates (inclusive), oldest first, in one indexed query"""
+    return list(db.temperature_records.find(
+        {'date': {'$gte': start_date, '$lte': end_date}},
+        RECORD_PROJECTION
+    ).sort('date', 1))
+
+
+# Fields every saved reading must carry
+REQUIRED_FIELDS = ['date', 'refrigerator_temp', 'freezer_temp', 'ln2_level', 'room_temp', 'humidity']
+
+# Most days accepted by one batch save
+MAX_BATCH_RECORDS = 62
+
+
+def validate_reading(data):
+    """Return an error message for a reading that cannot be saved, else None"""
+    if not isinstance(data, dict):
+        return 'Each reading must be an object'
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return f'Missing required field: {field}'
+    try:
+        parse_date(data['date'])
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def reading_update(data, now=None):
+    """Upsert document for one reading; created_at is only written on insert"""
+    now = now or datetime.now().isoformat()
+    return {
+        '$set': {
+            'refrigerator_temp': data['refrigerator_temp'],
+            'freezer_temp': data['freezer_temp'],
+            'ln2_level': data['ln2_level'],
+            'room_temp': data['room_temp'],
+            'humidity': data['humidity'],
+            'corrective_action': data.get('corrective_action', ''),
+            'is_compliant': data.get('is_compliant', False),
+            'compliance': data.get('compliance', {}),
+            'source': 'manual',
+            'rules_version': data.get('rules_version'),
+            'updated_at': now
+        },
+        '$setOnInsert': {'created_at': now}
+    }
+
+
+def save_reading(db, data):
+    """
+    Insert or update one day's reading in a single round trip and return the
+    document as it was before the save (None if the day was new).
+
+    Concurrent upserts of the same new date can collide on the unique index;
+    the server retries those itself, and the loser is retried once here as
+    an update in case it is not.
+    """
+    with timed(MONGO_WRITE_SECONDS, operation='temperature_records'):
+        try:
+            previous = db.temperature_records.find_one_and_update(
+                {'date': data['date']},
+                reading_update(data),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            previous = db.temperature_records.find_one_and_update(
+                {'date': data['date']},
+                reading_update(data),
+                return_document=ReturnDocument.BEFORE
+            )
+    record_mongo_write('temperature_records')
+    return previous
+
+
+def save_readings(db, readings):
+    """
+    Upsert several days in one unordered bulk write. Returns (inserted, updated)
+    counts. Later readings for a date repeated in the batch win.
+    """
+    by_date = {reading['date']: reading for reading in readings}
+    now = datetime.now().isoformat()
+    with timed(MONGO_WRITE_SECONDS, operation='temperature_records'):
+        result = db.temperature_records.bulk_write(
+            [UpdateOne({'date': date}, reading_update(reading, now), upsert=True) for date, reading in by_date.items()],
+            ordered=False
+        )
+    record_mongo_write('temperature_records', len(by_date))
+    return result.upserted_count, result.matched_count
+
+
+# Parameters tracked per day, in display order
+PARAMETERS = ['refrigerator', 'freezer', 'ln2', 'room', 'humidity']
+
+# Daily record field holding each parameter's reading
+PARAMETER_FIELDS = {
+    'refrigerator': 'refrigerator_temp',
+    'freezer': 'freezer_temp',
+    'ln2': 'ln2_level',
+    'room': 'room_temp',
+    'humidity': 'humidity',
+}
+
+# Acceptable (low, high) per parameter, inclusive. These are the defaults
+# until a version is published to compliance_rules (see compliance_rules.py).
+REFERENCE_RANGES = {
+    'refrigerator': (2, 8),
+    'freezer': (-30, -15),
+    'ln2': (60, 100),
+    'room': (20, 25),
+    'humidity': (30, 60),
+}
+
+# $date prefix length for each supported grouping
+GROUP_KEY_LENGTHS = {'month': 7, 'year': 4}
+
+
+def empty_counts():
+    return {
+        'total': 0,
+        'compliant': 0,
+        'parameters': {param: {'total': 0, 'compliant': 0} for param in PARAMETERS}
+    }
+
+
+def compliance_pipeline(start_date, end_date, group_by='month'):
+    """
+    Aggregation that counts compliant days and per-parameter compliance between
+    two dates, grouped by month, year, or over the whole range (group_by=None).
+    """
+    if group_by is None:
+        group_key = {'$literal': 'all'}
+    elif group_by in GROUP_KEY_LENGTHS:
+        group_key = {'$substrBytes': ['$date', 0, GROUP_KEY_LENGTHS[group_by]]}
+    else:
+        raise ValueError(f"Unsupported grouping: {group_by}")
+
+    return [
+        {'$match': {'date': {'$gte': start_date, '$lte': end_date}}},
+        {'$project': {
+            '_id': 0,
+            'period': group_key,
+            'is_compliant': 1,
+            'compliance': {'$objectToArray': {'$ifNull': ['$compliance', {}]}}
+        }},
+        {'$facet': {
+            'days': [
+                {'$group': {
+                    '_id': '$period',
+                    'total': {'$sum': 1},
+                    'compliant': {'$sum': {'$cond': ['$is_compliant', 1, 0]}}
+                }}
+            ],
+            'parameters': [
+                {'$unwind': '$compliance'},
+                {'$group': {
+                    '_id': {'period': '$period', 'parameter': '$compliance.k'},
+                    'total': {'$sum': 1},
+                    'compliant': {'$sum': {'$cond': ['$compliance.v', 1, 0]}}
+                }}
+            ]
+        }}
+    ]
+
+
+def aggregate_compliance(db, start_date, end_date, group_by='month'):
+    """
+    Run compliance_pipeline and return {period: counts} where counts has the
+    shape of empty_counts(). Only the counts cross the wire, never the records.
+    """
+    result = list(db.temperature_records.aggregate(compliance_pipeline(start_date, end_date, group_by)))
+    periods = {}
+    if not result:
+        return periods
+
+    for row in result[0]['days']:
+        counts = periods.setdefault(row['_id'], empty_counts())
+        counts['total'] = row['total']
+        counts['compliant'] = row['compliant']
+
+    for row in result[0]['parameters']:
+        param = row['_id']['parameter']
+        if param not in PARAMETERS:
+            continue
+        counts = periods.setdefault(row['_id']['period'], empty_counts())
+        counts['parameters'][param] = {'total': row['total'], 'compliant': row['compliant']}
+
+    return periods
+
+
+def percentage(compliant, total):
+    return round((compliant / total) * 100 if total > 0 else 0)
+
+
+def range_compliance(db, start_date, end_date):
+    """Compliance counts over a whole date range, as returned by /temperature-compliance"""
+    counts = empty_counts()
+    for month_counts in compliance_by_month(db, start_date, end_date).values():
+        add_counts(counts, month_counts)
+    return {
+        'total_days': counts['total'],
+        'compliant_days': counts['compliant'],
+        'parameters': counts['parameters']
+    }
+
+
+def format_period(period, counts):
+    """Shape one period's counts the way the yearly view expects, with percentages"""
+    return {
+        'month': period,
+        'total_days': counts['total'],
+        'compliant_days': counts['compliant'],
+        'compliance_percentage': percentage(counts['compliant'], counts['total']),
+        'parameters': {
+            param: {
+                'total': param_counts['total'],
+                'compliant': param_counts['compliant'],
+                'percentage': percentage(param_counts['compliant'], param_counts['total'])
+            }
+            for param, param_counts in counts['parameters'].items()
+        }
+    }
+
+
+def monthly_compliance(db, start_date, end_date):
+    """Per-month compliance between two dates, sorted by month"""
+    periods = compliance_by_month(db, start_date, end_date)
+    return [format_period(month, periods[month]) for month in sorted(periods)]
+
+
+# --- Monthly rollups ---
+
+def add_counts(total, counts, sign=1):
+    """Add (or with sign=-1, subtract) one set of counts into another in place"""
+    total['total'] += sign * counts['total']
+    total['compliant'] += sign * counts['compliant']
+    for param in PARAMETERS:
+        total['parameters'][param]['total'] += sign * counts['parameters'][param]['total']
+        total['parameters'][param]['compliant'] += sign * counts['parameters'][param]['compliant']
+    return total
+
+
+def record_counts(record):
+    """Counts contributed by a single daily record"""
+    counts = empty_counts()
+    if not record:
+        return counts
+    counts['total'] = 1
+    counts['compliant'] = 1 if record.get('is_compliant') else 0
+    for param, compliant in (record.get('compliance') or {}).items():
+        if param in PARAMETERS:
+            counts['parameters'][param] = {'total': 1, 'compliant': 1 if compliant else 0}
+    return counts
+
+
+def rollup_increments(old_record, new_record):
+    """$inc document that moves a month's rollup from old_record to new_record"""
+    delta = add_counts(record_counts(new_record), record_counts(old_record), sign=-1)
+    increments = {'total': delta['total'], 'compliant': delta['compliant']}
+    for param, param_delta in delta['parameters'].items():
+        increments[f'parameters.{param}.total'] = param_delta['total']
+        increments[f'parameters.{param}.compliant'] = param_delta['compliant']
+    return {field: value for field, value in increments.items() if value}
+
+
+# _id of the document counting rollup writes; sorts after every "YYYY-MM"
+ROLLUPS_VERSION_ID = '_version'
+
+
+def bump_rollups_version(db):
+    db.temperature_rollups.update_one({'_id': ROLLUPS_VERSION_ID}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def update_rollup(db, old_record, new_record):
+    """
+    Apply one saved record to its month's rollup. old_record is the document as
+    it was before the save (None for a new day). Both must be for the same date.
+    """
+    month = new_record['date'][:7]
+    increments = rollup_increments(old_record, new_record)
+    increments['version'] = 1
+    db.temperature_rollups.update_one(
+        {'_id': month},
+        {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+    bump_rollups_version(db)
+
+
+def _rollup_to_counts(rollup):
+    counts = empty_counts()
+    counts['total'] = rollup.get('total', 0)
+    counts['compliant'] = rollup.get('compliant', 0)
+    for param in PARAMETERS:
+        stored = rollup.get('parameters', {}).get(param, {})
+        counts['parameters'][param] = {'total': stored.get('total', 0), 'compliant': stored.get('compliant', 0)}
+    return counts
+
+
+def get_rollups(db, first_month, last_month):
+    """Return {month: counts} for stored rollups between two YYYY-MM months (inclusive)"""
+    rollups = db.temperature_rollups.find({'_id': {'$gte': first_month, '$lte': last_month}})
+    return {rollup['_id']: _rollup_to_counts(rollup) for rollup in rollups if rollup.get('total', 0) > 0}
+
+
+def split_range(start_date, end_date):
+    """
+    Split a date range into (head, months, tail): the partial month ranges at
+    either end as (start, end) tuples or None, and the whole months in between
+    as a (first_month, last_month) tuple or None.
+    """
+    start = parse_date(start_date)
+    end = parse_date(end_date)
+    first_full = start if start.day == 1 else (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    after_end = end + timedelta(days=1)
+    last_full_end = end if after_end.day == 1 else end.replace(day=1) - timedelta(days=1)
+
+    if first_full > last_full_end:
+        return (start_date, end_date), None, None
+
+    head = None
+    if first_full > start:
+        head = (start_date, (first_full - timedelta(days=1)).strftime(DATE_FORMAT))
+    tail = None
+    if last_full_end < end:
+        tail = ((last_full_end + timedelta(days=1)).strftime(DATE_FORMAT), end_date)
+    return head, (first_full.strftime('%Y-%m'), last_full_end.strftime('%Y-%m')), tail
+
+
+def compliance_by_month(db, start_date, end_date):
+    """
+    Return {month: counts} between two dates. Whole months come from
+    temperature_rollups; partial months at either end are aggregated from the
+    raw records.
+    """
+    head, months, tail = split_range(start_date, end_date)
+    periods = {}
+    if months:
+        periods.update(get_rollups(db, *months))
+    for partial in (head, tail):
+        if partial:
+            periods.update(aggregate_compliance(db, partial[0], partial[1], group_by='month'))
+    return periods
+
+
+def rebuild_rollups(db, first_month=None, last_month=None):
+    """
+    Recompute rollups from temperature_records, for every month or for the
+    months between first_month and last_month (YYYY-MM, inclusive). Months
+    with no records left have their rollup removed. Returns the number of
+    months written.
+    """
+    start_date = month_range(first_month)[0] if first_month else '0000-01-01'
+    end_date = month_range(last_month)[1] if last_month else '9999-12-31'
+    periods = aggregate_compliance(db, start_date, end_date, group_by='month')
+
+    now = datetime.utcnow()
+    for month, counts in periods.items():
+        db.temperature_rollups.update_one(
+            {'_id': month},
+            {
+                '$set': {
+                    'total': counts['total'],
+                    'compliant': counts['compliant'],
+                    'parameters': counts['parameters'],
+                    'updated_at': now
+                },
+                '$inc': {'version': 1}
+            },
+            upsert=True
+        )
+
+    stale = {'_id': {'$gte': start_date[:7], '$lte': end_date[:7], '$nin': list(periods)}}
+    removed = db.temperature_rollups.delete_many(stale).deleted_count
+    bump_rollups_version(db)
+    logger.info(f"Rebuilt {len(periods)} temperature rollups, removed {removed} empty months")
+    return len(periods)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if '--rebuild-rollups' not in sys.argv:
+        print("Usage: python temperature.py --rebuild-rollups [FIRST_MONTH LAST_MONTH]")
+        sys.exit(1)
+
+    from database import db
+
+    months = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    written = rebuild_rollups(db, *months[:2])
+    print(f"Rebuilt {written} monthly rollups")
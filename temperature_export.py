@@ -0,0 +1,254 @@
+"""
+Streaming exports of temperature records.
+
+Records are read from a date-sorted cursor and serialized a chunk at a time,
+so memory stays flat however long the range is and the first bytes go out as
+soon as the first batch arrives. Formats:
+
+    csv      the spreadsheet layout the tracker has always exported
+    ndjson   one JSON object per line, for scripts and bulk analytics
+    parquet  columnar, one row group per batch; needs the optional `pyarrow`
+
+Text formats can be wrapped in gzip_stream() for Content-Encoding: gzip.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Documents fetched per round trip, and rows serialized per yielded chunk
+CURSOR_BATCH_SIZE = 500
+ROWS_PER_CHUNK = 200
+
+EXPORT_PROJECTION = {
+    '_id': 0,
+    'date': 1,
+    'refrigerator_temp': 1,
+    'freezer_temp': 1,
+    'ln2_level': 1,
+    'room_temp': 1,
+    'humidity': 1,
+    'corrective_action': 1,
+    'is_compliant': 1,
+    'compliance': 1,
+    'created_at': 1,
+    'updated_at': 1,
+}
+
+CSV_HEADER = [
+    'Date',
+    'Refrigerator Temp (°C)',
+    'Refrigerator Compliant',
+    'Freezer Temp (°C)',
+    'Freezer Compliant',
+    'LN2 Level (%)',
+    'LN2 Compliant',
+    'Room Temp (°C)',
+    'Room Compliant',
+    'Humidity (%)',
+    'Humidity Compliant',
+    'Overall Compliance',
+    'Corrective Action'
+]
+
+# Flat column -> record getter, shared by NDJSON and Parquet
+FLAT_COLUMNS = {
+    'date': lambda r: r.get('date'),
+    'refrigerator_temp': lambda r: _number(r.get('refrigerator_temp')),
+    'refrigerator_compliant': lambda r: _compliant(r, 'refrigerator'),
+    'freezer_temp': lambda r: _number(r.get('freezer_temp')),
+    'freezer_compliant': lambda r: _compliant(r, 'freezer'),
+    'ln2_level': lambda r: _number(r.get('ln2_level')),
+    'ln2_compliant': lambda r: _compliant(r, 'ln2'),
+    'room_temp': lambda r: _number(r.get('room_temp')),
+    'room_compliant': lambda r: _compliant(r, 'room'),
+    'humidity': lambda r: _number(r.get('humidity')),
+    'humidity_compliant': lambda r: _compliant(r, 'humidity'),
+    'is_compliant': lambda r: bool(r.get('is_compliant', False)),
+    'corrective_action': lambda r: r.get('corrective_action', ''),
+    'created_at': lambda r: _text(r.get('created_at')),
+    'updated_at': lambda r: _text(r.get('updated_at')),
+}
+
+EXPORT_FORMATS = {
+    'csv': {'mimetype': 'text/csv', 'extension': 'csv', 'compressible': True},
+    'ndjson': {'mimetype': 'application/x-ndjson', 'extension': 'ndjson', 'compressible': True},
+    # Parquet pages are already compressed
+    'parquet': {'mimetype': 'application/vnd.apache.parquet', 'extension': 'parquet', 'compressible': False},
+}
+
+
+def _number(value):
+    """Readings arrive from the form as numbers or numeric strings"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compliant(record, parameter):
+    return bool((record.get('compliance') or {}).get(parameter, False))
+
+
+def _text(value):
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _yes_no(value):
+    return 'Yes' if value else 'No'
+
+
+def available_formats():
+    """Formats that can be produced with the installed packages"""
+    return [name for name in EXPORT_FORMATS if name != 'parquet' or pyarrow is not None]
+
+
+def open_export_cursor(db, start_date, end_date):
+    """Date-ordered cursor over the range, fetched in CURSOR_BATCH_SIZE batches"""
+    return db.temperature_records.find(
+        {'date': {'$gte': start_date, '$lte': end_date}},
+        EXPORT_PROJECTION
+    ).sort('date', 1).batch_size(CURSOR_BATCH_SIZE)
+
+
+def _chunked(records, size=ROWS_PER_CHUNK):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(records):
+    """Yield the CSV export as UTF-8 byte chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for chunk in _chunked(records):
+        for record in chunk:
+            writer.writerow([
+                record.get('date'),
+                record.get('refrigerator_temp'),
+                _yes_no(_compliant(record, 'refrigerator')),
+                record.get('freezer_temp'),
+                _yes_no(_compliant(record, 'freezer')),
+                record.get('ln2_level'),
+                _yes_no(_compliant(record, 'ln2')),
+                record.get('room_temp'),
+                _yes_no(_compliant(record, 'room')),
+                record.get('humidity'),
+                _yes_no(_compliant(record, 'humidity')),
+                _yes_no(record.get('is_compliant', False)),
+                record.get('corrective_action', '')
+            ])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when the range turned out to be empty
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(records):
+    """Yield one flat JSON object per line, as UTF-8 byte chunks"""
+    for chunk in _chunked(records):
+        lines = [
+            json.dumps({column: getter(record) for column, getter in FLAT_COLUMNS.items()}, ensure_ascii=False)
+            for record in chunk
+        ]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_parquet(records, rows_per_group=CURSOR_BATCH_SIZE):
+    """Yield a Parquet file with one row group per batch of records"""
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires the pyarrow package")
+
+    schema = pyarrow.schema([
+        ('date', pyarrow.string()),
+        ('refrigerator_temp', pyarrow.float64()),
+        ('refrigerator_compliant', pyarrow.bool_()),
+        ('freezer_temp', pyarrow.float64()),
+        ('freezer_compliant', pyarrow.bool_()),
+        ('ln2_level', pyarrow.float64()),
+        ('ln2_compliant', pyarrow.bool_()),
+        ('room_temp', pyarrow.float64()),
+        ('room_compliant', pyarrow.bool_()),
+        ('humidity', pyarrow.float64()),
+        ('humidity_compliant', pyarrow.bool_()),
+        ('is_compliant', pyarrow.bool_()),
+        ('corrective_action', pyarrow.string()),
+        ('created_at', pyarrow.string()),
+        ('updated_at', pyarrow.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for chunk in _chunked(records, rows_per_group):
+            columns = {column: [getter(record) for record in chunk] for column, getter in FLAT_COLUMNS.items()}
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+SERIALIZERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+    'parquet': iter_parquet,
+}
+
+
+def export_stream(records, export_format='csv', gzip=False):
+    """Byte chunks for records in the given format, optionally gzipped"""
+    chunks = SERIALIZERS[export_format](records)
+    if gzip and EXPORT_FORMATS[export_format]['compressible']:
+        chunks = gzip_stream(chunks)
+    return chunks
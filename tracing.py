@@ -0,0 +1,260 @@
+"""
+Lightweight request tracing for Auragens AI.
+
+A trace is a tree of timed spans for one unit of work, e.g. a /chat request:
+
+    chat
+    ├── load_conversation
+    ├── semantic_search
+    │   ├── generate_embedding
+    │   └── vector_search
+    ├── get_ai_response
+    │   ├── llm.groq          (status=error)
+    │   └── llm.claude
+    ├── record_turn
+    └── save_chat
+
+The current span lives in a contextvar, so functions anywhere in the call
+stack open child spans with `with span('name'):` or `@traced('name')`
+without passing anything around. Outside a trace (CLI scripts, background
+threads) span() does nothing.
+
+Every trace records its spans in memory; only the sampled ones are exported.
+A trace is exported when it was picked at random with TRACE_SAMPLE_RATE, or
+when it ran longer than TRACE_SLOW_SECONDS, so slow requests always leave a
+breakdown. Exported traces are appended to TRACE_FILE as one JSON object per
+line:
+
+    {"trace_id": "...", "span_id": "...", "name": "chat", "start": "2024-05-01T12:00:00.123+00:00",
+     "duration_ms": 2310.4, "sampled": "slow", "attributes": {...},
+     "spans": [{"span_id": "...", "parent_id": "...", "name": "llm.groq",
+                "offset_ms": 412.0, "duration_ms": 1800.2, "status": "ok", "attributes": {...}}]}
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+# Traces at least this long are exported regardless of the sample rate (0 disables)
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '10'))
+TRACE_FILE = os.getenv('TRACE_FILE', '/tmp/auragens_traces.jsonl')
+# The trace file is rotated to TRACE_FILE.1 once it grows past this size
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(50 * 1024 * 1024)))
+# Spans kept per trace; a runaway loop cannot grow a trace without bound
+MAX_SPANS_PER_TRACE = 500
+
+_current = ContextVar('auragens_current_span', default=None)
+
+
+class Span:
+    """One timed operation; children share the root's trace"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'started', 'duration', 'status', 'error')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.started = perf_counter()
+        self.duration = None
+        self.status = 'ok'
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        self.duration = perf_counter() - self.started
+        if error is not None:
+            self.status = 'error'
+            self.error = f"{type(error).__name__}: {error}"[:200]
+
+    def children(self):
+        return [child for child in self.trace.spans if child.parent_id == self.span_id]
+
+    def breakdown(self):
+        """'name 0.123s, name 1.456s' for the direct children, in start order"""
+        return ', '.join(f"{child.name} {child.duration or 0:.3f}s" for child in self.children())
+
+    def to_dict(self):
+        data = {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'offset_ms': round((self.started - self.trace.root.started) * 1000, 2),
+            'duration_ms': round((self.duration or 0) * 1000, 2),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class Trace:
+    """The spans of one unit of work; the first span is the root"""
+
+    def __init__(self, name, attributes=None, sampled=False):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = datetime.now(timezone.utc)
+        self.sampled = sampled
+        self.spans = []
+        self.dropped_spans = 0
+        self.root = self.add(name, None, attributes)
+
+    def add(self, name, parent_id, attributes=None):
+        span = Span(self, name, parent_id, attributes)
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+        return span
+
+    def to_dict(self, reason):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.root.span_id,
+            'name': self.root.name,
+            'start': self.started_at.isoformat(),
+            'duration_ms': round((self.root.duration or 0) * 1000, 2),
+            'status': self.root.status,
+            'sampled': reason,
+            'attributes': self.root.attributes,
+            'spans': [span.to_dict() for span in self.spans[1:]],
+            'dropped_spans': self.dropped_spans,
+        }
+
+
+class JSONFileExporter:
+    """Append finished traces to a JSON-lines file, rotating it when it grows too large"""
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, trace_dict):
+        line = json.dumps(trace_dict, default=str) + '\n'
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'a') as trace_file:
+                    trace_file.write(line)
+            except OSError as e:
+                logger.error(f"Could not write trace to {self.path}: {str(e)}")
+
+
+class MemoryExporter:
+    """Test stub: keeps exported traces in a list"""
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace_dict):
+        self.traces.append(trace_dict)
+
+
+class Tracer:
+    """Starts traces, decides which are exported and hands them to the exporter"""
+
+    def __init__(self, exporter, sample_rate=TRACE_SAMPLE_RATE, slow_seconds=TRACE_SLOW_SECONDS):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.stats = {'traces': 0, 'exported': 0}
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """Root span for one unit of work; nested inside another trace it is just a child span"""
+        if _current.get() is not None:
+            with span(name, **attributes) as child:
+                yield child
+            return
+
+        trace = Trace(name, attributes, sampled=random.random() < self.sample_rate)
+        token = _current.set(trace.root)
+        error = None
+        try:
+            yield trace.root
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            trace.root.finish(error)
+            self.stats['traces'] += 1
+            self._maybe_export(trace)
+
+    def _maybe_export(self, trace):
+        if trace.sampled:
+            reason = 'rate'
+        elif self.slow_seconds and trace.root.duration >= self.slow_seconds:
+            reason = 'slow'
+        else:
+            return
+        try:
+            self.exporter.export(trace.to_dict(reason))
+            self.stats['exported'] += 1
+        except Exception as e:
+            logger.error(f"Error exporting trace {trace.trace_id}: {str(e)}")
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child of the current span; yields None when no trace is active"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.add(name, parent.span_id, attributes)
+    token = _current.set(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        child.finish(error)
+
+
+def traced(name=None):
+    """Decorator form of span(), named after the function by default"""
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_attribute(key, value):
+    """Annotate the current span, if any"""
+    current = _current.get()
+    if current is not None:
+        current.set(key, value)
+
+
+tracer = Tracer(JSONFileExporter())